@@ -0,0 +1,33 @@
+"""pytest-benchmark suite for the verification pipeline stages
+
+    pip install pytest pytest-benchmark
+    python -m pytest benchmarks --benchmark-json=bench.json
+
+Runs against the stub model by default; set BENCH_MODEL=deepface (or a
+dotted path) to time real models. DB writes go to a throwaway test database.
+"""
+import os
+import sys
+from pathlib import Path
+
+import django
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'land_registration.settings')
+django.setup()
+
+
+@pytest.fixture(scope='session')
+def test_database():
+    from django.test.utils import (
+        setup_databases,
+        setup_test_environment,
+        teardown_databases,
+        teardown_test_environment,
+    )
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    yield
+    teardown_databases(old_config, verbosity=0)
+    teardown_test_environment()
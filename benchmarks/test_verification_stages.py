@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from verification.benchmarking import DEFAULT_SIZES, STAGES, WrittenRows, load_model, peak_rss_mb, percentiles, stage_callables
+
+
+@pytest.fixture(scope='session')
+def model():
+    return load_model(os.environ.get('BENCH_MODEL', 'stub'))
+
+
+@pytest.fixture(scope='module', params=DEFAULT_SIZES, ids=lambda size: f"{size[0]}x{size[1]}")
+def stages(request, model, test_database):
+    rows = WrittenRows()
+    yield stage_callables(model, *request.param, cleanup=rows)
+    rows.delete()
+
+
+@pytest.mark.parametrize('stage', STAGES)
+def test_stage(benchmark, stages, stage):
+    # One group per stage, so the report compares image sizes side by side
+    benchmark.group = stage
+    benchmark(stages[stage])
+    # No stats are collected under --benchmark-disable; the stage still ran once
+    if benchmark.stats is not None:
+        benchmark.extra_info.update(percentiles(benchmark.stats.stats.data))
+    benchmark.extra_info['peak_rss_mb'] = peak_rss_mb()
@@ -0,0 +1,55 @@
+"""Gunicorn configuration with a shared face inference pool
+
+    gunicorn -c gunicorn.conf.py land_registration.wsgi
+
+The master starts one inference pool whose processes, sized to the CPU
+cores, each build their own copy of the face models after being forked
+(TensorFlow is not fork-safe, so the weights are not shared between
+them). Web workers only handle HTTP and send detection and embedding to
+the pool over a unix socket, so their number is set by HTTP concurrency
+rather than by model memory.
+"""
+import os
+import shutil
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'land_registration.settings')
+# Web and inference workers share their metrics through this directory
+os.environ.setdefault(
+    'METRICS_MULTIPROCESS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'metrics')
+)
+os.environ.setdefault('FACE_INFERENCE_POOL', '1')
+# With preload_app the app is imported in the master; warm-up runs per worker in post_fork
+os.environ['FACE_WARMUP_AFTER_FORK'] = '1'
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = 120
+preload_app = True
+
+
+def on_starting(server):
+    # Files of a previous run would be summed into this one's counters
+    shutil.rmtree(os.environ['METRICS_MULTIPROCESS_DIR'], ignore_errors=True)
+
+    import django
+    django.setup()
+
+    from django.conf import settings
+    if settings.INFERENCE_POOL.get('enabled', False):
+        from verification.inference_pool import start_pool
+        server.inference_pool = start_pool()
+
+
+def post_fork(server, worker):
+    # Only does anything with FACE_INFERENCE_POOL=0, when workers load the models themselves
+    from verification.apps import start_warmup
+    start_warmup()
+
+
+def on_exit(server):
+    pool = getattr(server, 'inference_pool', None)
+    if pool is not None and pool.is_alive():
+        pool.terminate()
+        pool.join(30)
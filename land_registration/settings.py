@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'verification.middleware.request_metrics_middleware',
+    'verification.middleware.request_profiling_middleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -143,6 +145,100 @@ AI_MODELS = {
     'nlp_confidence_threshold': 0.7,
 }
 
+# Face verification settings
+FACE_VERIFICATION = {
+    'model_name': 'Facenet',
+    'detector_backend': 'retinaface',  # Used when detector_cascade is empty
+    # Detectors tried in order; a stage's faces are used only if every face
+    # meets its thresholds, otherwise the next stage runs. The last stage is
+    # always accepted.
+    'detector_cascade': [
+        {'backend': 'opencv', 'min_confidence': 0.9, 'require_landmarks': True},
+        {'backend': 'retinaface'},
+    ],
+    'distance_metric': 'cosine',
+    'warmup_on_startup': True,  # Build and warm the models when the app loads
+    'warmup_in_background': True,  # Keep worker boot fast; readiness reports progress
+    'retain_verification_images': False,  # Write verified images to UPLOAD_FOLDER for audit
+    'normalize_embeddings': False,  # Store FaceEmbedding vectors L2-normalized
+    'embedding_encoding': 'float32',  # Or 'float16' / 'int8' (per-vector scale) to shrink stored vectors
+    'embedding_batch_size': 32,  # Faces per embedding forward pass
+    'batch_chunk_size': 32,  # Pairs per chunk in /api/verify/batch/
+    'detection_max_side': 1280,  # Detect on a copy downscaled to this; None for full resolution
+    'async_inference_workers': 4,  # Concurrent verifications in the async (ASGI) views
+}
+
+# 1:N identification index
+FACE_INDEX = {
+    # 'verification.vector_index.EmbeddingIndex' for exact search, or
+    # 'verification.vector_index.IVFIndex' for approximate search on large tables
+    'backend': 'verification.vector_index.EmbeddingIndex',
+    # e.g. {'nlist': 1024, 'nprobe': 16} for IVFIndex. 'quantization': 'float16'
+    # or 'int8' holds the in-memory vectors at half or a quarter of the size;
+    # the best k * rerank_factor candidates are then re-scored against the
+    # stored vectors (`manage.py quantization_report` measures the loss).
+    # IVFIndex clusters on a background thread; 'background': False does it
+    # inside sync() instead. Each sync also loads rows created in the last
+    # 'overlap_seconds' (60) that a slower transaction committed behind the id
+    # cursor, and every 'reconcile_interval' (60) seconds rows deleted by
+    # other processes are dropped
+    'options': {},
+    'sync_interval': 1.0,  # Seconds between incremental syncs with FaceEmbedding
+    'max_top_k': 100,
+}
+
+# Face embedding cache: in-process LRU backed by a directory shared by all workers
+EMBEDDING_CACHE = {
+    'enabled': True,
+    'max_entries': 1024,
+    'directory': BASE_DIR / 'cache' / 'embeddings',
+    'max_disk_bytes': 512 * 1024 * 1024,  # Least recently used files are deleted beyond this; None for no limit
+    'prune_interval': 256,  # Writes per process between checks of the directory size
+}
+
+# Micro-batching of concurrent embedding requests within a process. Off by
+# default: every request then waits up to max_wait_ms, which only pays off
+# when several requests embed at once
+INFERENCE_SCHEDULER = {
+    'enabled': False,
+    'max_wait_ms': 5,  # How long the first request in a batch waits for company
+    'max_batch_size': 32,  # Dispatch as soon as this many faces are waiting
+}
+
+# Write-behind buffering of verification audit rows (verification/audit_buffer.py).
+# When enabled, verify responses return before the FaceEmbedding and
+# VerificationRecord are written, so verification_id is null.
+AUDIT_WRITE_BEHIND = {
+    'enabled': False,
+    'max_rows': 100,  # Flush as soon as this many attempts are buffered
+    'flush_interval': 1.0,  # Seconds the oldest buffered attempt may wait
+    'journal': False,  # Append each attempt to a local journal first, so a crash loses no rows
+    # Also holds dead-letter.jsonl, where attempts the database rejects are kept
+    'journal_dir': BASE_DIR / 'cache' / 'audit-journal',
+}
+
+# Pre-fork inference pool (gunicorn.conf.py or `manage.py run_inference_pool`).
+# When enabled, web workers send detection and embedding to the pool over a
+# unix socket instead of loading the models themselves.
+INFERENCE_POOL = {
+    'enabled': os.environ.get('FACE_INFERENCE_POOL') == '1',
+    'address': BASE_DIR / 'cache' / 'inference.sock',
+    'processes': None,  # Default: CPU cores // intra_op_threads
+    'intra_op_threads': 2,  # TensorFlow threads per inference process
+    'threads_per_process': 4,  # Concurrent requests per process, micro-batched together
+    'timeout': 60,  # Seconds a web worker waits for a result
+}
+
+# Asynchronous verification jobs (POST /api/verify/?async=1), stored in the
+# database and processed by `manage.py run_verification_workers`
+VERIFICATION_JOBS = {
+    'processes': 2,  # Default worker process count
+    'poll_interval': 0.5,  # Seconds an idle worker waits before polling again
+    'stale_after': 300,  # Seconds without a worker heartbeat before a running job is considered abandoned
+    'heartbeat_interval': 30,  # Seconds between heartbeats of a running job
+    'max_attempts': 3,  # Abandoned jobs are retried until this many attempts
+}
+
 # File upload settings
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
 ALLOWED_DOCUMENT_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.pdf', '.tiff', '.bmp']
@@ -155,6 +251,59 @@ CAPTURES_FOLDER = BASE_DIR / 'static' / 'captures'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(CAPTURES_FOLDER, exist_ok=True)
 
+# Content-addressed storage for captures and uploads (verification/storage.py)
+BLOB_STORAGE = {
+    'stores': {
+        'captures': CAPTURES_FOLDER,
+        'uploads': UPLOAD_FOLDER,
+    },
+    'shard_depth': 2,  # Nested directory levels of two hex characters each
+}
+
+# Defaults for `manage.py purge_verification_data`; None disables a policy
+DATA_RETENTION = {
+    'max_age_days': None,  # Purge records, finished jobs, embeddings and stored files not used for this long
+    'max_records': None,  # Keep only this many of the newest VerificationRecords
+    'max_embeddings': None,  # Keep only this many of the newest unreferenced FaceEmbeddings
+    'chunk_size': 1000,  # Rows per DELETE statement
+    'file_workers': 8,  # Threads removing files
+    'sweep_orphans': False,  # Also delete unreferenced blob-store files (--orphans)
+    'orphan_grace_seconds': 3600,  # Leave unreferenced files younger than this alone
+    # Delete captures and uploads from before the blob store once unmodified
+    # for this many days and unreferenced (--legacy-max-age-days); None keeps them
+    'legacy_max_age_days': None,
+}
+
+# In-process metrics served at /metrics in the Prometheus text format
+METRICS = {
+    'enabled': True,  # Also times every request; False turns /metrics into a 404
+    # Only scrapes from these addresses are answered. This is the direct peer:
+    # behind a reverse proxy on the same host it is the proxy for every client,
+    # so forwarded requests are refused and the proxy must not expose /metrics
+    'allowed_ips': ['127.0.0.1', '::1'],
+    # Each process writes its values here and /metrics sums them, so a scrape
+    # covers every gunicorn, inference pool and job worker; None reports only
+    # the process that answers the scrape
+    'multiprocess_dir': os.environ.get('METRICS_MULTIPROCESS_DIR'),
+    'write_interval': 1.0,  # Seconds between a process's writes while its values change
+}
+
+# On-demand request profiling (verification/profiling.py), listed at
+# /admin/verification/profiles/. Costs nothing while disabled; when enabled,
+# untriggered requests only pay a header lookup and a random draw.
+REQUEST_PROFILING = {
+    'enabled': os.environ.get('REQUEST_PROFILING') == '1',
+    'sample_rate': 0.0,  # Fraction of requests profiled at random
+    'header': 'X-Profile-Request',  # Profiles any request whose value equals the token
+    'token': os.environ.get('REQUEST_PROFILING_TOKEN'),  # The header is ignored while unset
+    'cprofile': True,
+    'tracemalloc': True,
+    'tracemalloc_frames': 1,  # Traceback depth kept per allocation
+    'top_allocations': 25,  # Allocation sites recorded per profile
+    'directory': BASE_DIR / 'cache' / 'profiles',
+    'max_profiles': 100,  # Oldest profiles are deleted beyond this
+}
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
@@ -18,8 +18,10 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from verification.admin import profile_urlpatterns
 
 urlpatterns = [
+    path('admin/verification/profiles/', include(profile_urlpatterns)),
     path('admin/', admin.site.urls),
     path('', include('verification.urls')),
     # path('api/document-verification/', include('document_verification.urls')),
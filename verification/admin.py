@@ -1,10 +1,14 @@
 from django.contrib import admin
-from .models import FaceEmbedding, VerificationRecord
+from django.http import FileResponse, Http404
+from django.template.response import TemplateResponse
+from django.urls import path
+from .models import FaceEmbedding, VerificationRecord, VerificationJob, StoredBlob
+from .profiling import PROFILE_ID, get_profile_store
 
 @admin.register(FaceEmbedding)
 class FaceEmbeddingAdmin(admin.ModelAdmin):
-    list_display = ('id', 'created_at', 'updated_at')
-    list_filter = ('created_at', 'updated_at')
+    list_display = ('id', 'model_name', 'dimension', 'is_normalized', 'created_at', 'updated_at')
+    list_filter = ('model_name', 'created_at', 'updated_at')
     readonly_fields = ('created_at', 'updated_at')
     search_fields = ('id',)
 
@@ -14,3 +18,58 @@ class VerificationRecordAdmin(admin.ModelAdmin):
     list_filter = ('is_verified', 'verification_date')
     readonly_fields = ('verification_date',)
     search_fields = ('id', 'known_image_path', 'new_image_path')
+
+@admin.register(VerificationJob)
+class VerificationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'attempts', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+    exclude = ('known_image', 'new_image')
+    search_fields = ('id', 'worker')
+
+@admin.register(StoredBlob)
+class StoredBlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'store', 'size', 'ref_count', 'created_at')
+    list_filter = ('store', 'created_at')
+    readonly_fields = ('created_at',)
+    search_fields = ('sha256', 'name')
+
+def profile_list(request):
+    """Admin page listing the stored request profiles, newest first"""
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Request profiles',
+        'profiles': get_profile_store().list(),
+    }
+    return TemplateResponse(request, 'admin/verification/profile_list.html', context)
+
+def profile_detail(request, profile_id):
+    """Admin page showing one profile's metadata, allocation sites and cProfile output"""
+    store = get_profile_store()
+    profile = store.get(profile_id) if PROFILE_ID.match(profile_id) else None
+    if profile is None:
+        raise Http404("Profile not found")
+    context = {
+        **admin.site.each_context(request),
+        'title': f"Request profile {profile_id}",
+        'profile': profile,
+        'stats': store.read_text(profile_id),
+    }
+    return TemplateResponse(request, 'admin/verification/profile_detail.html', context)
+
+def profile_download(request, profile_id):
+    """Download a profile's pstats dump"""
+    if not PROFILE_ID.match(profile_id):
+        raise Http404("Profile not found")
+    try:
+        return FileResponse(open(get_profile_store().path(profile_id, '.prof'), 'rb'),
+                            as_attachment=True, filename=f"{profile_id}.prof")
+    except FileNotFoundError:
+        raise Http404("Profile not found")
+
+# Mounted under admin/ in the root URLconf, staff only
+profile_urlpatterns = [
+    path('', admin.site.admin_view(profile_list), name='verification_profile_list'),
+    path('<str:profile_id>/', admin.site.admin_view(profile_detail), name='verification_profile_detail'),
+    path('<str:profile_id>/download/', admin.site.admin_view(profile_download), name='verification_profile_download'),
+]
@@ -1,120 +1,212 @@
-from rest_framework.decorators import api_view, parser_classes
+from rest_framework.decorators import (
+    api_view,
+    parser_classes,
+    renderer_classes,
+    authentication_classes,
+    permission_classes
+)
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 from rest_framework import status
 from django.conf import settings
-import os
 import json
-import base64
-import uuid
-from datetime import datetime
-from .utils import verify_owner, get_face_embedding
-from .models import FaceEmbedding, VerificationRecord
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from .services import (
+    verify_and_record,
+    identify_face,
+    verify_batch,
+    verification_records_queryset,
+    records_page,
+    get_face_embedding,
+    embedding_validators,
+    set_embedding_validators,
+    store_capture,
+    store_upload
+)
+from .jobs import enqueue_verification
+from .parsers import NDJSONParser, ImageMultiPartParser
+from .renderers import PackedEmbeddingJSONRenderer, EmbeddingOctetStreamRenderer
+from .imaging import decode_base64_image
+from .model_registry import registry
+from .inference_pool import get_inference_client
+from .embedding_cache import get_embedding_cache
+from .scheduler import get_inference_scheduler
+from .audit_buffer import get_audit_buffer
+from .models import VerificationJob
 from .serializers import (
     ImageUploadSerializer, 
+    ImageFileSerializer,
     FaceVerificationSerializer, 
+    FaceVerificationUploadSerializer,
+    FaceIdentificationSerializer,
     FileUploadSerializer,
     FaceEmbeddingSerializer,
-    VerificationRecordSerializer
+    PackedFaceEmbeddingSerializer,
+    LegacyFaceEmbeddingSerializer,
+    VerificationRecordSerializer,
+    VerificationRecordExpandedSerializer,
+    VerificationRecordQuerySerializer,
+    VerificationJobSerializer
 )
 
+def _image_bytes(value):
+    """Return the bytes of an image field: a multipart file or a base64 string"""
+    if isinstance(value, str):
+        return decode_base64_image(value)
+    return value.read()
+
 @api_view(['POST'])
-@parser_classes([JSONParser])
+@parser_classes([JSONParser, ImageMultiPartParser])
 def capture_image_api(request):
-    """API endpoint for image capture from camera"""
-    serializer = ImageUploadSerializer(data=request.data)
+    """API endpoint for image capture from camera
+    
+    Accepts JSON with a base64 image or multipart with a binary image part.
+    """
+    if request.content_type.startswith('multipart/'):
+        serializer = ImageFileSerializer(data=request.data)
+    else:
+        serializer = ImageUploadSerializer(data=request.data)
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        image_data = serializer.validated_data['image']
-        
-        # Remove data URL prefix
-        if image_data.startswith('data:image'):
-            image_data = image_data.split(',')[1]
-        
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        
-        # Generate unique filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"capture_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
-        filepath = os.path.join(settings.CAPTURES_FOLDER, filename)
+        image_bytes = _image_bytes(serializer.validated_data['image'])
         
-        # Save image
-        with open(filepath, 'wb') as f:
-            f.write(image_bytes)
-        
-        return Response({
-            'success': True,
-            'filename': filename,
-            'filepath': filepath
-        })
+        # Identical captures (e.g. a kiosk retry) share one stored file
+        return Response({'success': True, **store_capture(image_bytes)})
     
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
-@parser_classes([JSONParser])
+@parser_classes([JSONParser, ImageMultiPartParser])
 def verify_faces_api(request):
-    """API endpoint for face verification"""
-    serializer = FaceVerificationSerializer(data=request.data)
+    """API endpoint for face verification
+    
+    Accepts JSON with base64 known_image / new_image strings or multipart
+    with binary known_image / new_image parts. With ?async=1 the pair is
+    queued for the worker pool and the response is 202 with a job id to
+    poll at /api/jobs/<id>/.
+    """
+    if request.content_type.startswith('multipart/'):
+        serializer = FaceVerificationUploadSerializer(data=request.data)
+    else:
+        serializer = FaceVerificationSerializer(data=request.data)
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        known_image = serializer.validated_data['known_image']
-        new_image = serializer.validated_data['new_image']
-        
-        # Save uploaded images temporarily
-        known_path = os.path.join(settings.UPLOAD_FOLDER, 'known_temp.jpg')
-        new_path = os.path.join(settings.UPLOAD_FOLDER, 'new_temp.jpg')
-        
-        # Decode and save known image
-        if known_image.startswith('data:image'):
-            known_image = known_image.split(',')[1]
-        with open(known_path, 'wb') as f:
-            f.write(base64.b64decode(known_image))
+        # Both images stay in memory; nothing is written to disk
+        known_bytes = _image_bytes(serializer.validated_data['known_image'])
+        new_bytes = _image_bytes(serializer.validated_data['new_image'])
         
-        # Decode and save new image
-        if new_image.startswith('data:image'):
-            new_image = new_image.split(',')[1]
-        with open(new_path, 'wb') as f:
-            f.write(base64.b64decode(new_image))
-        
-        # Perform verification
-        is_verified = verify_owner(known_path, new_path)
-        
-        # Get face embedding if verified
-        embedding = None
-        embedding_obj = None
-        if is_verified:
-            embedding = get_face_embedding(new_path)
-            if embedding:
-                # Save embedding to database
-                embedding_obj = FaceEmbedding.objects.create(embedding_data=embedding)
+        if request.query_params.get('async', '').lower() in ('1', 'true', 'yes'):
+            job = enqueue_verification(known_bytes, new_bytes)
+            return Response({
+                'success': True,
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': reverse('verification_job_api', args=[job.id])
+            }, status=status.HTTP_202_ACCEPTED)
         
-        # Create verification record
-        verification_record = VerificationRecord.objects.create(
-            known_image_path=known_path,
-            new_image_path=new_path,
-            is_verified=is_verified,
-            embedding=embedding_obj
-        )
+        # Perform verification and store the attempt
+        outcome = verify_and_record(known_bytes, new_bytes)
         
-        # Clean up temporary files
-        for temp_file in [known_path, new_path]:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+        return Response({'success': True, **outcome})
+    
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+def verification_job_api(request, job_id):
+    """API endpoint reporting the status and result of a queued verification"""
+    try:
+        job = VerificationJob.objects.defer('known_image', 'new_image').get(id=job_id)
+    except VerificationJob.DoesNotExist:
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    return Response({'success': True, 'job': VerificationJobSerializer(job).data})
+
+@api_view(['POST'])
+@parser_classes([NDJSONParser, MultiPartParser])
+def verify_batch_api(request):
+    """API endpoint for verifying many image pairs in one request
+    
+    Accepts either NDJSON (one {"id", "known_image", "new_image"} object per
+    line, base64 images) or multipart with repeated known_image / new_image
+    file parts paired by position and optional repeated id fields. Results
+    are streamed back as NDJSON, one line per pair, as each chunk completes.
+    """
+    if request.content_type.startswith('multipart/'):
+        pairs = _multipart_batch_pairs(request)
+    else:
+        pairs = _ndjson_batch_pairs(request.data)
+    
+    results = (json.dumps(result) + '\n' for result in verify_batch(pairs))
+    return StreamingHttpResponse(results, content_type='application/x-ndjson')
+
+def _ndjson_batch_pairs(lines):
+    for index, item in enumerate(lines):
+        if isinstance(item, Exception):
+            yield {'index': index, 'error': str(item)}
+            continue
+        if not isinstance(item, dict):
+            yield {'index': index, 'error': 'Each line must be a JSON object'}
+            continue
+        serializer = FaceVerificationSerializer(data=item)
+        if not serializer.is_valid():
+            yield {'index': index, 'id': item.get('id'), 'error': serializer.errors}
+            continue
+        try:
+            yield {
+                'index': index,
+                'id': item.get('id'),
+                'known_image': decode_base64_image(serializer.validated_data['known_image']),
+                'new_image': decode_base64_image(serializer.validated_data['new_image'])
+            }
+        except ValueError as e:
+            yield {'index': index, 'id': item.get('id'), 'error': str(e)}
+
+def _multipart_batch_pairs(request):
+    known_files = request.FILES.getlist('known_image')
+    new_files = request.FILES.getlist('new_image')
+    ids = request.data.getlist('id')
+    for index in range(max(len(known_files), len(new_files))):
+        pair_id = ids[index] if index < len(ids) else None
+        if index >= len(known_files) or index >= len(new_files):
+            yield {'index': index, 'id': pair_id, 'error': 'known_image and new_image counts differ'}
+            continue
+        yield {
+            'index': index,
+            'id': pair_id,
+            'known_image': known_files[index].read(),
+            'new_image': new_files[index].read()
+        }
+
+@api_view(['POST'])
+@parser_classes([JSONParser])
+def identify_face_api(request):
+    """API endpoint for 1:N identification against all stored face embeddings"""
+    serializer = FaceIdentificationSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        image_bytes = decode_base64_image(serializer.validated_data['image'])
+        top_k = min(serializer.validated_data['top_k'], settings.FACE_INDEX.get('max_top_k', 100))
         
-        return Response({
-            'success': True,
-            'verified': is_verified,
-            'embedding_saved': embedding is not None,
-            'verification_id': verification_record.id,
-            'message': 'Verification successful!' if is_verified else 'Verification failed - faces do not match'
-        })
+        return Response({'success': True, **identify_face(image_bytes, top_k=top_k)})
     
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -136,56 +228,127 @@ def upload_file_api(request):
         if file_extension not in allowed_extensions:
             return Response({'error': 'Invalid file type'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Generate unique filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{file.name}"
-        filepath = os.path.join(settings.UPLOAD_FOLDER, filename)
-        
-        # Save file
-        with open(filepath, 'wb+') as destination:
-            for chunk in file.chunks():
-                destination.write(chunk)
-        
-        return Response({
-            'success': True,
-            'filename': filename,
-            'filepath': filepath
-        })
+        return Response({'success': True, **store_upload(file)})
     
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def _embedding_response(embedding, representation):
+    if representation == 'binary':
+        return Response(embedding.get_vector_bytes(), headers={
+            'X-Embedding-Id': str(embedding.pk),
+            'X-Embedding-Model': embedding.model_name,
+            'X-Embedding-Dimension': str(embedding.dimension),
+        })
+    if representation == 'legacy':
+        serializer = LegacyFaceEmbeddingSerializer(embedding)
+    elif representation == 'base64':
+        serializer = PackedFaceEmbeddingSerializer(embedding)
+    else:
+        serializer = FaceEmbeddingSerializer(embedding)
+    return Response({
+        'success': True, 
+        'embedding': serializer.data
+    })
+
 @api_view(['GET'])
-def get_embeddings_api(request):
-    """API endpoint to get the latest face embedding"""
+@renderer_classes([JSONRenderer, BrowsableAPIRenderer, PackedEmbeddingJSONRenderer, EmbeddingOctetStreamRenderer])
+def get_embeddings_api(request, embedding_id=None):
+    """API endpoint to get a face embedding by id, or the latest one
+    
+    ?format=json (default) returns the vector as a list, ?format=base64 as
+    base64 little-endian float32 and ?format=binary as the raw bytes. Pass
+    ?legacy=true for the original embedding_data JSON shape. Responses carry
+    an ETag and Last-Modified, so repeat polls can be answered with 304.
+    """
     try:
-        # Get the most recent embedding
-        latest_embedding = FaceEmbedding.objects.order_by('-created_at').first()
+        embedding = get_face_embedding(embedding_id)
         
-        if latest_embedding:
-            serializer = FaceEmbeddingSerializer(latest_embedding)
-            return Response({
-                'success': True, 
-                'embedding': serializer.data
-            })
-        else:
+        if embedding is None:
+            if embedding_id is not None:
+                return Response({'success': False, 'message': 'Embedding not found'},
+                                status=status.HTTP_404_NOT_FOUND)
             return Response({
                 'success': False, 
                 'message': 'No embedding found'
             })
+        
+        representation = request.accepted_renderer.format
+        legacy = request.query_params.get('legacy', '').lower() in ('1', 'true', 'yes')
+        if representation in ('json', 'api') and legacy:
+            representation = 'legacy'
+        etag, last_modified = embedding_validators(embedding, representation)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        
+        if response is None:
+            response = _embedding_response(embedding, representation)
+        patch_vary_headers(response, ['Accept'])
+        return set_embedding_validators(response, etag, last_modified)
     
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['GET'])
 def get_verification_records_api(request):
-    """API endpoint to get verification records"""
+    """API endpoint to page through verification records, newest first
+    
+    Filters: is_verified, date_from (inclusive), date_to (exclusive). Pass
+    the returned next_cursor as ?cursor= for the next page, and
+    ?expand=embedding to inline each record's FaceEmbedding.
+    """
+    query = VerificationRecordQuerySerializer(data=request.query_params.dict())
+    if not query.is_valid():
+        return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+    params = query.validated_data
+    
     try:
-        records = VerificationRecord.objects.order_by('-verification_date')[:10]  # Get last 10 records
-        serializer = VerificationRecordSerializer(records, many=True)
+        expand_embedding = params.get('expand') == 'embedding'
+        records = verification_records_queryset(
+            is_verified=params['is_verified'],
+            date_from=params.get('date_from'),
+            date_to=params.get('date_to'),
+            cursor=params.get('cursor'),
+            expand_embedding=expand_embedding
+        )
+        records, next_cursor = records_page(list(records[:params['limit'] + 1]), params['limit'])
+        serializer_class = VerificationRecordExpandedSerializer if expand_embedding else VerificationRecordSerializer
         return Response({
             'success': True,
-            'records': serializer.data
+            'records': serializer_class(records, many=True).data,
+            'next_cursor': next_cursor
         })
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
-        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR) 
\ No newline at end of file
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+def get_stats_api(request):
+    """API endpoint for per-process verification pipeline counters"""
+    cache = get_embedding_cache()
+    scheduler = get_inference_scheduler()
+    audit_buffer = get_audit_buffer()
+    return Response({
+        'success': True,
+        'embedding_cache': cache.stats() if cache is not None else None,
+        'inference_scheduler': scheduler.stats() if scheduler is not None else None,
+        'audit_buffer': audit_buffer.stats() if audit_buffer is not None else None
+    })
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def readiness_api(request):
+    """Readiness probe for load balancers: 200 once the face models are warm"""
+    client = get_inference_client()
+    if client is None:
+        model_status = registry.status()
+    else:
+        try:
+            model_status = client.call('status')
+        except Exception as e:
+            model_status = {'ready': False, 'state': 'unreachable', 'error': str(e)}
+    return Response(
+        model_status,
+        status=status.HTTP_200_OK if model_status['ready'] else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
@@ -1,6 +1,45 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class VerificationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'verification'
+
+    def ready(self):
+        from . import signals  # noqa: F401 - connects the receivers
+
+        if os.environ.get('FACE_WARMUP_AFTER_FORK') == '1':
+            # A preloading server (gunicorn.conf.py) imports the app in its
+            # master; a warm-up thread started there would not exist in the
+            # forked workers, so each worker calls start_warmup() instead
+            return
+        if not _is_serving_process():
+            return
+        start_warmup()
+
+
+def start_warmup():
+    """Start warming the face models in this process if the settings ask for it"""
+    if not settings.FACE_VERIFICATION.get('warmup_on_startup', True):
+        return
+    if settings.INFERENCE_POOL.get('enabled', False):
+        return  # the models live in the inference pool processes
+
+    from .model_registry import registry
+    registry.start(background=settings.FACE_VERIFICATION.get('warmup_in_background', True))
+
+
+def _is_serving_process():
+    """Return False for management commands and test runs that never serve requests"""
+    if 'pytest' in sys.modules:
+        return False
+    if os.path.basename(sys.argv[0]) not in ('manage.py', 'django-admin'):
+        return True  # gunicorn, uvicorn and other WSGI/ASGI servers
+    if len(sys.argv) < 2 or sys.argv[1] != 'runserver':
+        return False
+    # The autoreloader parent process only watches files
+    return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
@@ -0,0 +1,246 @@
+"""Async versions of the verify, capture, upload and records endpoints for ASGI
+
+Inference runs on a bounded thread pool so at most async_inference_workers
+verifications compute at once however many requests are waiting, and
+database access goes through the async ORM. Authentication matches the DRF
+endpoints: a token header, or a session with a valid CSRF token.
+"""
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework.authtoken.models import Token
+
+from .imaging import decode_base64_image
+from .parsers import BoundedMemoryUploadHandler, ImageTooLarge
+from .serializers import (
+    ImageUploadSerializer,
+    ImageFileSerializer,
+    FaceVerificationSerializer,
+    FaceVerificationUploadSerializer,
+    FileUploadSerializer,
+    VerificationRecordSerializer,
+    VerificationRecordExpandedSerializer,
+    VerificationRecordQuerySerializer
+)
+from .services import (
+    arecord_verification,
+    retain_image,
+    store_capture,
+    store_upload,
+    verification_records_queryset,
+    records_page
+)
+from .utils import compare_faces
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_inference_executor():
+    """Return the process-wide thread pool that async views run inference on"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.FACE_VERIFICATION.get('async_inference_workers', 4),
+                    thread_name_prefix='async-inference'
+                )
+    return _executor
+
+
+async def run_inference(func, *args):
+    """Run a CPU-bound function on the bounded inference executor"""
+    return await asyncio.get_running_loop().run_in_executor(get_inference_executor(), func, *args)
+
+
+async def authenticate(request):
+    """Return the user for a Token header or a CSRF-checked session, or None"""
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Token '):
+        try:
+            token = await Token.objects.select_related('user').aget(key=header[6:].strip())
+        except Token.DoesNotExist:
+            return None
+        return token.user if token.user.is_active else None
+
+    user = await request.auser()
+    if not user.is_authenticated or not user.is_active:
+        return None
+    # Same rule as DRF's SessionAuthentication: session-authenticated writes need CSRF
+    if await sync_to_async(_csrf_failed, thread_sensitive=False)(request):
+        return None
+    return user
+
+
+def _csrf_failed(request):
+    # Reads request.POST for the form token, so the body is parsed off the event loop
+    return CsrfViewMiddleware(lambda r: None).process_view(request, None, (), {}) is not None
+
+
+def _unauthorized():
+    return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+
+def _use_bounded_uploads(request):
+    # Must happen before anything (including the CSRF check) reads request.POST
+    if request.content_type.startswith('multipart/'):
+        request.upload_handlers = [BoundedMemoryUploadHandler(request)]
+
+
+def _request_data(request, multipart_serializer, json_serializer):
+    """Validate a multipart or JSON body with the matching serializer"""
+    if request.content_type.startswith('multipart/'):
+        return multipart_serializer(data={**request.POST.dict(), **request.FILES.dict()})
+    return json_serializer(data=json.loads(request.body))
+
+
+def _image_bytes(value):
+    if isinstance(value, str):
+        return decode_base64_image(value)
+    return value.read()
+
+
+def _verify_images(known_image, new_image):
+    """Decode and compare an image pair; runs on the inference executor"""
+    known_bytes = _image_bytes(known_image)
+    new_bytes = _image_bytes(new_image)
+    return compare_faces(known_bytes, new_bytes), known_bytes, new_bytes
+
+
+def _retain_images(known_bytes, new_bytes):
+    return retain_image(known_bytes), retain_image(new_bytes)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def verify_faces_async(request):
+    """Async face verification; accepts the same JSON or multipart bodies as /api/verify/"""
+    _use_bounded_uploads(request)
+    try:
+        # The CSRF check parses the body, so an oversized upload fails here
+        if await authenticate(request) is None:
+            return _unauthorized()
+
+        serializer = await sync_to_async(_request_data, thread_sensitive=False)(
+            request, FaceVerificationUploadSerializer, FaceVerificationSerializer
+        )
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+
+        result, known_bytes, new_bytes = await run_inference(
+            _verify_images,
+            serializer.validated_data['known_image'],
+            serializer.validated_data['new_image']
+        )
+        known_path, new_path = await sync_to_async(_retain_images)(known_bytes, new_bytes)
+        outcome = await arecord_verification(result, known_path, new_path)
+        return JsonResponse({'success': True, **outcome})
+
+    except ImageTooLarge as e:
+        return JsonResponse({'error': str(e.detail)}, status=413)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def capture_image_async(request):
+    """Async image capture; accepts the same JSON or multipart bodies as /api/capture/"""
+    _use_bounded_uploads(request)
+    try:
+        # The CSRF check parses the body, so an oversized upload fails here
+        if await authenticate(request) is None:
+            return _unauthorized()
+
+        serializer = await sync_to_async(_request_data, thread_sensitive=False)(
+            request, ImageFileSerializer, ImageUploadSerializer
+        )
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+
+        image_bytes = await sync_to_async(_image_bytes, thread_sensitive=False)(
+            serializer.validated_data['image']
+        )
+        return JsonResponse({'success': True, **await sync_to_async(store_capture)(image_bytes)})
+
+    except ImageTooLarge as e:
+        return JsonResponse({'error': str(e.detail)}, status=413)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def upload_file_async(request):
+    """Async file upload; same form as /api/upload/"""
+    _use_bounded_uploads(request)
+    try:
+        if await authenticate(request) is None:
+            return _unauthorized()
+
+        serializer = await sync_to_async(
+            lambda: FileUploadSerializer(data=request.FILES.dict()), thread_sensitive=False
+        )()
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+
+        file = serializer.validated_data['file']
+        allowed_extensions = {'png', 'jpg', 'jpeg', 'gif'}
+        file_extension = file.name.rsplit('.', 1)[1].lower() if '.' in file.name else ''
+        if file_extension not in allowed_extensions:
+            return JsonResponse({'error': 'Invalid file type'}, status=400)
+
+        return JsonResponse({'success': True, **await sync_to_async(store_upload)(file)})
+
+    except ImageTooLarge as e:
+        return JsonResponse({'error': str(e.detail)}, status=413)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+async def get_verification_records_async(request):
+    """Async keyset-paginated verification records; same parameters as /api/records/"""
+    if await authenticate(request) is None:
+        return _unauthorized()
+
+    query = VerificationRecordQuerySerializer(data=request.GET.dict())
+    if not query.is_valid():
+        return JsonResponse(query.errors, status=400)
+    params = query.validated_data
+
+    try:
+        expand_embedding = params.get('expand') == 'embedding'
+        records = verification_records_queryset(
+            is_verified=params['is_verified'],
+            date_from=params.get('date_from'),
+            date_to=params.get('date_to'),
+            cursor=params.get('cursor'),
+            expand_embedding=expand_embedding
+        )
+        records, next_cursor = records_page(
+            [record async for record in records[:params['limit'] + 1]], params['limit']
+        )
+        serializer_class = VerificationRecordExpandedSerializer if expand_embedding else VerificationRecordSerializer
+        return JsonResponse({
+            'success': True,
+            'records': serializer_class(records, many=True).data,
+            'next_cursor': next_cursor
+        })
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
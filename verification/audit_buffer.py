@@ -0,0 +1,365 @@
+import atexit
+import base64
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+from django.utils.dateparse import parse_datetime
+
+from .models import FaceEmbedding, VerificationRecord
+from .signals import add_embedding_to_index
+
+
+# Errors caused by the rows themselves, which retrying the same rows cannot fix
+ROW_ERRORS = (IntegrityError, DataError, ValueError, TypeError)
+
+
+def serialize_attempt(embedding_obj, verification_record, error=None):
+    """Return one journal line for an unsaved (FaceEmbedding or None, VerificationRecord)"""
+    embedding = None
+    if embedding_obj is not None:
+        embedding = {
+            'vector': base64.b64encode(embedding_obj.vector).decode('ascii'),
+            'encoding': embedding_obj.encoding,
+            'scale': embedding_obj.scale,
+            'model_name': embedding_obj.model_name,
+            'dimension': embedding_obj.dimension,
+            'is_normalized': embedding_obj.is_normalized,
+            'facial_area': embedding_obj.facial_area,
+            'face_confidence': embedding_obj.face_confidence,
+            'created_at': embedding_obj.created_at,
+        }
+    record = {
+        'known_image_path': verification_record.known_image_path,
+        'new_image_path': verification_record.new_image_path,
+        'is_verified': verification_record.is_verified,
+        'verification_date': verification_record.verification_date,
+    }
+    data = {'embedding': embedding, 'record': record}
+    if error is not None:
+        data['error'] = error
+    return json.dumps(data, cls=DjangoJSONEncoder) + '\n'
+
+
+def deserialize_attempt(line):
+    """Inverse of serialize_attempt"""
+    data = json.loads(line)
+    embedding_obj = None
+    if data['embedding'] is not None:
+        fields = data['embedding']
+        embedding_obj = FaceEmbedding(**{
+            **fields,
+            'vector': base64.b64decode(fields['vector']),
+            'created_at': parse_datetime(fields['created_at']),
+        })
+    fields = data['record']
+    verification_record = VerificationRecord(**{
+        **fields,
+        'verification_date': parse_datetime(fields['verification_date']),
+    })
+    return embedding_obj, verification_record
+
+
+def write_attempts(attempts):
+    """Insert buffered (FaceEmbedding or None, VerificationRecord) pairs with two bulk_creates"""
+    embeddings = [embedding_obj for embedding_obj, _ in attempts if embedding_obj is not None]
+    with transaction.atomic():
+        FaceEmbedding.objects.bulk_create(embeddings)
+        for embedding_obj, verification_record in attempts:
+            if embedding_obj is not None:
+                verification_record.embedding = embedding_obj
+        VerificationRecord.objects.bulk_create([record for _, record in attempts])
+        # bulk_create sends no post_save, so feed the search index here
+        for embedding_obj in embeddings:
+            add_embedding_to_index(FaceEmbedding, embedding_obj, created=True)
+
+
+def write_attempts_isolating(attempts):
+    """Write attempts, splitting any batch the database rejects until the bad rows are alone
+
+    Returns (rejected, unwritten, error): the (attempt, error) pairs that
+    failed on their own, and when some other error (the database being
+    unreachable, say) stopped the write, the attempts not yet written and
+    that error. Rows already committed are not in either list.
+    """
+    rejected = []
+    batches = [attempts]
+    while batches:
+        batch = batches.pop(0)
+        try:
+            write_attempts(batch)
+        except ROW_ERRORS as e:
+            _unsave(batch)
+            if len(batch) == 1:
+                rejected.append((batch[0], e))
+            else:
+                middle = len(batch) // 2
+                batches[:0] = [batch[:middle], batch[middle:]]
+        except Exception as e:
+            _unsave(batch)
+            return rejected, batch + [attempt for rest in batches for attempt in rest], e
+    return rejected, [], None
+
+
+def _unsave(attempts):
+    # A rolled-back bulk_create may have set primary keys; the rows were never stored
+    for embedding_obj, verification_record in attempts:
+        for obj in (embedding_obj, verification_record):
+            if obj is not None:
+                obj.pk = None
+                obj._state.adding = True
+                obj._state.db = None
+
+
+def append_dead_letters(path, rejected):
+    """Append attempts the database rejected to a dead-letter file, with the error"""
+    for _, error in rejected:
+        print(f"Error writing buffered verification record, moved to {path}: {error}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        for (embedding_obj, verification_record), error in rejected:
+            f.write(serialize_attempt(embedding_obj, verification_record, error=f"{type(error).__name__}: {error}"))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class AuditJournal:
+    """Per-process append-only journal of buffered attempts
+
+    Each process writes numbered segment files next to a lock file it holds
+    for its lifetime. A flush starts a new segment and deletes the old one
+    once its rows are committed. Segments whose owner no longer holds its
+    lock belong to a process that died with rows still buffered; they are
+    replayed by the next process to start. Replay is at-least-once: a crash
+    between a commit and the segment delete writes those rows again. Rows
+    the database rejects go to dead-letter.jsonl in the same directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.prefix = os.path.join(self.directory, f"audit-{os.getpid()}")
+        self.dead_letter = os.path.join(self.directory, 'dead-letter.jsonl')
+        self._lock_file = open(f"{self.prefix}.lock", 'w')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.sequence = 0
+        self._segment = None
+
+    def recover(self):
+        """Write the segments left by dead processes (and a previous process with this pid)"""
+        recovered = self._replay(glob.glob(f"{self.prefix}.*.jsonl"))
+        for lock_path in glob.glob(os.path.join(self.directory, 'audit-*.lock')):
+            prefix = lock_path[:-len('.lock')]
+            if prefix == self.prefix:
+                continue
+            with open(lock_path, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # owner is still running
+                recovered += self._replay(glob.glob(f"{prefix}.*.jsonl"))
+                os.unlink(lock_path)
+        return recovered
+
+    def _replay(self, paths):
+        count = 0
+        for path in sorted(paths):
+            with open(path) as f:
+                attempts = [deserialize_attempt(line) for line in f if line.endswith('\n')]
+            rejected, unwritten, error = write_attempts_isolating(attempts)
+            if rejected:
+                append_dead_letters(self.dead_letter, rejected)
+            if error is not None:
+                # Keep only what is left for the next attempt
+                with open(path + '.tmp', 'w') as f:
+                    f.writelines(serialize_attempt(*attempt) for attempt in unwritten)
+                os.replace(path + '.tmp', path)
+                raise error
+            count += len(attempts) - len(rejected)
+            os.unlink(path)
+        return count
+
+    def append(self, line):
+        if self._segment is None:
+            self._segment = open(f"{self.prefix}.{self.sequence}.jsonl", 'a')
+        self._segment.write(line)
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+
+    def rotate(self):
+        """Close the current segment and return its path, or None if nothing was written"""
+        if self._segment is None:
+            return None
+        self._segment.close()
+        path = self._segment.name
+        self._segment = None
+        self.sequence += 1
+        return path
+
+
+class AuditBuffer:
+    """Write-behind buffer for verification audit rows
+
+    Requests hand their unsaved FaceEmbedding and VerificationRecord to
+    add() and return without touching the database. A background thread
+    writes everything buffered with bulk_create once max_rows attempts are
+    waiting or the oldest has waited flush_interval seconds, so concurrent
+    requests no longer queue on the database write lock one row at a time.
+    With a journal, each attempt is appended and fsynced to a local file
+    before add() returns, so rows buffered at a crash are written by the
+    next process to start instead of lost.
+
+    When the database rejects a batch because of its rows (an
+    IntegrityError, say), the batch is split until the offending attempts
+    are alone; those are appended to the dead_letter file and the rest are
+    written. Any other error keeps every unwritten attempt for the next
+    flush.
+    """
+
+    def __init__(self, max_rows=100, flush_interval=1.0, journal=None, dead_letter=None):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.journal = journal
+        self.dead_letter = dead_letter or (journal.dead_letter if journal is not None else None)
+        self._pending = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self.buffered = 0
+        self.written = 0
+        self.flushes = 0
+        self.errors = 0
+        self.rejected = 0
+        self.recovered = journal.recover() if journal is not None else 0
+
+    def add(self, embedding_obj, verification_record):
+        """Buffer one attempt's unsaved rows"""
+        self._ensure_started()
+        line = serialize_attempt(embedding_obj, verification_record) if self.journal is not None else None
+        with self._lock:
+            if line is not None:
+                self.journal.append(line)
+            self._pending.append((embedding_obj, verification_record))
+            self.buffered += 1
+            if self._oldest is None:
+                # Start the writer's flush_interval countdown
+                self._oldest = time.monotonic()
+                self._wakeup.notify()
+            elif len(self._pending) >= self.max_rows:
+                self._wakeup.notify()
+
+    def flush(self):
+        """Write everything buffered so far; return the number of attempts written"""
+        with self._flush_lock:
+            with self._lock:
+                attempts, self._pending, self._oldest = self._pending, [], None
+                segment = self.journal.rotate() if self.journal is not None else None
+            if not attempts:
+                return 0
+            rejected, unwritten, error = write_attempts_isolating(attempts)
+            if rejected:
+                self._reject(rejected)
+            with self._lock:
+                self.written += len(attempts) - len(rejected) - len(unwritten)
+                self.rejected += len(rejected)
+                if error is None:
+                    self.flushes += 1
+                else:
+                    self.errors += 1
+                    # Keep the rows (and their journal lines) for the next flush
+                    self._pending[:0] = unwritten
+                    self._oldest = time.monotonic()
+                    if segment is not None:
+                        for embedding_obj, verification_record in unwritten:
+                            self.journal.append(serialize_attempt(embedding_obj, verification_record))
+            if segment is not None:
+                os.unlink(segment)
+            if error is not None:
+                raise error
+            return len(attempts) - len(rejected)
+
+    def _reject(self, rejected):
+        if self.dead_letter is None:
+            for _, error in rejected:
+                print(f"Error writing buffered verification record, dropped: {error}")
+            return
+        append_dead_letters(self.dead_letter, rejected)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    if len(self._pending) >= self.max_rows:
+                        break
+                    if self._oldest is not None:
+                        remaining = self._oldest + self.flush_interval - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._wakeup.wait(remaining)
+                    else:
+                        self._wakeup.wait()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing buffered verification records: {e}")
+                time.sleep(self.flush_interval)
+
+    def stats(self):
+        """Return buffer depth and flush counters"""
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'buffered': self.buffered,
+                'written': self.written,
+                'flushes': self.flushes,
+                'errors': self.errors,
+                'rejected': self.rejected,
+                'recovered': self.recovered,
+                'journal': self.journal is not None,
+            }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_audit_buffer():
+    """Return the process-wide audit buffer, or None when rows are written synchronously"""
+    global _buffer
+    config = settings.AUDIT_WRITE_BEHIND
+    if not config.get('enabled', False):
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                journal = AuditJournal(config['journal_dir']) if config.get('journal', False) else None
+                _buffer = AuditBuffer(
+                    max_rows=config.get('max_rows', 100),
+                    flush_interval=config.get('flush_interval', 1.0),
+                    journal=journal,
+                    dead_letter=os.path.join(config['journal_dir'], 'dead-letter.jsonl')
+                )
+    return _buffer
+
+
+def get_loaded_audit_buffer():
+    """Return the process-wide audit buffer if this process has created one"""
+    return _buffer
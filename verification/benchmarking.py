@@ -0,0 +1,243 @@
+"""Stage-level timing of the verification pipeline on synthetic faces
+
+Used by `manage.py bench_verification` and the pytest-benchmark suite in
+benchmarks/. The default StubFaceModel stands in for the detector and the
+recognition model so runs need no weights, network or GPU; DeepFaceModel
+times the configured DeepFace models instead.
+"""
+import base64
+import platform
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .imaging import decode_base64_image, decode_image, downscale_for_detection, scale_facial_area, crop_aligned_face
+from . import utils
+from .model_registry import peak_rss_mb
+from .models import FaceEmbedding, VerificationRecord
+
+STAGES = ('base64_decode', 'image_decode', 'detection', 'alignment', 'embedding', 'distance', 'db_write')
+
+# Phone-camera-like resolutions: VGA, 1.2 MP and 12 MP
+DEFAULT_SIZES = ((640, 480), (1280, 960), (4032, 3024))
+
+MODELS = {
+    'stub': 'verification.benchmarking.StubFaceModel',
+    'deepface': 'verification.benchmarking.DeepFaceModel',
+}
+
+SKIN_BGR = (96, 150, 210)
+
+
+def synthetic_face(width, height, seed=0):
+    """Return a BGR image of a drawn face on a textured background, eyes slightly tilted"""
+    rng = np.random.default_rng(seed)
+    img = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+    face_w = int(min(width, height) * 0.4)
+    face_h = int(face_w * 1.3)
+    cx, cy = width // 2, height // 2
+    cv2.ellipse(img, (cx, cy), (face_w // 2, face_h // 2), 0, 0, 360, SKIN_BGR, -1)
+    for eye in StubFaceModel.eye_positions(cx - face_w // 2, cy - face_h // 2, face_w, face_h):
+        cv2.circle(img, eye, max(2, face_w // 14), (40, 30, 30), -1)
+    cv2.ellipse(img, (cx, cy + face_h // 4), (face_w // 5, face_h // 14), 0, 0, 180, (60, 60, 150), -1)
+    return img
+
+
+class StubFaceModel:
+    """Deterministic CPU stand-in for the face detector and recognition model
+
+    Detection finds the skin-coloured region on a downscaled copy, as the
+    real pipeline detects on a downscaled copy; the embedding is a fixed
+    random projection of the grey face, so costs scale with input size
+    without any model weights.
+    """
+    name = 'stub'
+    dimension = 128
+    input_size = (160, 160)
+
+    def __init__(self, seed=0):
+        side = 32
+        self.projection = np.random.default_rng(seed).standard_normal(
+            (side * side, self.dimension)
+        ).astype(np.float32)
+        self.side = side
+
+    @staticmethod
+    def eye_positions(x, y, w, h):
+        """Return (left_eye, right_eye) for a face box; the left eye is on the image's right"""
+        eye_y = y + int(h * 0.38)
+        return (x + int(w * 0.72), eye_y + max(1, h // 40)), (x + int(w * 0.28), eye_y)
+
+    def detect(self, img):
+        """Return the facial areas (box and eyes) found in a BGR image"""
+        small, scale = downscale_for_detection(img, utils.get_detection_max_side())
+        mask = cv2.inRange(small, np.subtract(SKIN_BGR, 12), np.add(SKIN_BGR, 12))
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return []
+        x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+        left_eye, right_eye = self.eye_positions(x, y, w, h)
+        facial_area = {'x': x, 'y': y, 'w': w, 'h': h, 'left_eye': left_eye, 'right_eye': right_eye}
+        return [scale_facial_area(facial_area, scale, img.shape)]
+
+    def embed(self, face_images):
+        """Return one embedding per aligned RGB face crop in [0, 1]"""
+        embeddings = []
+        for face in face_images:
+            face = cv2.resize(np.asarray(face, dtype=np.float32), self.input_size)
+            grey = cv2.resize(face.mean(axis=2), (self.side, self.side), interpolation=cv2.INTER_AREA)
+            embeddings.append(grey.reshape(-1) @ self.projection)
+        return embeddings
+
+
+class DeepFaceModel:
+    """The configured DeepFace detector and recognition model"""
+
+    def __init__(self):
+        if not utils.DEEPFACE_AVAILABLE:
+            raise RuntimeError("deepface is not installed")
+        self.name = utils.get_model_name()
+
+    def detect(self, img):
+        small, scale = downscale_for_detection(img, utils.get_detection_max_side())
+        detections = utils.DeepFace.extract_faces(
+            img_path=small,
+            detector_backend=utils.get_detector_backend(),
+            enforce_detection=False,
+            align=False
+        )
+        return [
+            scale_facial_area(detection['facial_area'], scale, img.shape)
+            for detection in detections if detection['confidence']
+        ]
+
+    def embed(self, face_images):
+        return utils.embed_faces(face_images)
+
+
+def load_model(name):
+    """Instantiate a benchmark model by short name ('stub', 'deepface') or dotted path"""
+    return import_string(MODELS.get(name, name))()
+
+
+class WrittenRows:
+    """Collects the rows written by db_write so they can be deleted afterwards"""
+
+    def __init__(self):
+        self.embedding_ids = []
+        self.record_ids = []
+
+    def delete(self):
+        VerificationRecord.objects.filter(id__in=self.record_ids).delete()
+        FaceEmbedding.objects.filter(id__in=self.embedding_ids).delete()
+        self.embedding_ids, self.record_ids = [], []
+
+
+def stage_callables(model, width, height, cleanup=None, seed=0):
+    """Return {stage: zero-argument callable} for one image size
+
+    Each stage's input is computed once up front from the previous stage,
+    so every callable times only its own work. db_write is left out when
+    cleanup is None.
+    """
+    img = synthetic_face(width, height, seed=seed)
+    encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+    b64 = 'data:image/jpeg;base64,' + base64.b64encode(encoded).decode('ascii')
+    decoded = decode_image(encoded)
+    faces = model.detect(decoded)
+    if not faces:
+        raise RuntimeError(f"{type(model).__name__} found no face in the {width}x{height} synthetic image")
+    facial_area = faces[0]
+    face = crop_aligned_face(decoded, facial_area)[:, :, ::-1] / 255
+    embedding = np.asarray(model.embed([face])[0], dtype=np.float32)
+    other = embedding + np.random.default_rng(seed + 1).normal(0, 0.01, embedding.shape).astype(np.float32)
+    metric = utils.get_distance_metric()
+
+    def db_write():
+        embedding_obj = FaceEmbedding.from_face(
+            {'embedding': embedding, 'facial_area': facial_area, 'face_confidence': 1.0},
+            model_name=f"benchmark-{model.name}"
+        )
+        embedding_obj.save()
+        record = VerificationRecord.objects.create(
+            known_image_path='benchmark', new_image_path='benchmark', is_verified=True, embedding=embedding_obj
+        )
+        cleanup.embedding_ids.append(embedding_obj.id)
+        cleanup.record_ids.append(record.id)
+
+    stages = {
+        'base64_decode': lambda: decode_base64_image(b64),
+        'image_decode': lambda: decode_image(encoded),
+        'detection': lambda: model.detect(decoded),
+        'alignment': lambda: crop_aligned_face(decoded, facial_area),
+        'embedding': lambda: model.embed([face]),
+        'distance': lambda: utils.find_distance(embedding, other, metric),
+    }
+    if cleanup is not None:
+        stages['db_write'] = db_write
+    return stages
+
+
+def percentiles(seconds):
+    """Summarise per-call durations in milliseconds"""
+    ms = np.asarray(seconds) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        'n': len(ms),
+        'mean_ms': round(float(ms.mean()), 4),
+        'p50_ms': round(float(p50), 4),
+        'p95_ms': round(float(p95), 4),
+        'p99_ms': round(float(p99), 4),
+        'max_ms': round(float(ms.max()), 4),
+    }
+
+
+def run_benchmark(model, sizes=DEFAULT_SIZES, repeat=50, warmup=3, stages=STAGES, include_db=True):
+    """Time each stage at each image size and return a JSON-serialisable report
+
+    Peak RSS is the process high-water mark after each size, so run sizes in
+    increasing order to attribute it.
+    """
+    report = {
+        'meta': {
+            'model': type(model).__module__ + '.' + type(model).__name__,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'repeat': repeat,
+            'warmup': warmup,
+        },
+        'sizes': [],
+    }
+    for width, height in sizes:
+        cleanup = WrittenRows() if include_db else None
+        callables = stage_callables(model, width, height, cleanup=cleanup)
+        results = {}
+        try:
+            for stage in stages:
+                if stage not in callables:
+                    continue
+                call = callables[stage]
+                for _ in range(warmup):
+                    call()
+                durations = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    call()
+                    durations.append(time.perf_counter() - started)
+                results[stage] = percentiles(durations)
+        finally:
+            if cleanup is not None:
+                cleanup.delete()
+        report['sizes'].append({
+            'width': width,
+            'height': height,
+            'stages': results,
+            'peak_rss_mb': peak_rss_mb(),
+        })
+    return report
@@ -0,0 +1,204 @@
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class EmbeddingCache:
+    """Content-addressed cache of face representations
+
+    Entries live in a bounded in-process LRU backed by a directory of JSON
+    files that every worker process on the host can read and write. The
+    directory is pruned back under max_disk_bytes, least recently used
+    first, every prune_interval writes. Callers get their own copy of an
+    entry, so mutating a result never changes what is cached.
+    """
+
+    def __init__(self, max_entries=1024, directory=None, max_disk_bytes=None, prune_interval=256):
+        self.max_entries = max_entries
+        self.directory = str(directory) if directory else None
+        self.max_disk_bytes = max_disk_bytes
+        self.prune_interval = prune_interval
+        self._writes_since_prune = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    @staticmethod
+    def make_key(image_bytes, model_name, detector_backend, align=True):
+        """Return the cache key for an image and the settings that produced its embedding"""
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return hashlib.sha256(
+            f"{digest}:{model_name}:{detector_backend}:{int(bool(align))}".encode()
+        ).hexdigest()
+
+    def get(self, key):
+        """Return the cached representation for a key, or None"""
+        with self._lock:
+            representation = self._entries.get(key)
+            if representation is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return copy.deepcopy(representation)
+
+        representation = self._read_disk(key)
+        with self._lock:
+            if representation is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, representation)
+        return copy.deepcopy(representation)
+
+    def set(self, key, representation):
+        """Store a copy of a representation in memory and on disk"""
+        representation = copy.deepcopy(representation)
+        with self._lock:
+            self._remember(key, representation)
+        if self._write_disk(key, representation):
+            with self._lock:
+                self._writes_since_prune += 1
+                due = self._writes_since_prune >= self.prune_interval
+                if due:
+                    self._writes_since_prune = 0
+            if due:
+                self.prune_disk()
+
+    def prune_disk(self):
+        """Delete the least recently used disk entries beyond max_disk_bytes; return how many"""
+        if not self.directory or not self.max_disk_bytes:
+            return 0
+        entries = []
+        total = 0
+        try:
+            shards = [entry.path for entry in os.scandir(self.directory) if entry.is_dir()]
+        except FileNotFoundError:
+            return 0
+        for shard in shards:
+            try:
+                with os.scandir(shard) as files:
+                    for entry in files:
+                        if not entry.name.endswith('.json'):
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+            except FileNotFoundError:
+                continue
+        if total <= self.max_disk_bytes:
+            return 0
+
+        # Prune to 90% of the limit so the next few writes do not prune again
+        target = self.max_disk_bytes * 0.9
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        with self._lock:
+            self.disk_evictions += removed
+        return removed
+
+    def clear(self):
+        """Drop every in-memory entry (the disk tier is left alone)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the cache counters"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'disk_evictions': self.disk_evictions,
+            }
+
+    def _remember(self, key, representation):
+        self._entries[key] = representation
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                representation = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            # The mtime doubles as the last use for prune_disk()
+            os.utime(path)
+        except OSError:
+            pass
+        return representation
+
+    def _write_disk(self, key, representation):
+        """Write one entry to the disk tier; return True if it was written"""
+        if not self.directory:
+            return False
+        path = self._path(key)
+        temp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so readers in other workers
+            # never see a partially written entry
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(representation, f)
+            os.replace(temp_path, path)
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error writing embedding cache entry: {e}")
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Return the process-wide embedding cache, or None when it is disabled"""
+    global _cache
+    config = settings.EMBEDDING_CACHE
+    if not config.get('enabled', True):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(
+                    max_entries=config.get('max_entries', 1024),
+                    directory=config.get('directory'),
+                    max_disk_bytes=config.get('max_disk_bytes'),
+                    prune_interval=config.get('prune_interval', 256)
+                )
+    return _cache
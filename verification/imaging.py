@@ -0,0 +1,124 @@
+import base64
+import binascii
+
+import cv2
+import numpy as np
+
+
+class ImageDecodeError(ValueError):
+    """The client sent image data that cannot be decoded"""
+
+
+# Characters decoded per step; a multiple of 4 so chunks split on whole quanta
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+def decode_base64_image(image_data):
+    """Decode a base64 image string, with or without a data URL prefix, to a bytearray
+
+    The string is decoded a chunk at a time straight into a preallocated
+    output buffer, so a multi-MB upload is never copied whole on its way
+    through (no prefix split, no ASCII re-encode of the full string).
+    """
+    start = 0
+    if image_data.startswith('data:image'):
+        start = image_data.find(',', 0, 256) + 1
+        if start == 0:
+            raise ImageDecodeError("Invalid data URL: missing ',' after the header")
+
+    image_bytes = bytearray((len(image_data) - start) * 3 // 4)
+    size = 0
+    try:
+        for offset in range(start, len(image_data), BASE64_CHUNK_SIZE):
+            chunk = binascii.a2b_base64(image_data[offset:offset + BASE64_CHUNK_SIZE])
+            image_bytes[size:size + len(chunk)] = chunk
+            size += len(chunk)
+    except (binascii.Error, ValueError) as e:
+        # Embedded whitespace or line breaks shift the 4-character quanta
+        # across chunk boundaries; fall back to decoding the whole string
+        try:
+            image_bytes = bytearray(base64.b64decode(image_data[start:]))
+        except (binascii.Error, ValueError):
+            raise ImageDecodeError(f"Invalid base64 image data: {e}")
+        size = len(image_bytes)
+    del image_bytes[size:]
+
+    if not image_bytes:
+        raise ImageDecodeError("Empty image data")
+    return image_bytes
+
+
+def decode_image(image_bytes):
+    """Decode encoded image bytes (JPEG, PNG, ...) into a BGR NumPy array"""
+    if not image_bytes:
+        raise ImageDecodeError("Empty image data")
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ImageDecodeError("Could not decode image data")
+    return img
+
+
+def downscale_for_detection(img, max_side):
+    """Return (image, scale) with the longest side reduced to max_side
+
+    scale is the factor applied to the original; images that already fit are
+    returned unchanged with a scale of 1.
+    """
+    height, width = img.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return img, 1.0
+    scale = max_side / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), scale
+
+
+def scale_facial_area(facial_area, scale, shape):
+    """Map a facial_area detected on a downscaled copy back onto the original image"""
+    height, width = shape[:2]
+    x = max(0, int(round(facial_area['x'] / scale)))
+    y = max(0, int(round(facial_area['y'] / scale)))
+    scaled = {
+        'x': x,
+        'y': y,
+        'w': min(width - x - 1, int(round(facial_area['w'] / scale))),
+        'h': min(height - y - 1, int(round(facial_area['h'] / scale))),
+    }
+    for eye in ('left_eye', 'right_eye'):
+        point = facial_area.get(eye)
+        scaled[eye] = (int(round(point[0] / scale)), int(round(point[1] / scale))) if point is not None else None
+    return scaled
+
+
+def crop_aligned_face(img, facial_area):
+    """Crop a face from a BGR image, rotated so the eyes are level
+
+    Matches DeepFace's alignment (rotate about the eyes' angle, then take a
+    w x h box around the rotated face centre, black outside the image) but
+    only rotates a window around the face instead of the whole image.
+    """
+    x, y, w, h = facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']
+    left_eye, right_eye = facial_area.get('left_eye'), facial_area.get('right_eye')
+    if left_eye is None or right_eye is None or w <= 0 or h <= 0:
+        return img[y:y + h, x:x + w]
+
+    angle = float(np.degrees(np.arctan2(left_eye[1] - right_eye[1], left_eye[0] - right_eye[0])))
+
+    # A window whose side is the box diagonal holds the box at any rotation
+    side = int(np.ceil(np.hypot(w, h))) + 2
+    cx, cy = x + w / 2, y + h / 2
+    left, top = int(round(cx - side / 2)), int(round(cy - side / 2))
+    height, width = img.shape[:2]
+    window = cv2.copyMakeBorder(
+        img[max(0, top):max(0, top + side), max(0, left):max(0, left + side)],
+        max(0, -top), max(0, top + side - height), max(0, -left), max(0, left + side - width),
+        cv2.BORDER_CONSTANT, value=(0, 0, 0)
+    )
+
+    # Positive angles rotate counter-clockwise, as PIL's Image.rotate does
+    center = (cx - left, cy - top)
+    matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+    rotated = cv2.warpAffine(window, matrix, (side, side), flags=cv2.INTER_CUBIC,
+                             borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+    x1, y1 = int(center[0] - w / 2), int(center[1] - h / 2)
+    return rotated[y1:y1 + h, x1:x1 + w]
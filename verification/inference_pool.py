@@ -0,0 +1,193 @@
+import hashlib
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from django.conf import settings
+from django.db import connections
+
+
+def get_pool_address():
+    """Return the unix socket path the inference pool listens on"""
+    return str(settings.INFERENCE_POOL.get('address'))
+
+
+def get_pool_authkey():
+    """Return the key both ends use to authenticate pool connections"""
+    return hashlib.sha256(f"inference-pool:{settings.SECRET_KEY}".encode()).digest()
+
+
+def get_pool_size():
+    """Return the number of inference processes: the configured count, or cores / intra-op threads"""
+    config = settings.INFERENCE_POOL
+    if config.get('processes'):
+        return config['processes']
+    return max(1, (os.cpu_count() or 1) // max(1, config.get('intra_op_threads', 1)))
+
+
+def _handlers():
+    # Imported here so web workers can use the client without the model stack
+    from . import utils
+    from .model_registry import registry
+    return {
+        'represent_images': utils.represent_images_in_process,
+        'status': registry.status,
+    }
+
+
+class InferencePool:
+    """Pool of processes that run face detection and embedding
+
+    The supervisor only opens the listening socket and forks the workers;
+    it never imports TensorFlow, whose runtime threads and locks do not
+    survive a fork. Each worker builds and warms up its own models after
+    the fork and serves requests from the web workers over the shared
+    unix socket.
+
+    The weights are therefore not shared copy-on-write: every pool process
+    holds a full copy of the models (see peak_rss_mb in the readiness
+    status). The saving over loading the models in each web worker comes
+    from running fewer pool processes, one per intra_op_threads cores,
+    than web workers.
+    """
+
+    def __init__(self, address=None, processes=None, threads=None):
+        config = settings.INFERENCE_POOL
+        self.address = address or get_pool_address()
+        self.processes = processes or get_pool_size()
+        self.threads = threads or config.get('threads_per_process', 4)
+        self.workers = []
+
+    def serve_forever(self):
+        """Fork the workers and supervise them until SIGTERM/SIGINT"""
+        intra_op_threads = settings.INFERENCE_POOL.get('intra_op_threads')
+        if intra_op_threads:
+            # Read by TensorFlow when its runtime starts in each worker
+            os.environ.setdefault('TF_NUM_INTRAOP_THREADS', str(intra_op_threads))
+            os.environ.setdefault('TF_NUM_INTEROP_THREADS', '1')
+
+        os.makedirs(os.path.dirname(self.address), exist_ok=True)
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        listener = Listener(self.address, family='AF_UNIX', authkey=get_pool_authkey())
+        os.chmod(self.address, 0o600)
+
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        self.workers = [self._start_worker(context, listener) for _ in range(self.processes)]
+        print(f"Inference pool: {self.processes} processes x {self.threads} threads on {self.address}")
+
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            while True:
+                for i, process in enumerate(self.workers):
+                    if not process.is_alive():
+                        print(f"Inference worker {process.pid} exited with {process.exitcode}; restarting")
+                        self.workers[i] = self._start_worker(context, listener)
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in self.workers:
+                process.terminate()
+            for process in self.workers:
+                process.join()
+            listener.close()
+
+    def _start_worker(self, context, listener):
+        process = context.Process(
+            target=_worker_main, args=(listener, self.threads), name='inference-worker', daemon=True
+        )
+        process.start()
+        return process
+
+
+def _worker_main(listener, threads):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # Models are built here, after the fork, so no TensorFlow state is inherited
+    from .model_registry import registry
+    registry.warm_up()
+    handlers = _handlers()
+
+    serving = [
+        threading.Thread(target=_serve, args=(listener, handlers), daemon=True)
+        for _ in range(threads - 1)
+    ]
+    for thread in serving:
+        thread.start()
+    _serve(listener, handlers)
+
+
+def _serve(listener, handlers):
+    """Accept connections on the shared listener and answer one request per connection"""
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            print(f"Inference pool: rejected connection: {e}")
+            continue
+        with conn:
+            try:
+                method, args = conn.recv()
+                conn.send(('ok', handlers[method](*args)))
+            except Exception as e:
+                try:
+                    conn.send(('error', e))
+                except Exception:
+                    pass
+
+
+class InferenceClient:
+    """Sends inference calls from a web worker to the pool"""
+
+    def __init__(self, address=None, timeout=None):
+        self.address = address or get_pool_address()
+        self.authkey = get_pool_authkey()
+        self.timeout = timeout or settings.INFERENCE_POOL.get('timeout', 60)
+
+    def call(self, method, *args):
+        """Run a pool handler and return its result, re-raising its exception"""
+        with Client(self.address, family='AF_UNIX', authkey=self.authkey) as conn:
+            conn.send((method, args))
+            if not conn.poll(self.timeout):
+                raise TimeoutError(f"Inference pool did not answer within {self.timeout}s")
+            status, value = conn.recv()
+        if status == 'error':
+            raise value
+        return value
+
+
+_client = None
+
+
+def get_inference_client():
+    """Return the client for the inference pool, or None when inference runs in-process"""
+    global _client
+    if not settings.INFERENCE_POOL.get('enabled', False):
+        return None
+    if _client is None:
+        _client = InferenceClient()
+    return _client
+
+
+def start_pool():
+    """Run the inference pool in a forked supervisor process and return it"""
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    process = context.Process(target=_supervise, name='inference-pool')
+    process.start()
+    return process
+
+
+def _supervise():
+    # Drop handlers inherited from the parent (e.g. gunicorn's arbiter)
+    for signum in (signal.SIGHUP, signal.SIGQUIT, signal.SIGCHLD, signal.SIGUSR1,
+                   signal.SIGUSR2, signal.SIGWINCH, signal.SIGTTIN, signal.SIGTTOU):
+        signal.signal(signum, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    InferencePool().serve_forever()
@@ -0,0 +1,156 @@
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .audit_buffer import get_loaded_audit_buffer
+from .models import VerificationJob
+from .services import verify_and_record
+
+
+def enqueue_verification(known_image, new_image):
+    """Store a verification request for the worker pool and return the job"""
+    return VerificationJob.objects.create(known_image=known_image, new_image=new_image)
+
+
+def claim_next_job(worker_name, candidates=5):
+    """Atomically mark the oldest pending job as running for this worker
+
+    The status check is part of the UPDATE, so when several workers race for
+    the same row exactly one of them sees a changed row count; the others
+    move on to the next candidate. Returns None when the queue is empty.
+    """
+    pending = (
+        VerificationJob.objects
+        .filter(status=VerificationJob.PENDING)
+        .order_by('created_at')
+        .values_list('id', flat=True)[:candidates]
+    )
+    for job_id in list(pending):
+        claimed = VerificationJob.objects.filter(id=job_id, status=VerificationJob.PENDING).update(
+            status=VerificationJob.RUNNING,
+            worker=worker_name,
+            started_at=timezone.now(),
+            heartbeat_at=timezone.now(),
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            return VerificationJob.objects.get(id=job_id)
+    return None
+
+
+@contextmanager
+def heartbeat(job, interval=None):
+    """Renew job.heartbeat_at every interval seconds while the with block runs
+
+    requeue_stale_jobs() only takes back jobs whose heartbeat stopped, so a
+    slow job is left alone for as long as its worker is alive.
+    """
+    interval = interval or settings.VERIFICATION_JOBS.get('heartbeat_interval', 30)
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                try:
+                    VerificationJob.objects.filter(
+                        id=job.id, status=VerificationJob.RUNNING, worker=job.worker
+                    ).update(heartbeat_at=timezone.now())
+                except Exception as e:
+                    print(f"Error renewing heartbeat of verification job {job.id}: {e}")
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f'heartbeat-{job.id}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job):
+    """Run a claimed job and store its outcome"""
+    try:
+        with heartbeat(job):
+            job.result = verify_and_record(bytes(job.known_image), bytes(job.new_image))
+        job.status = VerificationJob.DONE
+        job.error = ''
+    except Exception as e:
+        print(f"Error running verification job {job.id}: {e}")
+        job.status = VerificationJob.FAILED
+        job.error = str(e)
+
+    # The images are only needed while the job is queued
+    job.known_image = None
+    job.new_image = None
+    job.finished_at = timezone.now()
+    job.save(update_fields=['result', 'status', 'error', 'known_image', 'new_image', 'finished_at'])
+    return job
+
+
+def requeue_stale_jobs(stale_after=None, max_attempts=None):
+    """Return abandoned running jobs to the queue, or fail them after max_attempts
+
+    A job stays running if its worker was killed mid-job. Workers renew
+    heartbeat_at while a job runs, so a job whose heartbeat is older than
+    stale_after seconds is assumed lost. Returns (requeued, failed).
+    """
+    config = settings.VERIFICATION_JOBS
+    stale_after = stale_after or config.get('stale_after', 300)
+    max_attempts = max_attempts or config.get('max_attempts', 3)
+
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    stale = VerificationJob.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+        status=VerificationJob.RUNNING
+    )
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=VerificationJob.FAILED,
+        error='Job abandoned by its worker too many times',
+        known_image=None,
+        new_image=None,
+        finished_at=timezone.now()
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(
+        status=VerificationJob.PENDING, worker=''
+    )
+    return requeued, failed
+
+
+def worker_name():
+    """Identify this process in VerificationJob.worker"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_worker(stop_event, poll_interval=None):
+    """Claim and run jobs until stop_event is set"""
+    poll_interval = poll_interval or settings.VERIFICATION_JOBS.get('poll_interval', 0.5)
+    name = worker_name()
+    try:
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                job = claim_next_job(name)
+            except Exception as e:
+                print(f"Error claiming verification job: {e}")
+                job = None
+            if job is None:
+                stop_event.wait(poll_interval)
+                continue
+            run_job(job)
+    finally:
+        # Pool processes leave through os._exit, which skips the buffer's atexit flush
+        audit_buffer = get_loaded_audit_buffer()
+        if audit_buffer is not None:
+            try:
+                audit_buffer.flush()
+            except Exception as e:
+                print(f"Error writing buffered verification records: {e}")
@@ -0,0 +1,66 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from verification.benchmarking import DEFAULT_SIZES, STAGES, load_model, run_benchmark
+
+
+def _size(value):
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise CommandError(f"Image sizes look like 1280x960, not {value!r}")
+    return width, height
+
+
+class Command(BaseCommand):
+    help = (
+        "Time each verification stage (base64 decode, image decode, detection, alignment, "
+        "embedding, distance, DB write) on synthetic faces and print p50/p95/p99 and peak RSS as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default='stub',
+                            help="'stub' (no weights, runs offline), 'deepface', or a dotted path to a "
+                                 "class with detect(img) and embed(face_images)")
+        parser.add_argument('--sizes', nargs='+', default=[f"{w}x{h}" for w, h in DEFAULT_SIZES],
+                            help="Image sizes as WIDTHxHEIGHT, smallest first")
+        parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                            help="Stages to time")
+        parser.add_argument('--repeat', type=int, default=50, help="Timed calls per stage and size")
+        parser.add_argument('--warmup', type=int, default=3, help="Untimed calls before each stage")
+        parser.add_argument('--no-db', action='store_true',
+                            help="Skip the DB write stage; its rows are otherwise deleted afterwards")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+        try:
+            model = load_model(options['model'])
+        except (ImportError, RuntimeError) as e:
+            raise CommandError(f"Cannot load benchmark model {options['model']!r}: {e}")
+
+        report = run_benchmark(
+            model,
+            sizes=[_size(value) for value in options['sizes']],
+            repeat=options['repeat'],
+            warmup=options['warmup'],
+            stages=options['stages'],
+            include_db=not options['no_db']
+        )
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            for size in report['sizes']:
+                self.stdout.write(f"{size['width']}x{size['height']} (peak RSS {size['peak_rss_mb']} MB)")
+                for stage, stats in size['stages'].items():
+                    self.stdout.write(
+                        f"  {stage:14} p50 {stats['p50_ms']:9.3f} ms  p95 {stats['p95_ms']:9.3f} ms  "
+                        f"p99 {stats['p99_ms']:9.3f} ms"
+                    )
+            self.stdout.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(output)
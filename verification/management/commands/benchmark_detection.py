@@ -0,0 +1,91 @@
+import time
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from verification import utils
+from verification.imaging import decode_image
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'}
+
+
+def _iou(a, b):
+    x1, y1 = max(a['x'], b['x']), max(a['y'], b['y'])
+    x2 = min(a['x'] + a['w'], b['x'] + b['w'])
+    y2 = min(a['y'] + a['h'], b['y'] + b['h'])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = a['w'] * a['h'] + b['w'] * b['h'] - inter
+    return inter / union if union else 0.0
+
+
+def _largest(faces):
+    return max(faces, key=lambda face: face['facial_area']['w'] * face['facial_area']['h'])
+
+
+class Command(BaseCommand):
+    help = "Compare face detection at full resolution against downscaled detection for latency and accuracy"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Image files or directories of images")
+        parser.add_argument('--max-side', type=int, nargs='+', default=[640, 960, 1280],
+                            help="Detection sizes to compare; one result line per value")
+        parser.add_argument('--repeat', type=int, default=1, help="Timed runs per image and setting")
+
+    def handle(self, *args, **options):
+        if not utils.DEEPFACE_AVAILABLE:
+            raise CommandError("deepface is not installed")
+
+        images = []
+        for path in map(Path, options['paths']):
+            files = sorted(path.iterdir()) if path.is_dir() else [path]
+            for file in files:
+                if file.suffix.lower() in IMAGE_EXTENSIONS:
+                    images.append((file.name, decode_image(file.read_bytes())))
+        if not images:
+            raise CommandError("No images found")
+        self.stdout.write(f"Loaded {len(images)} images, largest side up to "
+                          f"{max(max(img.shape[:2]) for _, img in images)} px")
+
+        baseline_seconds, baseline = self._run(images, 0, options['repeat'])
+        self.stdout.write(f"full resolution: {baseline_seconds * 1000:.1f} ms/image")
+
+        metric = utils.get_distance_metric()
+        threshold = utils.find_threshold(utils.get_model_name(), metric)
+        for max_side in options['max_side']:
+            seconds, faces = self._run(images, max_side, options['repeat'])
+            missed, ious, distances = 0, [], []
+            for reference, candidate in zip(baseline, faces):
+                if not reference:
+                    continue
+                if not candidate:
+                    missed += 1
+                    continue
+                reference, candidate = _largest(reference), _largest(candidate)
+                ious.append(_iou(reference['facial_area'], candidate['facial_area']))
+                distances.append(utils.find_distance(reference['embedding'], candidate['embedding'], metric))
+            self.stdout.write(
+                f"max_side={max_side}: {seconds * 1000:.1f} ms/image "
+                f"({baseline_seconds / seconds:.1f}x), missed faces {missed}, "
+                f"box IoU mean {np.mean(ious) if ious else float('nan'):.3f}, "
+                f"{metric} distance to full-resolution embedding mean "
+                f"{np.mean(distances) if distances else float('nan'):.4f} "
+                f"max {max(distances) if distances else float('nan'):.4f} (threshold {threshold})"
+            )
+
+    def _run(self, images, max_side, repeat):
+        """Return (mean detection seconds per image, per-image faces with embeddings)"""
+        elapsed = 0.0
+        results = []
+        for _, img in images:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                faces = utils.detect_faces(img, enforce_detection=False, max_side=max_side)
+                elapsed += time.perf_counter() - started
+            faces = [face for face in faces if face['confidence']]
+            embeddings = utils.embed_faces([face['face'] for face in faces])
+            results.append([
+                {'facial_area': face['facial_area'], 'embedding': embedding}
+                for face, embedding in zip(faces, embeddings)
+            ])
+        return elapsed / (len(images) * repeat), results
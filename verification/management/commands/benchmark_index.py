@@ -0,0 +1,64 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from verification.vector_index import EmbeddingIndex, IVFIndex
+from verification.utils import get_model_name
+
+
+class Command(BaseCommand):
+    help = "Report recall@k and latency of the approximate index against brute force on stored embeddings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=10, help="Neighbours per query")
+        parser.add_argument('--queries', type=int, default=200, help="Number of stored vectors used as queries")
+        parser.add_argument('--nlist', type=int, default=1024, help="Number of IVF clusters")
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64],
+                            help="Cluster counts to probe; one result line per value")
+        parser.add_argument('--noise', type=float, default=0.0,
+                            help="Gaussian noise added to each query vector")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        k = options['k']
+        exact = EmbeddingIndex(model_name=get_model_name())
+        exact.sync()
+        ids, vectors = exact.rows()
+        if len(ids) == 0:
+            raise CommandError("No stored FaceEmbedding rows to benchmark against")
+        self.stdout.write(f"Loaded {len(ids)} embeddings of dimension {exact.dimension}")
+
+        rng = np.random.default_rng(options['seed'])
+        picks = rng.choice(len(ids), min(options['queries'], len(ids)), replace=False)
+        queries = vectors[picks] + rng.normal(0, options['noise'], size=(len(picks), exact.dimension))
+
+        exact_seconds, truth = self._run(exact, queries, k)
+        self.stdout.write(f"exact: {exact_seconds * 1000:.2f} ms/query")
+
+        ivf = IVFIndex(model_name=exact.model_name, nlist=options['nlist'], train_min=0)
+        ivf.add(ids, vectors)
+        started = time.perf_counter()
+        ivf.train()
+        self.stdout.write(
+            f"ivf: trained {ivf.stats()['nlist']} clusters in {time.perf_counter() - started:.2f} s"
+        )
+
+        for nprobe in options['nprobe']:
+            ivf.nprobe = nprobe
+            seconds, found = self._run(ivf, queries, k)
+            recall = np.mean([
+                len(set(expected) & set(got)) / len(expected)
+                for expected, got in zip(truth, found) if expected
+            ])
+            self.stdout.write(
+                f"ivf nprobe={nprobe}: recall@{k}={recall:.4f} "
+                f"{seconds * 1000:.2f} ms/query ({exact_seconds / seconds:.1f}x vs exact)"
+            )
+
+    def _run(self, index, queries, k):
+        results = []
+        started = time.perf_counter()
+        for query in queries:
+            results.append([embedding_id for embedding_id, _ in index.search(query, k=k)])
+        return (time.perf_counter() - started) / len(queries), results
@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from verification.retention import Purger
+
+
+def _megabytes(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete old verification records, embeddings, finished jobs and stored images "
+        "by age and count; with --orphans, also remove blob files nothing refers to, and with "
+        "--legacy-max-age-days, files written before the blob store"
+    )
+
+    def add_arguments(self, parser):
+        config = settings.DATA_RETENTION
+        parser.add_argument('--max-age-days', type=float, default=config.get('max_age_days'),
+                            help="Purge data older than this many days")
+        parser.add_argument('--max-records', type=int, default=config.get('max_records'),
+                            help="Keep only this many of the newest verification records")
+        parser.add_argument('--max-embeddings', type=int, default=config.get('max_embeddings'),
+                            help="Keep only this many of the newest embeddings no record refers to")
+        parser.add_argument('--chunk-size', type=int, default=config.get('chunk_size', 1000),
+                            help="Rows deleted per statement")
+        parser.add_argument('--file-workers', type=int, default=config.get('file_workers', 8),
+                            help="Threads used to remove files")
+        parser.add_argument('--orphans', action='store_true', default=config.get('sweep_orphans', False),
+                            help="Also delete files laid out like stored blobs that no StoredBlob or record "
+                                 "refers to; files written before the blob store are never touched")
+        parser.add_argument('--legacy-max-age-days', type=float, default=config.get('legacy_max_age_days'),
+                            help="Also delete captures and uploads written before the blob store that no "
+                                 "record refers to and that have not been modified for this many days")
+        parser.add_argument('--orphan-grace-seconds', type=float,
+                            default=config.get('orphan_grace_seconds', 3600),
+                            help="Leave unreferenced files younger than this alone")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report what would be deleted without changing anything")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['file_workers'] < 1:
+            raise CommandError("--chunk-size and --file-workers must be at least 1")
+        if options['legacy_max_age_days'] is not None and options['legacy_max_age_days'] < 0:
+            raise CommandError("--legacy-max-age-days must not be negative")
+        for option in ('max_records', 'max_embeddings'):
+            if options[option] is not None and options[option] < 1:
+                raise CommandError(f"--{option.replace('_', '-')} must be at least 1")
+
+        purger = Purger(
+            max_age_days=options['max_age_days'],
+            max_records=options['max_records'],
+            max_embeddings=options['max_embeddings'],
+            chunk_size=options['chunk_size'],
+            file_workers=options['file_workers'],
+            orphan_grace_seconds=options['orphan_grace_seconds'],
+            dry_run=options['dry_run']
+        )
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+
+        self.stdout.write(f"{verb} {purger.purge_jobs()} finished verification jobs")
+        self.stdout.write(f"{verb} {purger.purge_records()} verification records")
+        embeddings = purger.purge_embeddings()
+        self.stdout.write(f"{verb} {embeddings} face embeddings")
+
+        total = 0
+        for store in settings.BLOB_STORAGE['stores']:
+            files, size = purger.purge_blobs(store)
+            total += size
+            self.stdout.write(f"{verb} {files} stored {store} files ({_megabytes(size)})")
+            if options['orphans']:
+                orphans, orphan_size = purger.purge_orphans(store)
+                total += orphan_size
+                self.stdout.write(f"{verb} {orphans} orphaned {store} files ({_megabytes(orphan_size)})")
+            if options['legacy_max_age_days'] is not None:
+                legacy, legacy_size = purger.purge_legacy_files(store, options['legacy_max_age_days'])
+                total += legacy_size
+                self.stdout.write(f"{verb} {legacy} legacy {store} files ({_megabytes(legacy_size)})")
+        self.stdout.write(f"{'Would reclaim' if options['dry_run'] else 'Reclaimed'} {_megabytes(total)} on disk")
+        if embeddings and not options['dry_run']:
+            reconcile = settings.FACE_INDEX.get('options', {}).get('reconcile_interval', 60)
+            self.stdout.write(
+                f"Running processes drop purged embeddings from their search index within {reconcile:g} seconds"
+            )
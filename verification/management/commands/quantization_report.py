@@ -0,0 +1,134 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from verification.models import FaceEmbedding
+from verification.quantization import ENCODINGS, bytes_per_vector, dequantize, quantize
+from verification.utils import find_threshold, get_distance_metric, get_model_name
+from verification.vector_index import EmbeddingIndex, similarity_to_distance
+
+
+class Command(BaseCommand):
+    help = "Report the accuracy lost by float16 and int8 embeddings against the stored float32 vectors"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--encodings', nargs='+', default=['float16', 'int8'],
+                            choices=[name for name in ENCODINGS if name != 'float32'])
+        parser.add_argument('--k', type=int, default=10, help="Neighbours per query")
+        parser.add_argument('--queries', type=int, default=200, help="Number of stored vectors used as queries")
+        parser.add_argument('--rerank-factor', type=int, default=4,
+                            help="Candidates re-scored at full precision per requested neighbour")
+        parser.add_argument('--pairs', type=int, default=10000,
+                            help="Random pairs compared besides each query's nearest neighbours")
+        parser.add_argument('--noise', type=float, default=0.0,
+                            help="Gaussian noise added to each query vector")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        model_name = get_model_name()
+        k = options['k']
+        encodings = dict(
+            FaceEmbedding.objects.filter(model_name=model_name)
+            .values_list('encoding').annotate(count=Count('id'))
+        )
+        self.stdout.write("Stored rows by encoding: " + ", ".join(
+            f"{name}={count}" for name, count in sorted(encodings.items())
+        ) if encodings else "No stored rows")
+
+        ids, vectors = self._load(model_name)
+        if len(ids) == 0:
+            raise CommandError("No float32 FaceEmbedding rows to measure against")
+        count, dimension = vectors.shape
+        self.stdout.write(f"Loaded {count} float32 embeddings of dimension {dimension}")
+
+        rng = np.random.default_rng(options['seed'])
+        picks = rng.choice(count, min(options['queries'], count), replace=False)
+        queries = vectors[picks] + rng.normal(0, options['noise'], size=(len(picks), dimension))
+
+        exact = EmbeddingIndex(model_name=model_name)
+        exact.add(ids, vectors)
+        exact_seconds, truth = self._run(exact, queries, k)
+        self.stdout.write(
+            f"float32: {bytes_per_vector(dimension, 'float32')} B/vector, "
+            f"{count * bytes_per_vector(dimension, 'float32') / 2**20:.1f} MB, {exact_seconds * 1000:.2f} ms/query"
+        )
+
+        # Each query's true neighbours are the pairs a verification is most likely to flip on
+        positions = {embedding_id: position for position, embedding_id in enumerate(ids.tolist())}
+        near = [(pick, positions[neighbour]) for pick, found in zip(picks, truth) for neighbour in found]
+        far = rng.integers(0, count, size=(options['pairs'], 2))
+        pairs = np.array(near + far.tolist(), dtype=np.int64).reshape(-1, 2)
+
+        metric = get_distance_metric()
+        threshold = find_threshold(model_name, metric)
+        unit = vectors / self._norms(vectors)
+        full = self._distances(unit, pairs, metric)
+
+        for encoding in options['encodings']:
+            codes, scales = quantize(vectors, encoding)
+            decoded = dequantize(codes, encoding, scales)
+            decoded_unit = decoded / self._norms(decoded)
+            cosine_error = 1 - np.sum(unit * decoded_unit, axis=1)
+            distances = self._distances(decoded_unit, pairs, metric)
+            distance_error = np.abs(distances - full)
+            flips = np.count_nonzero((distances <= threshold) != (full <= threshold))
+            size = bytes_per_vector(dimension, encoding)
+            self.stdout.write(
+                f"{encoding}: {size} B/vector, {count * size / 2**20:.1f} MB; "
+                f"reconstruction 1-cos mean={cosine_error.mean():.2e} max={cosine_error.max():.2e}; "
+                f"{metric} distance error mean={distance_error.mean():.2e} max={distance_error.max():.2e}; "
+                f"decisions flipped at {threshold}: {flips}/{len(pairs)}"
+            )
+
+            for rerank_factor in (1, options['rerank_factor']):
+                index = EmbeddingIndex(model_name=model_name, quantization=encoding, rerank_factor=rerank_factor)
+                index.add(ids, vectors)
+                seconds, found = self._run(index, queries, k)
+                recall = np.mean([
+                    len(set(expected) & set(got)) / len(expected)
+                    for expected, got in zip(truth, found) if expected
+                ])
+                label = "no re-rank" if rerank_factor == 1 else f"re-rank x{rerank_factor}"
+                self.stdout.write(
+                    f"{encoding} search, {label}: recall@{k}={recall:.4f} {seconds * 1000:.2f} ms/query"
+                )
+
+    def _load(self, model_name, chunk_size=10000):
+        rows = (
+            FaceEmbedding.objects
+            .filter(model_name=model_name, encoding='float32', vector__isnull=False)
+            .order_by('id')
+            .values_list('id', 'vector')
+            .iterator(chunk_size=chunk_size)
+        )
+        ids, data, dimension = [], [], None
+        for pk, vector in rows:
+            vector = bytes(vector)
+            if dimension is None:
+                dimension = len(vector) // ENCODINGS['float32'].itemsize
+            if len(vector) != dimension * ENCODINGS['float32'].itemsize:
+                continue
+            ids.append(pk)
+            data.append(vector)
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+        vectors = np.frombuffer(b''.join(data), dtype=ENCODINGS['float32']).reshape(len(ids), dimension)
+        return np.array(ids, dtype=np.int64), vectors
+
+    def _norms(self, vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return norms
+
+    def _distances(self, unit, pairs, metric):
+        similarities = np.sum(unit[pairs[:, 0]] * unit[pairs[:, 1]], axis=1)
+        return np.array([similarity_to_distance(float(similarity), metric) for similarity in similarities])
+
+    def _run(self, index, queries, k):
+        results = []
+        started = time.perf_counter()
+        for query in queries:
+            results.append([embedding_id for embedding_id, _ in index.search(query, k=k)])
+        return (time.perf_counter() - started) / len(queries), results
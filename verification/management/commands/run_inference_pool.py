@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from verification.inference_pool import InferencePool, get_pool_size
+
+
+class Command(BaseCommand):
+    help = "Run the pre-fork face inference pool that web workers send detection and embedding to"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+                            help="Inference processes (default: CPU cores // intra_op_threads)")
+        parser.add_argument('--threads', type=int, default=None,
+                            help="Concurrent requests served per process")
+        parser.add_argument('--address', default=None, help="Unix socket path to listen on")
+
+    def handle(self, *args, **options):
+        pool = InferencePool(
+            address=options['address'],
+            processes=options['processes'] or get_pool_size(),
+            threads=options['threads']
+        )
+        pool.serve_forever()
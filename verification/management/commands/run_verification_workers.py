@@ -0,0 +1,80 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from verification.jobs import run_worker, requeue_stale_jobs
+from verification.model_registry import registry
+
+
+def _worker_main(stop_event, poll_interval):
+    # Signals sent to the whole process group are handled by the parent,
+    # which sets stop_event so each worker finishes its current job first
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    # TensorFlow is not fork-safe, so the parent never loads it and each
+    # worker builds its own models after the fork
+    registry.warm_up()
+    run_worker(stop_event, poll_interval=poll_interval)
+
+
+class Command(BaseCommand):
+    help = "Run a pool of worker processes that execute queued verification jobs"
+
+    def add_arguments(self, parser):
+        config = settings.VERIFICATION_JOBS
+        parser.add_argument('--processes', type=int, default=config.get('processes', 2),
+                            help="Number of worker processes")
+        parser.add_argument('--poll-interval', type=float, default=config.get('poll_interval', 0.5),
+                            help="Seconds an idle worker waits before polling the queue again")
+        parser.add_argument('--stale-after', type=float, default=config.get('stale_after', 300),
+                            help="Seconds without a heartbeat after which a running job is returned to the queue")
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError("--processes must be at least 1")
+
+        # Workers are forked so they inherit the configured Django setup;
+        # database connections must not be shared across the fork
+        context = multiprocessing.get_context('fork')
+        stop_event = context.Event()
+        connections.close_all()
+
+        def start_worker():
+            process = context.Process(
+                target=_worker_main,
+                args=(stop_event, options['poll_interval']),
+                name='verification-worker',
+                daemon=True
+            )
+            process.start()
+            return process
+
+        workers = [start_worker() for _ in range(options['processes'])]
+        self.stdout.write(f"Started {len(workers)} verification workers")
+
+        # Treat SIGTERM like Ctrl-C so shutdown runs outside the signal handler
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            while not stop_event.is_set():
+                requeued, failed = requeue_stale_jobs(stale_after=options['stale_after'])
+                if requeued or failed:
+                    self.stdout.write(f"Requeued {requeued} and failed {failed} abandoned jobs")
+                connections.close_all()
+
+                for i, process in enumerate(workers):
+                    if not process.is_alive() and not stop_event.is_set():
+                        self.stderr.write(f"Worker {process.pid} exited with {process.exitcode}; restarting")
+                        workers[i] = start_worker()
+
+                stop_event.wait(min(options['stale_after'], 5.0))
+        except KeyboardInterrupt:
+            pass
+
+        stop_event.set()
+        self.stdout.write("Waiting for workers to finish their current job")
+        for process in workers:
+            process.join()
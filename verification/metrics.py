@@ -0,0 +1,330 @@
+"""In-process metrics in the Prometheus text exposition format
+
+Counters and histograms are plain dicts behind a lock, so recording costs
+a few microseconds and can stay on in production. Values are kept per
+process. With METRICS['multiprocess_dir'] set, every process (web
+workers, inference pool and job workers) writes its values to its own
+file there at most every write_interval seconds, and /metrics serves the
+sum over all files, so one scrape covers every worker. Without it,
+/metrics reports only the process that served the scrape.
+"""
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination"""
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # An unlabelled counter reports 0 before its first increment
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _changed()
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values = {} if self.labelnames else {(): 0}
+
+    def merge(self, total, value):
+        return value if total is None else total + value
+
+    def samples(self, values=None):
+        if values is None:
+            values = {tuple(key): value for key, value in self.snapshot()}
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram:
+    """Bucketed observations per label combination, cumulative on output"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+        _changed()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), [list(counts), total]] for key, (counts, total) in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def merge(self, total, value):
+        if total is None:
+            return [list(value[0]), value[1]]
+        return [[a + b for a, b in zip(total[0], value[0])], total[1] + value[1]]
+
+    def samples(self, values=None):
+        if values is None:
+            values = {tuple(key): value for key, value in self.snapshot()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                labels = _labels(self.labelnames, key, [('le', _number(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+class Registry:
+    """Metrics plus collectors that read other components' counters at scrape time"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Register a callable returning (name, type, documentation, [(labels dict, value)])"""
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        """Return this process's values as JSON-serializable data, for render() in any process"""
+        return {
+            'metrics': {metric.name: metric.snapshot() for metric in self.metrics},
+            'collected': [
+                [name, metric_type, documentation, [[labels, value] for labels, value in samples]]
+                for collector in self.collectors
+                for name, metric_type, documentation, samples in collector()
+            ],
+        }
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+    def render(self, snapshots=None):
+        """Return every metric in the text exposition format, summed over snapshots (default: this process)"""
+        if snapshots is None:
+            snapshots = [self.snapshot()]
+        lines = []
+        for metric in self.metrics:
+            values = {}
+            for snapshot in snapshots:
+                for key, value in snapshot['metrics'].get(metric.name, []):
+                    values[tuple(key)] = metric.merge(values.get(tuple(key)), value)
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples(values))
+
+        collected = {}
+        for snapshot in snapshots:
+            for name, metric_type, documentation, samples in snapshot['collected']:
+                _, _, values = collected.setdefault(name, (metric_type, documentation, {}))
+                for labels, value in samples:
+                    key = tuple(labels.items())
+                    values[key] = values.get(key, 0) + value
+        for name, (metric_type, documentation, values) in collected.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, value in values.items():
+                lines.append(f"{name}{_labels([label for label, _ in key], [v for _, v in key])} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'face_verification_stage_seconds',
+    "Time spent in each verification stage: decode, detect, embed, db_write",
+    ['stage']
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    'http_request_duration_seconds',
+    "Total request time by URL name, method and status",
+    ['view', 'method', 'status']
+))
+RESULTS = registry.register(Counter(
+    'face_verification_results_total',
+    "Completed face comparisons by result: verified or rejected",
+    ['result']
+))
+NO_FACE = registry.register(Counter(
+    'face_verification_no_face_total',
+    "Images in which no face was detected"
+))
+ERRORS = registry.register(Counter(
+    'face_verification_errors_total',
+    "Face comparisons that failed with an exception, by exception type",
+    ['exception']
+))
+
+
+def _collect_embedding_cache():
+    from .embedding_cache import get_embedding_cache
+    cache = get_embedding_cache()
+    if cache is None:
+        return []
+    stats = cache.stats()
+    return [
+        ('face_embedding_cache_lookups_total', 'counter', "Embedding cache lookups by result", [
+            ({'result': 'memory_hit'}, stats['memory_hits']),
+            ({'result': 'disk_hit'}, stats['disk_hits']),
+            ({'result': 'miss'}, stats['misses']),
+        ]),
+    ]
+
+
+registry.add_collector(_collect_embedding_cache)
+
+
+# Multiprocess export: each process owns one file, named so a reused pid
+# never overwrites the counts of a process that has exited
+_export_lock = threading.Lock()
+_export_state = {'started': False, 'version': 0, 'path': None}
+
+
+def _changed():
+    _export_state['version'] += 1
+    if not _export_state['started']:
+        _start_exporter()
+
+
+def _start_exporter():
+    with _export_lock:
+        if _export_state['started']:
+            return
+        _export_state['started'] = True
+        directory = settings.METRICS.get('multiprocess_dir')
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        _export_state['path'] = os.path.join(str(directory), f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+        threading.Thread(
+            target=_export, args=(settings.METRICS.get('write_interval', 1.0),),
+            name='metrics-exporter', daemon=True
+        ).start()
+        atexit.register(write_snapshot)
+
+
+def _export(interval):
+    written = None
+    while True:
+        time.sleep(interval)
+        version = _export_state['version']
+        if version != written:
+            try:
+                write_snapshot()
+                written = version
+            except Exception as e:
+                print(f"Error writing metrics snapshot: {e}")
+
+
+def write_snapshot():
+    """Write this process's values to its file in the multiprocess directory, if it has one"""
+    path = _export_state['path']
+    if path is None:
+        return
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def read_snapshots(directory):
+    """Return the snapshots of every process that has written to the directory"""
+    snapshots = []
+    for path in glob.glob(os.path.join(str(directory), '*.json')):
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # removed or replaced while listing
+    return snapshots
+
+
+def render_all():
+    """Render /metrics: summed over the multiprocess directory when configured, else this process"""
+    directory = settings.METRICS.get('multiprocess_dir')
+    if not directory:
+        return registry.render()
+    write_snapshot()
+    return registry.render(read_snapshots(directory))
+
+
+def _after_fork():
+    # A forked child starts from zero with its own file; the parent's
+    # values stay in the parent's file. Locks another thread held at the
+    # fork would never be released in the child, so they are replaced.
+    global _export_lock
+    _export_lock = threading.Lock()
+    _export_state.update(started=False, version=0, path=None)
+    for metric in registry.metrics:
+        metric._lock = threading.Lock()
+    registry.reset()
+
+
+os.register_at_fork(after_in_child=_after_fork)
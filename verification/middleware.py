@@ -0,0 +1,81 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+from . import profiling
+from .metrics import REQUEST_SECONDS
+
+
+def _observe(request, response, started):
+    match = getattr(request, 'resolver_match', None)
+    view = match.url_name if match is not None and match.url_name else 'unmatched'
+    if view == 'metrics':
+        return
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - started, view=view, method=request.method, status=response.status_code
+    )
+
+
+@sync_and_async_middleware
+def request_metrics_middleware(get_response):
+    """Record total request time by URL name, method and status
+
+    Supports both sync and async chains so the async views are not forced
+    through a thread. Labelled by url_name rather than path to keep the
+    number of series bounded.
+    """
+    if not settings.METRICS.get('enabled', True):
+        raise MiddlewareNotUsed
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            response = await get_response(request)
+            _observe(request, response, started)
+            return response
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            response = get_response(request)
+            _observe(request, response, started)
+            return response
+    return middleware
+
+
+@sync_and_async_middleware
+def request_profiling_middleware(get_response):
+    """Run sampled or explicitly requested requests under cProfile and tracemalloc
+
+    Removed from the chain when REQUEST_PROFILING is disabled. For async
+    views the profile also covers whatever else ran on the event loop
+    meanwhile.
+    """
+    config = settings.REQUEST_PROFILING
+    if not config.get('enabled', False):
+        raise MiddlewareNotUsed
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            capture = profiling.begin(request, config)
+            if capture is None:
+                return await get_response(request)
+            try:
+                response = await get_response(request)
+            finally:
+                profiling.end(capture)
+            await sync_to_async(profiling.save)(capture, request, response, config)
+            return response
+    else:
+        def middleware(request):
+            capture = profiling.begin(request, config)
+            if capture is None:
+                return get_response(request)
+            try:
+                response = get_response(request)
+            finally:
+                profiling.end(capture)
+            profiling.save(capture, request, response, config)
+            return response
+    return middleware
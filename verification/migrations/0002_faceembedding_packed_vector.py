@@ -0,0 +1,48 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('verification', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='faceembedding',
+            name='embedding_data',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name='faceembedding',
+            name='dimension',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='faceembedding',
+            name='face_confidence',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='faceembedding',
+            name='facial_area',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='faceembedding',
+            name='is_normalized',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='faceembedding',
+            name='model_name',
+            field=models.CharField(default='Facenet', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='faceembedding',
+            name='vector',
+            field=models.BinaryField(null=True),
+        ),
+    ]
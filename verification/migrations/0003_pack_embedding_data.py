@@ -0,0 +1,104 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:03
+
+import numpy as np
+from django.db import migrations
+
+
+def _faces(embedding_data):
+    """Return the faces of a legacy JSON embedding as dicts"""
+    if isinstance(embedding_data, dict):
+        return [embedding_data]
+    if embedding_data and not isinstance(embedding_data[0], dict):
+        return [{'embedding': embedding_data}]  # a bare list of floats
+    return list(embedding_data)
+
+
+def _pack(embedding):
+    """Return the embedding as a 1-D float32 array, or None if it is not one"""
+    if embedding is None:
+        return None
+    try:
+        vector = np.asarray(embedding, dtype='<f4')
+    except (TypeError, ValueError):
+        return None
+    if vector.ndim != 1 or vector.shape[0] == 0:
+        return None
+    return vector
+
+
+def pack_embeddings(apps, schema_editor):
+    FaceEmbedding = apps.get_model('verification', 'FaceEmbedding')
+    rows = FaceEmbedding.objects.filter(vector__isnull=True).only('id', 'embedding_data')
+    batch = []
+    unreadable = []
+    several_faces = []
+    for row in rows.iterator(chunk_size=500):
+        if not row.embedding_data:
+            continue  # nothing stored, nothing to lose
+        faces = _faces(row.embedding_data)
+        if len(faces) > 1:
+            # A row holds one vector; packing only the first face would drop the rest
+            several_faces.append(row.id)
+            continue
+        face = faces[0]
+        vector = _pack(face.get('embedding'))
+        if vector is None:
+            unreadable.append(row.id)
+            continue
+        row.vector = vector.tobytes()
+        row.dimension = vector.shape[0]
+        row.is_normalized = False
+        row.facial_area = face.get('facial_area')
+        row.face_confidence = face.get('face_confidence')
+        batch.append(row)
+        if len(batch) >= 500:
+            FaceEmbedding.objects.bulk_update(
+                batch, ['vector', 'dimension', 'is_normalized', 'facial_area', 'face_confidence']
+            )
+            batch = []
+    if batch:
+        FaceEmbedding.objects.bulk_update(
+            batch, ['vector', 'dimension', 'is_normalized', 'facial_area', 'face_confidence']
+        )
+    # 0004 drops embedding_data, so stop before those rows lose their only copy
+    problems = []
+    if unreadable:
+        problems.append(f"{len(unreadable)} have embedding_data that is not an embedding (ids {_ids(unreadable)})")
+    if several_faces:
+        problems.append(
+            f"{len(several_faces)} store more than one face, and only one fits the packed vector "
+            f"(ids {_ids(several_faces)}); split them into one row per face"
+        )
+    if problems:
+        raise RuntimeError(
+            f"FaceEmbedding rows cannot be packed: {'; '.join(problems)}. "
+            "Fix or delete them, then run migrate again."
+        )
+
+
+def _ids(pks, shown=50):
+    more = f" and {len(pks) - shown} more" if len(pks) > shown else ''
+    return ', '.join(str(pk) for pk in pks[:shown]) + more
+
+
+def unpack_embeddings(apps, schema_editor):
+    FaceEmbedding = apps.get_model('verification', 'FaceEmbedding')
+    rows = FaceEmbedding.objects.exclude(vector__isnull=True)
+    for row in rows.iterator(chunk_size=500):
+        row.embedding_data = [{
+            'embedding': np.frombuffer(row.vector, dtype='<f4').tolist(),
+            'facial_area': row.facial_area,
+            'face_confidence': row.face_confidence,
+        }]
+        row.save(update_fields=['embedding_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('verification', '0002_faceembedding_packed_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(pack_embeddings, unpack_embeddings),
+    ]
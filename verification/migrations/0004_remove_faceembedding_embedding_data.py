@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:03
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('verification', '0003_pack_embedding_data'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='faceembedding',
+            name='embedding_data',
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:10
+
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('verification', '0004_remove_faceembedding_embedding_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VerificationJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('known_image', models.BinaryField(null=True)),
+                ('new_image', models.BinaryField(null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='verificatio_status_508fd0_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('verification', '0005_verificationjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='verificationrecord',
+            index=models.Index(fields=['-verification_date', '-id'], name='verif_record_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='verificationrecord',
+            index=models.Index(fields=['is_verified', '-verification_date', '-id'], name='verif_record_outcome_idx'),
+        ),
+    ]
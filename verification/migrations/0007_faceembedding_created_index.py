@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('verification', '0006_verificationrecord_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='faceembedding',
+            index=models.Index(fields=['-created_at'], name='face_embedding_created_idx'),
+        ),
+    ]
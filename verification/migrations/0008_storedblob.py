@@ -0,0 +1,30 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:28
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('verification', '0007_faceembedding_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('store', models.CharField(max_length=32)),
+                ('sha256', models.CharField(max_length=64)),
+                ('name', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='storedblob',
+            constraint=models.UniqueConstraint(fields=('store', 'sha256'), name='unique_blob_per_store'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('verification', '0008_storedblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faceembedding',
+            name='encoding',
+            field=models.CharField(choices=[('float32', 'float32'), ('float16', 'float16'), ('int8', 'int8')], default='float32', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='faceembedding',
+            name='scale',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('verification', '0009_faceembedding_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='verificationjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
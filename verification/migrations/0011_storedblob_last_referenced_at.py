@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:58
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_at(apps, schema_editor):
+    # Existing blobs were last known to be referenced when first stored
+    StoredBlob = apps.get_model('verification', 'StoredBlob')
+    StoredBlob.objects.update(last_referenced_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('verification', '0010_verificationjob_heartbeat_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedblob',
+            name='last_referenced_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+    ]
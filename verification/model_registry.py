@@ -0,0 +1,126 @@
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+
+from . import utils
+
+
+class ModelRegistry:
+    """Builds the face models once per process and keeps them warm"""
+
+    COLD = 'cold'
+    WARMING = 'warming'
+    READY = 'ready'
+    FAILED = 'failed'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.models = {}
+        self.state = self.COLD
+        self.error = None
+        self.warmup_seconds = None
+
+    def is_ready(self):
+        """Return True once the models are built and a warm-up inference has run"""
+        return self.state == self.READY
+
+    def get_model(self, task, model_name):
+        """Return a built model, building it on first use"""
+        key = (task, model_name)
+        model = self.models.get(key)
+        if model is None:
+            model = utils.DeepFace.build_model(model_name=model_name, task=task)
+            self.models[key] = model
+        return model
+
+    def load_models(self):
+        """Build the recognition model and every detector in the cascade, without inference"""
+        self.get_model('facial_recognition', utils.get_model_name())
+        for stage in utils.get_detector_cascade():
+            self.get_model('face_detector', stage['backend'])
+
+    def warm_up(self):
+        """Build the recognition and detection models and trace them once"""
+        with self._lock:
+            if self.state in (self.WARMING, self.READY):
+                return self.state == self.READY
+            self.state = self.WARMING
+
+        if not utils.DEEPFACE_AVAILABLE:
+            self.error = 'deepface library not installed'
+            self.state = self.FAILED
+            return False
+
+        started = time.perf_counter()
+        try:
+            self.load_models()
+
+            # Run one full detect + embed pass through the same functions the
+            # request path uses, so the first TensorFlow graph trace happens
+            # here rather than on a request thread
+            faces = utils.detect_faces(synthetic_face_image())
+            utils.embed_faces([face['face'] for face in faces])
+        except Exception as e:
+            print(f"Error warming up face models: {e}")
+            self.error = str(e)
+            self.state = self.FAILED
+            return False
+
+        self.warmup_seconds = time.perf_counter() - started
+        self.error = None
+        self.state = self.READY
+        return True
+
+    def start(self, background=True):
+        """Start warming the models, optionally on a daemon thread"""
+        if not background:
+            return self.warm_up()
+
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._thread = threading.Thread(
+                target=self.warm_up, name='face-model-warmup', daemon=True
+            )
+        self._thread.start()
+        return False
+
+    def status(self):
+        """Return a JSON-serializable summary for the readiness endpoint"""
+        return {
+            'ready': self.is_ready(),
+            'state': self.state,
+            'models': [f"{task}:{name}" for task, name in self.models],
+            'warmup_seconds': self.warmup_seconds,
+            'error': self.error,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+
+def peak_rss_mb():
+    """Return this process's peak resident set size so far in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def synthetic_face_image(size=224):
+    """Return a BGR image with a rough face shape for warm-up inference"""
+    img = np.full((size, size, 3), 200, dtype=np.uint8)
+    yy, xx = np.mgrid[:size, :size]
+    center = size / 2
+    face = ((xx - center) / (size * 0.3)) ** 2 + ((yy - center) / (size * 0.4)) ** 2 <= 1
+    img[face] = (120, 150, 190)
+    for eye_x in (center - size * 0.12, center + size * 0.12):
+        eye = (xx - eye_x) ** 2 + (yy - center * 0.85) ** 2 <= (size * 0.04) ** 2
+        img[eye] = (40, 40, 40)
+    mouth = (np.abs(yy - center * 1.35) <= size * 0.02) & (np.abs(xx - center) <= size * 0.1)
+    img[mouth] = (60, 60, 140)
+    return img
+
+
+registry = ModelRegistry()
@@ -1,19 +1,84 @@
 from django.db import models
 from django.utils import timezone
+import numpy as np
+import base64
 import json
+import uuid
+
+from .quantization import ENCODINGS, check_encoding, decode_vector, encode_vector
+
+# Stored vectors are packed little-endian float32 unless encoding says otherwise
+VECTOR_DTYPE = np.dtype('<f4')
 
 class FaceEmbedding(models.Model):
     """Model to store face embeddings"""
-    embedding_data = models.JSONField()
+    vector = models.BinaryField(null=True)  # packed as encoding says, see quantization.py
+    encoding = models.CharField(max_length=8, choices=[(name, name) for name in ENCODINGS], default='float32')
+    scale = models.FloatField(null=True, blank=True)  # int8 only: vector = codes * scale
+    model_name = models.CharField(max_length=50, default='Facenet')
+    dimension = models.PositiveIntegerField(null=True)
+    is_normalized = models.BooleanField(default=False)
+    facial_area = models.JSONField(null=True, blank=True)
+    face_confidence = models.FloatField(null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        # "Latest embedding" lookups read the newest row by created_at
+        indexes = [
+            models.Index(fields=['-created_at'], name='face_embedding_created_idx'),
+        ]
+    
     def __str__(self):
         return f"Face Embedding {self.id} - {self.created_at}"
     
+    @classmethod
+    def from_face(cls, face, model_name, normalize=False, encoding='float32'):
+        """Build an unsaved row from one DeepFace.represent result"""
+        vector = np.asarray(face['embedding'], dtype=VECTOR_DTYPE)
+        if normalize:
+            vector = vector / np.linalg.norm(vector)
+        packed, scale = encode_vector(vector, check_encoding(encoding))
+        return cls(
+            vector=packed,
+            encoding=encoding,
+            scale=scale,
+            model_name=model_name,
+            dimension=vector.shape[0],
+            is_normalized=normalize,
+            facial_area=face.get('facial_area'),
+            face_confidence=face.get('face_confidence')
+        )
+    
+    def get_vector(self):
+        """Return the embedding as float32; a read-only view over the stored bytes when stored as float32"""
+        if self.vector is None:
+            return None
+        return decode_vector(self.vector, self.encoding, self.scale)
+    
+    def get_vector_bytes(self):
+        """Return the vector packed as little-endian float32, whatever its stored encoding"""
+        if self.vector is None:
+            return None
+        if self.encoding == 'float32':
+            return bytes(self.vector)
+        return self.get_vector().astype(VECTOR_DTYPE).tobytes()
+    
+    def get_vector_base64(self):
+        """Return the packed float32 vector as base64 text"""
+        if self.vector is None:
+            return None
+        return base64.b64encode(self.get_vector_bytes()).decode('ascii')
+    
     def get_embedding(self):
-        """Return the embedding as a list"""
-        return self.embedding_data
+        """Return the embedding in the legacy DeepFace.represent list shape"""
+        if self.vector is None:
+            return []
+        return [{
+            'embedding': self.get_vector().tolist(),
+            'facial_area': self.facial_area,
+            'face_confidence': self.face_confidence
+        }]
 
 class VerificationRecord(models.Model):
     """Model to store verification attempts"""
@@ -23,5 +88,66 @@ class VerificationRecord(models.Model):
     verification_date = models.DateTimeField(default=timezone.now)
     embedding = models.ForeignKey(FaceEmbedding, on_delete=models.CASCADE, null=True, blank=True)
     
+    class Meta:
+        # Keyset pagination walks (verification_date, id) newest first,
+        # optionally within one outcome
+        indexes = [
+            models.Index(fields=['-verification_date', '-id'], name='verif_record_date_id_idx'),
+            models.Index(fields=['is_verified', '-verification_date', '-id'], name='verif_record_outcome_idx'),
+        ]
+    
     def __str__(self):
         return f"Verification {self.id} - {'Success' if self.is_verified else 'Failed'} - {self.verification_date}"
+
+
+class VerificationJob(models.Model):
+    """Queued verification request, processed by run_verification_workers"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    known_image = models.BinaryField(null=True)  # cleared once the job finishes
+    new_image = models.BinaryField(null=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # renewed by the worker while running
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"Verification job {self.id} - {self.status}"
+
+
+class StoredBlob(models.Model):
+    """A file in a BlobStore, shared by every capture or upload with the same content"""
+    store = models.CharField(max_length=32)
+    sha256 = models.CharField(max_length=64)
+    name = models.CharField(max_length=255)  # path relative to the store root
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Set by every save() of this content; age-based retention counts from here
+    last_referenced_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'sha256'], name='unique_blob_per_store'),
+        ]
+
+    def __str__(self):
+        return f"{self.store}:{self.sha256} ({self.ref_count} refs)"
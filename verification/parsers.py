@@ -0,0 +1,90 @@
+import io
+import json
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import BaseParser, MultiPartParser
+
+
+class ImageTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Uploaded image is too large.'
+    default_code = 'image_too_large'
+
+
+class BoundedMemoryUploadHandler(FileUploadHandler):
+    """Keeps each uploaded file in memory, rejecting any larger than max_size
+
+    Unlike Django's default handlers, large files are never spooled to a
+    temporary file; the chunks are joined once when the part ends and the
+    resulting bytes are returned by read() without another copy.
+    """
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size or settings.MAX_CONTENT_LENGTH
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.chunks = []
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > self.max_size:
+            raise ImageTooLarge(f"'{self.field_name}' exceeds {self.max_size} bytes")
+        self.chunks.append(raw_data)
+
+    def file_complete(self, file_size):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return InMemoryUploadedFile(
+            file=io.BytesIO(data),
+            field_name=self.field_name,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra
+        )
+
+
+class ImageMultiPartParser(MultiPartParser):
+    """Multipart parser that reads image parts through BoundedMemoryUploadHandler"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        request.upload_handlers = [BoundedMemoryUploadHandler(request)]
+        return super().parse(stream, media_type=media_type, parser_context=parser_context)
+
+
+class NDJSONParser(BaseParser):
+    """Parses newline-delimited JSON lazily, yielding one object per non-empty line
+
+    Nothing is read from the request until the result is iterated, so a
+    view can start streaming its response before the whole body arrives.
+    Lines that are not valid JSON are yielded as ParseError instances so
+    the caller can report them without aborting the rest of the stream.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return _iter_ndjson(stream, encoding)
+
+
+def _iter_ndjson(stream, encoding):
+    if stream is None:
+        return
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line.decode(encoding))
+        except ValueError as e:
+            yield ParseError(f"Invalid JSON line: {e}")
@@ -0,0 +1,247 @@
+"""Per-request cProfile and tracemalloc capture
+
+request_profiling_middleware profiles a random sample of requests, and
+any request carrying REQUEST_PROFILING['header'] set to the configured
+token. Each profile is kept in a rotating directory as three files that
+share an id: <id>.json (request metadata and top allocation sites),
+<id>.prof (pstats dump for snakeviz or `python -m pstats`) and <id>.txt
+(the dump sorted by cumulative time). The admin lists them at
+/admin/verification/profiles/.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import secrets
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+PROFILE_ID = re.compile(r'^\d{8}-\d{6}-\d{3}-[0-9a-f]{8}$')
+
+# cProfile and tracemalloc are process-wide, so one request is profiled at a time
+_active = threading.Lock()
+
+_IGNORED_FRAMES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+)
+
+
+def trigger(request, config):
+    """Return why a request should be profiled ('header' or 'sample'), or None"""
+    token = config.get('token')
+    if token:
+        header = 'HTTP_' + config.get('header', 'X-Profile-Request').upper().replace('-', '_')
+        value = request.META.get(header)
+        if value is not None and secrets.compare_digest(value.encode(), token.encode()):
+            return 'header'
+    sample_rate = config.get('sample_rate', 0.0)
+    if sample_rate and random.random() < sample_rate:
+        return 'sample'
+    return None
+
+
+class Capture:
+    """cProfile and/or tracemalloc running for the duration of one request"""
+
+    def __init__(self, use_cprofile=True, use_tracemalloc=True, frames=1):
+        self.profiler = cProfile.Profile() if use_cprofile else None
+        self.use_tracemalloc = use_tracemalloc
+        self.frames = frames
+        self._was_tracing = False
+        self._baseline = None
+        self.started = None
+        self.duration = None
+        self.stats = None
+        self.allocations = None
+        self.traced_memory = None
+
+    def start(self):
+        if self.use_tracemalloc:
+            self._was_tracing = tracemalloc.is_tracing()
+            if self._was_tracing:
+                # Someone else is tracing (PYTHONTRACEMALLOC); report the difference instead
+                self._baseline = tracemalloc.take_snapshot()
+            else:
+                tracemalloc.start(self.frames)
+            tracemalloc.reset_peak()
+        self.started = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.duration = time.perf_counter() - self.started
+        if self.use_tracemalloc:
+            self.traced_memory = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED_FRAMES)
+            if self._baseline is not None:
+                self.allocations = snapshot.compare_to(self._baseline.filter_traces(_IGNORED_FRAMES), 'lineno')
+            else:
+                self.allocations = snapshot.statistics('lineno')
+                tracemalloc.stop()
+
+    def top_allocations(self, limit):
+        """Return the allocation sites still holding the most memory when the request ended"""
+        if self.allocations is None:
+            return []
+        sites = []
+        for stat in self.allocations[:limit]:
+            frame = stat.traceback[0]
+            sites.append({
+                'site': f"{frame.filename}:{frame.lineno}",
+                'size_kb': round(getattr(stat, 'size_diff', stat.size) / 1024, 1),
+                'count': getattr(stat, 'count_diff', stat.count),
+            })
+        return sites
+
+    def stats_text(self, limit=60):
+        output = io.StringIO()
+        pstats.Stats(self.profiler, stream=output).sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
+
+
+class ProfileStore:
+    """Directory of captured profiles, pruned to the newest max_profiles"""
+
+    extensions = ('.json', '.prof', '.txt')
+
+    def __init__(self, directory, max_profiles=100):
+        self.directory = str(directory)
+        self.max_profiles = max_profiles
+
+    def path(self, profile_id, extension):
+        if not PROFILE_ID.match(profile_id):
+            raise ValueError("Invalid profile id")
+        return os.path.join(self.directory, profile_id + extension)
+
+    def save(self, metadata, capture):
+        """Write one capture and return its id"""
+        os.makedirs(self.directory, exist_ok=True)
+        now = datetime.now(timezone.utc)
+        profile_id = f"{now:%Y%m%d-%H%M%S}-{now.microsecond // 1000:03d}-{uuid.uuid4().hex[:8]}"
+        metadata = {'id': profile_id, 'created_at': now.isoformat(), **metadata}
+        if capture.profiler is not None:
+            capture.profiler.dump_stats(self.path(profile_id, '.prof'))
+            self._write(self.path(profile_id, '.txt'), capture.stats_text())
+        # The .json goes last, so list() never shows a profile without its files
+        self._write(self.path(profile_id, '.json'), json.dumps(metadata, indent=2))
+        self.prune()
+        return profile_id
+
+    def list(self):
+        """Return the metadata of every stored profile, newest first"""
+        profiles = []
+        for profile_id in self._ids():
+            metadata = self.get(profile_id)
+            if metadata is not None:
+                profiles.append(metadata)
+        return profiles
+
+    def get(self, profile_id):
+        try:
+            with open(self.path(profile_id, '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def read_text(self, profile_id):
+        try:
+            with open(self.path(profile_id, '.txt')) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def prune(self):
+        for profile_id in self._ids()[self.max_profiles:]:
+            for extension in self.extensions:
+                try:
+                    os.unlink(self.path(profile_id, extension))
+                except FileNotFoundError:
+                    pass
+
+    def _ids(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        ids = (name[:-len('.json')] for name in names if name.endswith('.json'))
+        return sorted((profile_id for profile_id in ids if PROFILE_ID.match(profile_id)), reverse=True)
+
+    def _write(self, path, text):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+def get_profile_store():
+    config = settings.REQUEST_PROFILING
+    return ProfileStore(config['directory'], max_profiles=config.get('max_profiles', 100))
+
+
+def begin(request, config):
+    """Start a Capture if this request is to be profiled and no other one is; else return None"""
+    reason = trigger(request, config)
+    if reason is None or not _active.acquire(blocking=False):
+        return None
+    capture = Capture(
+        use_cprofile=config.get('cprofile', True),
+        use_tracemalloc=config.get('tracemalloc', True),
+        frames=config.get('tracemalloc_frames', 1),
+    )
+    capture.trigger = reason
+    try:
+        capture.start()
+    except BaseException:
+        _active.release()
+        raise
+    return capture
+
+
+def end(capture):
+    try:
+        capture.stop()
+    finally:
+        _active.release()
+
+
+def save(capture, request, response, config):
+    """Store a finished capture with the request's metadata"""
+    match = getattr(request, 'resolver_match', None)
+    user = getattr(request, 'user', None)
+    metadata = {
+        'method': request.method,
+        'path': request.path,
+        'view': match.url_name if match is not None else None,
+        'status': response.status_code,
+        'duration_ms': round(capture.duration * 1000, 2),
+        'trigger': capture.trigger,
+        'user': user.get_username() if user is not None and user.is_authenticated else None,
+        'remote_addr': request.META.get('REMOTE_ADDR'),
+        'content_length': request.META.get('CONTENT_LENGTH') or None,
+        'pid': os.getpid(),
+        'cprofile': capture.profiler is not None,
+        'tracemalloc': capture.use_tracemalloc,
+    }
+    if capture.traced_memory is not None:
+        current, peak = capture.traced_memory
+        metadata['traced_memory_kb'] = round(current / 1024, 1)
+        metadata['peak_memory_kb'] = round(peak / 1024, 1)
+        metadata['top_allocations'] = capture.top_allocations(config.get('top_allocations', 25))
+    try:
+        return get_profile_store().save(metadata, capture)
+    except Exception as e:
+        print(f"Error saving request profile: {e}")
+        return None
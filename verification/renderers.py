@@ -0,0 +1,30 @@
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class PackedEmbeddingJSONRenderer(JSONRenderer):
+    """JSON selected by ?format=base64; the view packs the vector as base64 float32"""
+    format = 'base64'
+
+
+class EmbeddingOctetStreamRenderer(BaseRenderer):
+    """Raw little-endian float32 vector, selected by ?format=binary or Accept
+
+    Views hand over the packed bytes as-is; anything else (an error body)
+    is rendered as JSON.
+    """
+    media_type = 'application/octet-stream'
+    format = 'binary'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return bytes(data)
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = 'application/json'
+        return json.dumps(data).encode()
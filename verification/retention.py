@@ -0,0 +1,298 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import FaceEmbedding, StoredBlob, VerificationJob, VerificationRecord
+from .storage import get_blob_store
+from .vector_index import get_loaded_index
+
+
+def iter_chunks(queryset, chunk_size, fields=('pk',)):
+    """Yield lists of value tuples from a queryset, walking the primary key in chunks"""
+    last_pk = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        rows = list(chunk.values_list('pk', *fields)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last_pk = rows[-1][0]
+
+
+def raw_delete(model, pks):
+    """Delete rows with one DELETE statement, skipping cascade collection and signals"""
+    return model.objects.filter(pk__in=pks)._raw_delete(model.objects.db)
+
+
+def _beyond_newest(queryset, keep, date_field):
+    """Q matching the rows of a queryset older than its newest `keep`, by (date_field, id)"""
+    boundary = queryset.order_by(f'-{date_field}', '-id').values_list(date_field, 'id')[keep - 1:keep].first()
+    if boundary is None:
+        return Q(pk__in=[])
+    date, pk = boundary
+    return Q(**{f'{date_field}__lt': date}) | Q(**{date_field: date, 'id__lt': pk})
+
+
+def _policy(queryset, date_field, cutoff=None, keep=None):
+    """Q matching rows older than cutoff or beyond the newest `keep`; None when neither is set"""
+    conditions = []
+    if cutoff is not None:
+        conditions.append(Q(**{f'{date_field}__lt': cutoff}))
+    if keep is not None:
+        conditions.append(_beyond_newest(queryset, keep, date_field))
+    if not conditions:
+        return None
+    condition = conditions[0]
+    for other in conditions[1:]:
+        condition |= other
+    return condition
+
+
+def expired_records(cutoff=None, keep=None):
+    condition = _policy(VerificationRecord.objects.all(), 'verification_date', cutoff, keep)
+    return VerificationRecord.objects.filter(condition) if condition is not None else VerificationRecord.objects.none()
+
+
+def expired_embeddings(cutoff=None, keep=None):
+    # Only embeddings no remaining record points at, which are also the ones
+    # `keep` counts; raw deletes do not cascade
+    unreferenced = FaceEmbedding.objects.filter(verificationrecord__isnull=True)
+    condition = _policy(unreferenced, 'created_at', cutoff, keep)
+    if condition is None:
+        return FaceEmbedding.objects.none()
+    return unreferenced.filter(condition)
+
+
+def expired_jobs(cutoff=None):
+    if cutoff is None:
+        return VerificationJob.objects.none()
+    return VerificationJob.objects.filter(
+        status__in=[VerificationJob.DONE, VerificationJob.FAILED], finished_at__lt=cutoff
+    )
+
+
+def expired_blobs(store, cutoff=None):
+    """Blobs with no references left, or not saved again since cutoff"""
+    condition = Q(ref_count=0)
+    if cutoff is not None:
+        condition |= Q(last_referenced_at__lt=cutoff)
+    return StoredBlob.objects.filter(condition, store=store)
+
+
+def _referenced_paths(paths):
+    """Return which of these paths a VerificationRecord still points at"""
+    paths = list(paths)
+    pairs = (
+        VerificationRecord.objects
+        .filter(Q(known_image_path__in=paths) | Q(new_image_path__in=paths))
+        .values_list('known_image_path', 'new_image_path')
+    )
+    return {path for pair in pairs for path in pair}
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _remove_file(path):
+    size = _file_size(path)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        return 0, 0
+    return 1, size
+
+
+def remove_files(paths, workers=8):
+    """Unlink files on a thread pool; return (files removed, bytes reclaimed)"""
+    removed = reclaimed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for count, size in executor.map(_remove_file, paths):
+            removed += count
+            reclaimed += size
+    return removed, reclaimed
+
+
+class Purger:
+    """Applies the retention policy in bounded chunks
+
+    Rows are selected a chunk at a time by primary key and removed with one
+    raw DELETE per chunk, so neither cascade collection nor signals run per
+    object. Files are unlinked on a thread pool. With dry_run nothing is
+    changed; the counts are those the current state would yield, so rows
+    only freed by the record purge itself (embeddings, retained images) are
+    not included.
+    """
+
+    def __init__(self, max_age_days=None, max_records=None, max_embeddings=None,
+                 chunk_size=1000, file_workers=8, orphan_grace_seconds=3600, dry_run=False):
+        self.cutoff = timezone.now() - timedelta(days=max_age_days) if max_age_days is not None else None
+        self.max_records = max_records
+        self.max_embeddings = max_embeddings
+        self.chunk_size = chunk_size
+        self.file_workers = file_workers
+        self.orphan_grace_seconds = orphan_grace_seconds
+        self.dry_run = dry_run
+
+    def purge_jobs(self):
+        """Delete finished jobs older than the cutoff; return the row count"""
+        return self._delete_rows(VerificationJob, expired_jobs(self.cutoff))
+
+    def purge_records(self):
+        """Delete expired records and release the retained images they held; return the row count"""
+        records = expired_records(self.cutoff, self.max_records)
+        if self.dry_run:
+            return records.count()
+
+        store = get_blob_store('uploads')
+        deleted = 0
+        for rows in iter_chunks(records, self.chunk_size, ('known_image_path', 'new_image_path')):
+            released = Counter(
+                digest for _, *paths in rows for digest in map(store.digest_for_path, paths)
+                if digest is not None
+            )
+            with transaction.atomic():
+                deleted += raw_delete(VerificationRecord, [row[0] for row in rows])
+                for digest, count in released.items():
+                    StoredBlob.objects.filter(store=store.name, sha256=digest).update(
+                        ref_count=Greatest(F('ref_count') - count, 0)
+                    )
+        return deleted
+
+    def purge_embeddings(self):
+        """Delete expired embeddings no record refers to; return the row count
+
+        This process's search index drops them as each chunk commits; other
+        processes drop them at their next reconcile.
+        """
+        index = get_loaded_index()
+        return self._delete_rows(
+            FaceEmbedding, expired_embeddings(self.cutoff, self.max_embeddings),
+            on_commit=index.remove if index is not None else None
+        )
+
+    def purge_blobs(self, store_name):
+        """Delete expired blobs of one store and their files; return (files, bytes)"""
+        store = get_blob_store(store_name)
+        removed = reclaimed = 0
+        for rows in iter_chunks(expired_blobs(store_name, self.cutoff), self.chunk_size, ('name', 'size')):
+            paths = {pk: os.path.join(store.root, name) for pk, name, _ in rows}
+            # Old content can still back a newer record that retained the same image
+            kept = _referenced_paths(paths.values()) if store_name == 'uploads' else set()
+            expired = [(pk, size) for pk, _, size in rows if paths[pk] not in kept]
+            if self.dry_run:
+                removed += len(expired)
+                reclaimed += sum(size for _, size in expired)
+                continue
+            with transaction.atomic():
+                # Checked again under the row locks, which BlobStore.save() takes
+                # too: content saved since the scan is no longer expired
+                expired = list(
+                    expired_blobs(store_name, self.cutoff).select_for_update()
+                    .filter(pk__in=[pk for pk, _ in expired]).values_list('pk', flat=True)
+                )
+                raw_delete(StoredBlob, expired)
+                count, size = remove_files([paths[pk] for pk in expired], self.file_workers)
+            removed += count
+            reclaimed += size
+        return removed, reclaimed
+
+    def purge_orphans(self, store_name):
+        """Delete blob files no StoredBlob or record refers to, and stale temp files; return (files, bytes)
+
+        Only files laid out the way BlobStore names them are considered, so
+        captures and uploads written before the blob store existed are never
+        touched. Files younger than the grace period are skipped, since a
+        blob is put in place just before its row is committed.
+        """
+        store = get_blob_store(store_name)
+        removed = reclaimed = 0
+        for chunk in self._scan_chunks(store.root):
+            names = {
+                os.path.relpath(path, store.root): path for path in chunk
+                if store.is_blob_name(os.path.relpath(path, store.root))
+                or os.path.dirname(path) == store.tmp_dir
+            }
+            known = set(
+                StoredBlob.objects.filter(store=store_name, name__in=list(names)).values_list('name', flat=True)
+            )
+            count, size = self._remove_unreferenced([path for name, path in names.items() if name not in known])
+            removed += count
+            reclaimed += size
+        return removed, reclaimed
+
+    def purge_legacy_files(self, store_name, max_age_days):
+        """Delete files written before the blob store that no record refers to; return (files, bytes)
+
+        Every file under the store root not laid out like a blob (and not a
+        temporary file) counts as legacy. Only those not modified for
+        max_age_days are removed.
+        """
+        store = get_blob_store(store_name)
+        removed = reclaimed = 0
+        for chunk in self._scan_chunks(store.root, min_age_seconds=max_age_days * 86400):
+            count, size = self._remove_unreferenced([
+                path for path in chunk
+                if not store.is_blob_name(os.path.relpath(path, store.root))
+                and os.path.dirname(path) != store.tmp_dir
+            ])
+            removed += count
+            reclaimed += size
+        return removed, reclaimed
+
+    def _remove_unreferenced(self, paths):
+        """Remove the files no VerificationRecord refers to; return (files, bytes)"""
+        referenced = _referenced_paths(paths)
+        unreferenced = [path for path in paths if path not in referenced]
+        if self.dry_run:
+            return len(unreferenced), sum(_file_size(path) for path in unreferenced)
+        return remove_files(unreferenced, self.file_workers)
+
+    def _delete_rows(self, model, queryset, on_commit=None):
+        """Raw-delete the queryset in chunks; on_commit(pks) runs after each chunk commits"""
+        if self.dry_run:
+            return queryset.count()
+        deleted = 0
+        for rows in iter_chunks(queryset, self.chunk_size):
+            pks = [row[0] for row in rows]
+            with transaction.atomic():
+                deleted += raw_delete(model, pks)
+                if on_commit is not None:
+                    transaction.on_commit(lambda pks=pks: on_commit(pks))
+        return deleted
+
+    def _scan_chunks(self, root, min_age_seconds=None):
+        """Yield lists of at most chunk_size file paths under root older than min_age_seconds
+
+        The default age is the orphan grace period.
+        """
+        if min_age_seconds is None:
+            min_age_seconds = self.orphan_grace_seconds
+        newest = time.time() - min_age_seconds
+        chunk = []
+        stack = [root]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif (entry.is_file(follow_symlinks=False) and not entry.name.startswith('.')
+                          and entry.stat().st_mtime < newest):
+                        chunk.append(entry.path)
+                        if len(chunk) >= self.chunk_size:
+                            yield chunk
+                            chunk = []
+        if chunk:
+            yield chunk
@@ -0,0 +1,178 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+from django.conf import settings
+
+
+# Upper bounds (ms) of the queue wait histogram buckets
+WAIT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class _Request:
+    __slots__ = ('images', 'future', 'enqueued_at')
+
+    def __init__(self, images):
+        self.images = images
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class InferenceScheduler:
+    """Coalesces concurrent embedding requests into shared model batches
+
+    Callers block in embed() while a single dispatcher thread collects every
+    request that arrives within max_wait_ms of the first one, or until
+    max_batch_size faces are waiting, runs them through the runner as one
+    batch and hands each caller its slice of the result. Running all forward
+    passes on one thread also keeps concurrent requests from contending for
+    the model. A lone request still waits up to max_wait_ms for company, so
+    the scheduler is only worth enabling under concurrent load.
+
+    If the dispatcher thread dies, every request it held or that is still
+    queued fails with the same exception, and the next embed() starts a new
+    thread.
+    """
+
+    def __init__(self, runner, max_wait_ms=5, max_batch_size=32):
+        self.runner = runner
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._batch_sizes = Counter()
+        self._wait_buckets = Counter()
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self.requests = 0
+        self.batches = 0
+        self.images = 0
+        self.errors = 0
+
+    def embed(self, face_images):
+        """Return the embeddings for a list of face crops, batched with other callers"""
+        if not face_images:
+            return []
+        request = _Request(list(face_images))
+        # Queued before the thread check, so a dispatcher that died meanwhile
+        # either fails this request or is replaced by one that serves it
+        self._queue.put(request)
+        self._ensure_started()
+        return request.future.result()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='inference-scheduler', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        batch = []
+        try:
+            while True:
+                batch = [self._queue.get()]
+                count = len(batch[0].images)
+                deadline = batch[0].enqueued_at + self.max_wait
+                while count < self.max_batch_size:
+                    timeout = deadline - time.monotonic()
+                    try:
+                        request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(request)
+                    count += len(request.images)
+                self._dispatch(batch, count)
+                batch = []
+        except BaseException as e:
+            with self._lock:
+                self._thread = None
+            pending = batch + self._drain()
+            print(f"Error in the inference scheduler thread: {e!r}")
+            for request in pending:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            raise
+
+    def _drain(self):
+        requests = []
+        while True:
+            try:
+                requests.append(self._queue.get_nowait())
+            except queue.Empty:
+                return requests
+
+    def _dispatch(self, batch, count):
+        started = time.monotonic()
+        with self._lock:
+            self.requests += len(batch)
+            self.batches += 1
+            self.images += count
+            self._batch_sizes[count] += 1
+            for request in batch:
+                wait_ms = (started - request.enqueued_at) * 1000
+                self._wait_total += wait_ms
+                self._wait_max = max(self._wait_max, wait_ms)
+                self._wait_buckets[next((b for b in WAIT_BUCKETS_MS if wait_ms <= b), '+Inf')] += 1
+
+        try:
+            embeddings = self.runner([img for request in batch for img in request.images])
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        offset = 0
+        for request in batch:
+            request.future.set_result(embeddings[offset:offset + len(request.images)])
+            offset += len(request.images)
+
+    def stats(self):
+        """Return batch-size and queue-wait metrics"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'batches': self.batches,
+                'images': self.images,
+                'errors': self.errors,
+                'queue_depth': self._queue.qsize(),
+                'mean_batch_size': self.images / self.batches if self.batches else None,
+                'batch_size_histogram': {str(size): n for size, n in sorted(self._batch_sizes.items())},
+                'queue_wait_ms': {
+                    'mean': self._wait_total / self.requests if self.requests else None,
+                    'max': self._wait_max,
+                    'histogram': {
+                        str(bucket): self._wait_buckets[bucket] for bucket in (*WAIT_BUCKETS_MS, '+Inf')
+                    },
+                },
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_inference_scheduler():
+    """Return the process-wide scheduler, or None when micro-batching is disabled"""
+    global _scheduler
+    config = settings.INFERENCE_SCHEDULER
+    if not config.get('enabled', False):
+        return None
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                from .utils import embed_faces
+                _scheduler = InferenceScheduler(
+                    embed_faces,
+                    max_wait_ms=config.get('max_wait_ms', 5),
+                    max_batch_size=config.get('max_batch_size', 32)
+                )
+    return _scheduler
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import FaceEmbedding, VerificationRecord
+from .models import FaceEmbedding, VerificationRecord, VerificationJob
 
 class ImageUploadSerializer(serializers.Serializer):
     """Serializer for image upload/capture"""
@@ -10,18 +10,80 @@ class FaceVerificationSerializer(serializers.Serializer):
     known_image = serializers.CharField(help_text="Base64 encoded known image")
     new_image = serializers.CharField(help_text="Base64 encoded new image to verify")
 
+class ImageFileSerializer(serializers.Serializer):
+    """Serializer for image capture sent as a multipart file part"""
+    image = serializers.FileField(help_text="Image file")
+
+class FaceVerificationUploadSerializer(serializers.Serializer):
+    """Serializer for face verification sent as multipart file parts"""
+    known_image = serializers.FileField(help_text="Known image file")
+    new_image = serializers.FileField(help_text="New image file to verify")
+
+class FaceIdentificationSerializer(serializers.Serializer):
+    """Serializer for 1:N face identification"""
+    image = serializers.CharField(help_text="Base64 encoded image to identify")
+    top_k = serializers.IntegerField(default=5, min_value=1, help_text="Number of closest matches to return")
+
 class FileUploadSerializer(serializers.Serializer):
     """Serializer for file upload"""
     file = serializers.FileField(help_text="Image file to upload")
 
 class FaceEmbeddingSerializer(serializers.ModelSerializer):
     """Serializer for FaceEmbedding model"""
+    embedding = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = FaceEmbedding
+        fields = ['id', 'model_name', 'dimension', 'is_normalized', 'embedding',
+                  'facial_area', 'face_confidence', 'created_at', 'updated_at']
+    
+    def get_embedding(self, obj):
+        vector = obj.get_vector()
+        return vector.tolist() if vector is not None else None
+
+class PackedFaceEmbeddingSerializer(FaceEmbeddingSerializer):
+    """Serializer for FaceEmbedding with the vector as base64 little-endian float32"""
+    def get_embedding(self, obj):
+        return obj.get_vector_base64()
+
+class LegacyFaceEmbeddingSerializer(serializers.ModelSerializer):
+    """Serializer for FaceEmbedding in the original DeepFace.represent JSON shape"""
+    embedding_data = serializers.SerializerMethodField()
+    
     class Meta:
         model = FaceEmbedding
         fields = ['id', 'embedding_data', 'created_at', 'updated_at']
+    
+    def get_embedding_data(self, obj):
+        return obj.get_embedding()
 
 class VerificationRecordSerializer(serializers.ModelSerializer):
     """Serializer for VerificationRecord model"""
     class Meta:
         model = VerificationRecord
-        fields = ['id', 'known_image_path', 'new_image_path', 'is_verified', 'verification_date', 'embedding'] 
\ No newline at end of file
+        fields = ['id', 'known_image_path', 'new_image_path', 'is_verified', 'verification_date', 'embedding'] 
+
+class VerificationRecordExpandedSerializer(serializers.ModelSerializer):
+    """Serializer for VerificationRecord with its FaceEmbedding inlined"""
+    embedding = FaceEmbeddingSerializer(read_only=True)
+    
+    class Meta:
+        model = VerificationRecord
+        fields = ['id', 'known_image_path', 'new_image_path', 'is_verified', 'verification_date', 'embedding']
+
+class VerificationRecordQuerySerializer(serializers.Serializer):
+    """Query parameters for paging through verification records"""
+    is_verified = serializers.BooleanField(required=False, allow_null=True, default=None)
+    date_from = serializers.DateTimeField(required=False, input_formats=['iso-8601', '%Y-%m-%d'],
+                                          help_text="Inclusive lower bound on verification_date")
+    date_to = serializers.DateTimeField(required=False, input_formats=['iso-8601', '%Y-%m-%d'],
+                                        help_text="Exclusive upper bound on verification_date")
+    cursor = serializers.CharField(required=False, help_text="next_cursor from the previous page")
+    limit = serializers.IntegerField(required=False, default=10, min_value=1, max_value=500)
+    expand = serializers.ChoiceField(required=False, choices=['embedding'])
+
+class VerificationJobSerializer(serializers.ModelSerializer):
+    """Serializer for VerificationJob status; the queued images are never returned"""
+    class Meta:
+        model = VerificationJob
+        fields = ['id', 'status', 'result', 'error', 'attempts', 'created_at', 'started_at', 'finished_at']
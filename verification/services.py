@@ -0,0 +1,314 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
+import base64
+import binascii
+import hashlib
+import os
+import time
+from datetime import datetime
+from .models import FaceEmbedding, VerificationRecord
+from .utils import (
+    compare_faces,
+    match_faces,
+    represent_images,
+    represent_faces,
+    largest_face,
+    find_threshold,
+    get_model_name,
+    get_distance_metric
+)
+from .audit_buffer import get_audit_buffer
+from .metrics import ERRORS, STAGE_SECONDS
+from .storage import get_blob_store
+from .vector_index import get_index
+
+
+def retain_image(image_bytes):
+    """Return where an image used for verification is kept for the audit record
+
+    Images are only written to disk when the retain_verification_images
+    setting is on; otherwise the record keeps a content reference so the request never
+    touches the filesystem.
+    """
+    if not settings.FACE_VERIFICATION.get('retain_verification_images', False):
+        return f"sha256:{hashlib.sha256(image_bytes).hexdigest()}"
+
+    store = get_blob_store('uploads')
+    blob, _ = store.save(image_bytes, '.jpg')
+    return store.path(blob)
+
+
+def _stored_file(store, blob, created):
+    return {
+        'filename': os.path.basename(blob.name),
+        'filepath': store.path(blob),
+        'sha256': blob.sha256,
+        'deduplicated': not created
+    }
+
+
+def store_capture(image_bytes):
+    """Store a camera capture and return its filename, filepath, sha256 and deduplicated flag"""
+    store = get_blob_store('captures')
+    return _stored_file(store, *store.save(image_bytes, '.jpg'))
+
+
+def store_upload(file):
+    """Stream an uploaded file into storage and return the same fields as store_capture"""
+    store = get_blob_store('uploads')
+    extension = os.path.splitext(file.name)[1].lower()
+    return _stored_file(store, *store.save_chunks(file.chunks(), extension))
+
+
+def verify_and_record(known_image, new_image):
+    """Verify two encoded images in memory and store the attempt"""
+    return record_verification(compare_faces(known_image, new_image), known_image, new_image)
+
+
+def record_verification(result, known_image, new_image):
+    """Store a verification attempt and return the response payload for it
+
+    The new image's embedding from the verification pass is reused for the
+    FaceEmbedding row. With AUDIT_WRITE_BEHIND enabled the rows are handed to
+    the audit buffer instead, and verification_id is None since the record
+    has no id until the buffer is flushed.
+    """
+    embedding_obj, verification_record = build_verification_rows(
+        result, retain_image(known_image), retain_image(new_image)
+    )
+    with STAGE_SECONDS.time(stage='db_write'):
+        buffer = get_audit_buffer()
+        if buffer is not None:
+            buffer.add(embedding_obj, verification_record)
+        else:
+            if embedding_obj is not None:
+                embedding_obj.save()
+                verification_record.embedding = embedding_obj
+            verification_record.save()
+    return verification_outcome(result, embedding_obj, verification_record)
+
+
+async def arecord_verification(result, known_image_path, new_image_path):
+    """Async ORM version of record_verification; the images are already retained"""
+    embedding_obj, verification_record = build_verification_rows(result, known_image_path, new_image_path)
+    started = time.perf_counter()
+    # Creating the buffer may replay a journal, and add() fsyncs, so neither runs on the event loop
+    buffer = await sync_to_async(get_audit_buffer)()
+    if buffer is not None:
+        await sync_to_async(buffer.add)(embedding_obj, verification_record)
+    else:
+        if embedding_obj is not None:
+            await embedding_obj.asave()
+            verification_record.embedding = embedding_obj
+        await verification_record.asave()
+    STAGE_SECONDS.observe(time.perf_counter() - started, stage='db_write')
+    return verification_outcome(result, embedding_obj, verification_record)
+
+
+def build_verification_rows(result, known_image_path, new_image_path):
+    """Return the unsaved (FaceEmbedding or None, VerificationRecord) for an attempt"""
+    is_verified = result is not None and result['verified']
+
+    # The new image was already embedded during verification, so store that
+    # representation instead of running detection and embedding again
+    embedding_obj = None
+    if is_verified:
+        embedding_obj = FaceEmbedding.from_face(
+            result['new_face'],
+            model_name=result['model'],
+            normalize=settings.FACE_VERIFICATION.get('normalize_embeddings', False),
+            encoding=settings.FACE_VERIFICATION.get('embedding_encoding', 'float32')
+        )
+
+    verification_record = VerificationRecord(
+        known_image_path=known_image_path,
+        new_image_path=new_image_path,
+        is_verified=is_verified
+    )
+    return embedding_obj, verification_record
+
+
+def verification_outcome(result, embedding_obj, verification_record):
+    """Return the response payload for a stored verification attempt"""
+    is_verified = verification_record.is_verified
+    return {
+        'verified': is_verified,
+        'embedding_saved': embedding_obj is not None,
+        'verification_id': verification_record.id,
+        'distance': result['distance'] if result else None,
+        'threshold': result['threshold'] if result else None,
+        'distance_metric': result['distance_metric'] if result else None,
+        'model': result['model'] if result else None,
+        'detector_backend': result['detector_backend'] if result else None,
+        'known_detector_backend': result['known_detector_backend'] if result else None,
+        'message': 'Verification successful!' if is_verified else 'Verification failed - faces do not match'
+    }
+
+
+def encode_record_cursor(record):
+    """Return an opaque cursor pointing just past a VerificationRecord"""
+    raw = f"{record.verification_date.isoformat()}|{record.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_record_cursor(cursor):
+    """Return the (verification_date, id) a cursor points past"""
+    try:
+        date, pk = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        return datetime.fromisoformat(date), int(pk)
+    except (ValueError, UnicodeError, binascii.Error):
+        raise ValueError("Invalid cursor")
+
+
+def verification_records_queryset(is_verified=None, date_from=None, date_to=None, cursor=None,
+                                  expand_embedding=False):
+    """Return VerificationRecords newest first, filtered and positioned after a cursor
+
+    Rows are ordered by (verification_date, id) so the cursor condition is a
+    range scan on the matching composite index. date_to is exclusive.
+    """
+    records = VerificationRecord.objects.order_by('-verification_date', '-id')
+    if is_verified is not None:
+        records = records.filter(is_verified=is_verified)
+    if date_from is not None:
+        records = records.filter(verification_date__gte=date_from)
+    if date_to is not None:
+        records = records.filter(verification_date__lt=date_to)
+    if cursor:
+        date, pk = decode_record_cursor(cursor)
+        records = records.filter(Q(verification_date__lt=date) | Q(verification_date=date, id__lt=pk))
+    if expand_embedding:
+        records = records.select_related('embedding')
+    return records
+
+
+def records_page(records, limit):
+    """Split limit + 1 fetched rows into the page and the cursor for the next one"""
+    if len(records) > limit:
+        return records[:limit], encode_record_cursor(records[limit - 1])
+    return records, None
+
+
+def get_face_embedding(embedding_id=None):
+    """Return the FaceEmbedding with this id, or the latest one; None if missing"""
+    if embedding_id is not None:
+        return FaceEmbedding.objects.filter(pk=embedding_id).first()
+    return FaceEmbedding.objects.order_by('-created_at').first()
+
+
+def embedding_validators(embedding, representation):
+    """Return the (ETag, Last-Modified timestamp) for one representation of an embedding
+
+    Both change whenever the row is saved, since updated_at is auto_now.
+    """
+    last_modified = embedding.updated_at.timestamp()
+    return f'"{embedding.pk}-{last_modified:.6f}-{representation}"', int(last_modified)
+
+
+def set_embedding_validators(response, etag, last_modified):
+    """Attach the validators and ask clients to revalidate on every poll"""
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def identify_face(image_bytes, top_k=5):
+    """Find the stored FaceEmbedding rows closest to the largest face in an image
+
+    Raises ValueError when no face is detected, rather than searching with
+    the whole-image fallback DeepFace returns (confidence 0) in that case.
+    """
+    faces = [face for face in represent_faces(image_bytes) if face.get('face_confidence')]
+    if not faces:
+        raise ValueError("No face detected in the image")
+    face = largest_face(faces)
+
+    # The index holds unit vectors, so only angle-based metrics apply
+    distance_metric = get_distance_metric()
+    if distance_metric not in ('cosine', 'euclidean_l2'):
+        distance_metric = 'cosine'
+    threshold = find_threshold(get_model_name(), distance_metric)
+
+    index = get_index()
+    matches = index.search(face['embedding'], k=top_k, distance_metric=distance_metric)
+
+    return {
+        'matches': [
+            {
+                'embedding_id': embedding_id,
+                'distance': distance,
+                'verified': distance <= threshold
+            }
+            for embedding_id, distance in matches
+        ],
+        'threshold': threshold,
+        'distance_metric': distance_metric,
+        'index_size': len(index),
+        'facial_area': face['facial_area'],
+        'detector_backend': face.get('detector_backend')
+    }
+
+
+def verify_batch(pairs, chunk_size=None):
+    """Verify a stream of image pairs, yielding one result per pair in order
+
+    Each pair is a dict with 'index', 'id' and either the encoded
+    'known_image' and 'new_image' bytes or an 'error' message. Pairs are
+    processed chunk_size at a time so every chunk shares one deduplicated,
+    batched embedding pass, and results are yielded as each chunk finishes.
+    Pairs whose images could not be represented yield success False and
+    are not recorded.
+    """
+    chunk_size = chunk_size or settings.FACE_VERIFICATION.get('batch_chunk_size', 32)
+    chunk = []
+    for pair in pairs:
+        chunk.append(pair)
+        if len(chunk) >= chunk_size:
+            yield from _verify_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield from _verify_chunk(chunk)
+
+
+def _verify_chunk(chunk):
+    images = []
+    for pair in chunk:
+        if 'error' not in pair:
+            images.extend([pair['known_image'], pair['new_image']])
+
+    try:
+        representations = iter(represent_images(images))
+    except Exception as e:
+        print(f"Error: {e}")
+        representations = iter([e] * len(images))
+
+    for pair in chunk:
+        if 'error' in pair:
+            yield {'index': pair['index'], 'id': pair.get('id'), 'success': False, 'error': pair['error']}
+            continue
+
+        known_faces = next(representations)
+        new_faces = next(representations)
+        # Nothing was verified when an image could not be represented (bad
+        # data, a failed embedding pass), so no attempt is recorded for it
+        failed = next((faces for faces in (known_faces, new_faces) if isinstance(faces, Exception)), None)
+        if failed is not None:
+            ERRORS.inc(exception=type(failed).__name__)
+            yield {'index': pair['index'], 'id': pair.get('id'), 'success': False, 'error': str(failed)}
+            continue
+
+        result = None
+        error = None
+        try:
+            result = match_faces(known_faces, new_faces)
+        except Exception as e:
+            ERRORS.inc(exception=type(e).__name__)
+            print(f"Error: {e}")
+            error = str(e)
+
+        outcome = record_verification(result, pair['known_image'], pair['new_image'])
+        yield {'index': pair['index'], 'id': pair.get('id'), 'success': True, 'error': error, **outcome}
@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import FaceEmbedding, VerificationRecord
+from .storage import get_blob_store
+from .vector_index import get_loaded_index
+
+
+@receiver(post_save, sender=FaceEmbedding)
+def add_embedding_to_index(sender, instance, created, **kwargs):
+    """Insert a new embedding into this process's search index once it is committed"""
+    if not created or instance.vector is None:
+        return
+    index = get_loaded_index()
+    if index is None or instance.model_name != index.model_name:
+        return
+
+    embedding_id = instance.pk
+    vector = instance.get_vector()
+    transaction.on_commit(lambda: index.insert(embedding_id, vector))
+
+
+@receiver(post_delete, sender=FaceEmbedding)
+def remove_embedding_from_index(sender, instance, **kwargs):
+    """Drop a deleted embedding from this process's search index once the delete is committed"""
+    index = get_loaded_index()
+    if index is None or instance.model_name != index.model_name:
+        return
+
+    embedding_id = instance.pk
+    transaction.on_commit(lambda: index.remove([embedding_id]))
+
+
+@receiver(post_delete, sender=VerificationRecord)
+def release_retained_images(sender, instance, **kwargs):
+    """Drop the record's references to its retained images once the delete is committed
+
+    Bulk purges delete records without signals and release the images themselves.
+    """
+    store = get_blob_store('uploads')
+    for path in (instance.known_image_path, instance.new_image_path):
+        digest = store.digest_for_path(path)
+        if digest is not None:
+            transaction.on_commit(lambda digest=digest: store.release(digest))
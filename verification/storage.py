@@ -0,0 +1,189 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import StoredBlob
+
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+class _ContentNeeded(Exception):
+    """Raised under the row lock when the blob file is missing and no temporary copy was written"""
+
+
+class BlobStore:
+    """Content-addressed file storage with reference-counted deduplication
+
+    Each blob is named by the SHA-256 of its content and sharded into nested
+    directories (ab/cd/abcd....jpg), so no directory grows past a few
+    hundred entries. Files are written to a temporary name under the root
+    and renamed into place, so a reader never sees a partial file. Saving
+    content that is already stored only increments its StoredBlob
+    ref_count; release() deletes the file once the last reference is gone.
+
+    Both take the StoredBlob row lock before looking at the file: save()
+    holds its new reference when it checks that the file exists, and
+    release() unlinks while still holding the lock, so a concurrent save of
+    the same content either keeps the file alive or writes it again. The
+    content is written and fsynced to a temporary file before the lock is
+    taken, so only the reference update and the rename happen under it.
+    """
+
+    def __init__(self, name, root, shard_depth=2):
+        self.name = name
+        self.root = str(root)
+        self.shard_depth = shard_depth
+        self.tmp_dir = os.path.join(self.root, '.tmp')
+
+    def relative_name(self, digest, extension=''):
+        """Return the path of a blob relative to the store root"""
+        shards = [digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+        return os.path.join(*shards, digest + extension)
+
+    def path(self, blob):
+        """Return the absolute path of a StoredBlob"""
+        return os.path.join(self.root, blob.name)
+
+    def save(self, content, extension=''):
+        """Store bytes and return (StoredBlob, created)"""
+        digest = hashlib.sha256(content).hexdigest()
+        tmp_path = None
+        try:
+            # Content that is already stored is not written again, unless it
+            # is deleted before the reference is taken
+            if not os.path.exists(os.path.join(self.root, self.relative_name(digest, extension))):
+                tmp_path = self._write_temp(content)
+            try:
+                return self._add_reference(digest, extension, len(content), tmp_path)
+            except _ContentNeeded:
+                tmp_path = self._write_temp(content)
+                return self._add_reference(digest, extension, len(content), tmp_path)
+        finally:
+            # Left behind when the content was already stored
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def _write_temp(self, content):
+        tmp_path = self._temp_file()
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+                os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return tmp_path
+
+    def save_chunks(self, chunks, extension=''):
+        """Store an iterable of byte chunks (e.g. UploadedFile.chunks()) and return (StoredBlob, created)"""
+        sha256 = hashlib.sha256()
+        size = 0
+        tmp_path = self._temp_file()
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        try:
+            return self._add_reference(sha256.hexdigest(), extension, size, tmp_path)
+        finally:
+            # Left behind when the content was already stored
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def release(self, digest):
+        """Drop one reference to a blob, deleting the file with the last one; return True if deleted"""
+        with transaction.atomic():
+            blob = StoredBlob.objects.select_for_update().filter(store=self.name, sha256=digest).first()
+            if blob is None:
+                return False
+            if blob.ref_count > 1:
+                StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+                return False
+            blob.delete()
+            # Still under the row lock, so a save() waiting on it sees the file gone and rewrites it
+            try:
+                os.unlink(self.path(blob))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def digest_for_path(self, path):
+        """Return the sha256 of the blob stored at an absolute path, or None if the path is not a blob of this store"""
+        if not path.startswith(self.root + os.sep):
+            return None
+        name = os.path.relpath(path, self.root)
+        return os.path.splitext(os.path.basename(name))[0] if self.is_blob_name(name) else None
+
+    def is_blob_name(self, name):
+        """Return True if a path relative to the root has the layout save() gives a blob"""
+        digest, extension = os.path.splitext(os.path.basename(name))
+        return bool(DIGEST.match(digest)) and name == self.relative_name(digest, extension)
+
+    def _temp_file(self):
+        # Same filesystem as the blobs, so the final rename is atomic
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        return tmp_path
+
+    def _move_into_place(self, tmp_path, name):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+    def _add_reference(self, digest, extension, size, tmp_path):
+        """Take a reference under the row lock, then put the file in place if it is missing
+
+        tmp_path is a temporary file already holding the content, or None
+        when the blob looked stored; if it turns out to be missing,
+        _ContentNeeded is raised and the reference is rolled back.
+        """
+        with transaction.atomic():
+            blob = StoredBlob.objects.select_for_update().filter(store=self.name, sha256=digest).first()
+            created = blob is None
+            if created:
+                try:
+                    with transaction.atomic():
+                        blob = StoredBlob.objects.create(
+                            store=self.name, sha256=digest, name=self.relative_name(digest, extension), size=size
+                        )
+                except IntegrityError:
+                    # Another request stored the same content first
+                    blob = StoredBlob.objects.select_for_update().get(store=self.name, sha256=digest)
+                    created = False
+            if not created:
+                blob.last_referenced_at = timezone.now()
+                StoredBlob.objects.filter(pk=blob.pk).update(
+                    ref_count=F('ref_count') + 1, last_referenced_at=blob.last_referenced_at
+                )
+                blob.ref_count += 1
+            if not os.path.exists(self.path(blob)):
+                if tmp_path is None:
+                    raise _ContentNeeded()
+                self._move_into_place(tmp_path, blob.name)
+        return blob, created
+
+
+_stores = {}
+
+
+def get_blob_store(name):
+    """Return the BlobStore configured under BLOB_STORAGE['stores'][name]"""
+    if name not in _stores:
+        config = settings.BLOB_STORAGE
+        _stores[name] = BlobStore(name, config['stores'][name], shard_depth=config.get('shard_depth', 2))
+    return _stores[name]
@@ -1,3 +1,1296 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from datetime import timedelta
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, transaction
+from django.apps import apps
+from django.middleware.csrf import CsrfViewMiddleware, _get_new_csrf_string
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import audit_buffer, imaging, jobs, metrics, profiling, quantization, services, storage, utils
+from .apps import start_warmup
+from .audit_buffer import AuditBuffer, AuditJournal, serialize_attempt
+from .model_registry import registry
+from .embedding_cache import EmbeddingCache
+from .imaging import ImageDecodeError, decode_base64_image
+from .models import FaceEmbedding, StoredBlob, VerificationJob, VerificationRecord
+from .retention import Purger
+from .scheduler import InferenceScheduler, get_inference_scheduler
+from .storage import BlobStore
+from .vector_index import EmbeddingIndex, IVFIndex
+
+# Run in a fresh interpreter so modules imported by this test run do not count
+STARTUP_SCRIPT = """
+import json, resource, sys
+import verification.views, verification.api_views, verification.async_views, verification.admin
+print(json.dumps({
+    'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': sorted(sys.modules),
+}))
+"""
+
+
+class StartupCostTests(SimpleTestCase):
+    """Management commands and request handling must not import the ML stack up front"""
+
+    HEAVY_MODULES = ('deepface', 'tensorflow', 'tf_keras', 'keras', 'torch', 'paddle', 'paddleocr', 'transformers')
+    MAX_SECONDS = 5.0
+    MAX_PEAK_RSS_MB = 200
+
+    def test_importing_views_stays_within_budget(self):
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, 'manage.py', 'shell', '-c', STARTUP_SCRIPT],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=120
+        )
+        seconds = time.perf_counter() - started
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        report = json.loads(completed.stdout.strip().splitlines()[-1])
+
+        loaded = [name for name in report['modules'] if name.split('.')[0] in self.HEAVY_MODULES]
+        self.assertEqual(loaded, [], "ML libraries imported at startup")
+        self.assertLess(seconds, self.MAX_SECONDS)
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak_mb = report['peak_rss_kb'] / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        self.assertLess(peak_mb, self.MAX_PEAK_RSS_MB)
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def representation(self):
+        return [{'embedding': [0.1, 0.2], 'facial_area': {'x': 1, 'y': 2, 'w': 3, 'h': 4}, 'face_confidence': 0.9}]
+
+    def test_mutating_a_result_does_not_change_the_cache(self):
+        cache = EmbeddingCache(directory=self.directory.name)
+        original = self.representation()
+        cache.set('ab' * 32, original)
+        original[0]['embedding'].append(9)
+
+        first = cache.get('ab' * 32)
+        first[0]['facial_area']['x'] = 100
+        first.append({})
+        self.assertEqual(cache.get('ab' * 32), self.representation())
+
+        cache.clear()
+        from_disk = cache.get('ab' * 32)
+        from_disk[0]['embedding'][0] = 5
+        self.assertEqual(cache.get('ab' * 32), self.representation())
+
+    def test_disk_tier_is_pruned_least_recently_used_first(self):
+        cache = EmbeddingCache(max_entries=1, directory=self.directory.name, max_disk_bytes=1, prune_interval=1000)
+        for i in range(10):
+            cache.set(f"{i:02d}" + 'f' * 62, self.representation())
+        entry_size = os.path.getsize(cache._path('00' + 'f' * 62))
+        cache.max_disk_bytes = entry_size * 5
+        # Touch the oldest entry so it counts as recently used
+        now = time.time()
+        for i in range(10):
+            os.utime(cache._path(f"{i:02d}" + 'f' * 62), (now - 100 + i, now - 100 + i))
+        os.utime(cache._path('00' + 'f' * 62))
+
+        removed = cache.prune_disk()
+
+        remaining = {i for i in range(10) if os.path.exists(cache._path(f"{i:02d}" + 'f' * 62))}
+        self.assertEqual(removed, 10 - len(remaining))
+        self.assertLessEqual(len(remaining) * entry_size, cache.max_disk_bytes * 0.9)
+        self.assertIn(0, remaining)
+        self.assertIn(9, remaining)
+        self.assertNotIn(1, remaining)
+        self.assertEqual(cache.stats()['disk_evictions'], removed)
+
+    def test_writes_trigger_pruning_every_prune_interval(self):
+        cache = EmbeddingCache(max_entries=1, directory=self.directory.name, max_disk_bytes=1, prune_interval=3)
+        for i in range(3):
+            cache.set(f"{i:02d}" + 'e' * 62, self.representation())
+        self.assertEqual(cache.stats()['disk_evictions'], 3)
+
+
+@override_settings(EMBEDDING_CACHE={'enabled': False})
+@mock.patch.object(utils, 'DEEPFACE_AVAILABLE', True)
+class UndecodableImageTests(TestCase):
+
+    def test_compare_faces_raises_for_undecodable_bytes(self):
+        with self.assertRaises(ImageDecodeError):
+            utils.compare_faces(b'not an image', b'not an image either')
+
+    def test_verify_answers_400_for_undecodable_image(self):
+        payload = {'known_image': 'bm90IGFuIGltYWdl', 'new_image': 'bm90IGFuIGltYWdl'}
+        response = self.client.post('/verify/', data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], "Could not decode image data")
+
+
+class BinaryTransportTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('transport'))
+
+    def capture(self, content):
+        upload = io.BytesIO(content)
+        upload.name = 'face.jpg'
+        with mock.patch('verification.api_views.store_capture', return_value={'filename': 'x.jpg'}) as store:
+            response = self.client.post('/api/capture/', {'image': upload}, format='multipart')
+        return response, store
+
+    def test_multipart_part_is_kept_in_memory(self):
+        # Larger than FILE_UPLOAD_MAX_MEMORY_SIZE, which would spool to disk by default
+        content = os.urandom(3 * 1024 * 1024)
+        with mock.patch('django.core.files.uploadhandler.TemporaryFileUploadHandler.new_file') as spool:
+            response, store = self.capture(content)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(bytes(store.call_args.args[0]), content)
+        spool.assert_not_called()
+
+    @override_settings(MAX_CONTENT_LENGTH=1024)
+    def test_oversized_part_is_rejected_with_413(self):
+        response, store = self.capture(b'x' * 1025)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()['detail'], "'image' exceeds 1024 bytes")
+        store.assert_not_called()
+        self.assertEqual(self.capture(b'x' * 1024)[0].status_code, 200)
+
+    def test_chunked_base64_decoding(self):
+        data = os.urandom(1000)
+        encoded = base64.b64encode(data).decode()
+        # Chunks of 8 characters put line breaks and padding on chunk boundaries
+        with mock.patch('verification.imaging.BASE64_CHUNK_SIZE', 8):
+            for image_data in (
+                encoded,
+                base64.encodebytes(data).decode(),
+                'data:image/jpeg;base64,' + encoded,
+                '   ' + encoded + '\r\n',
+            ):
+                self.assertEqual(bytes(decode_base64_image(image_data)), data)
+            self.assertEqual(bytes(decode_base64_image('YQ==')), b'a')
+            for image_data, error in (
+                (encoded[:-1], "Incorrect padding"),
+                ('YQ', "Incorrect padding"),
+                ('', "Empty image data"),
+                ('====', "Empty image data"),
+                ('data:image/jpeg;base64', "missing ','"),
+            ):
+                with self.assertRaisesRegex(ImageDecodeError, error):
+                    decode_base64_image(image_data)
+
+
+class DetectionPreprocessingTests(SimpleTestCase):
+
+    def test_downscale_keeps_small_images(self):
+        img = np.zeros((600, 800, 3), dtype=np.uint8)
+        self.assertIs(imaging.downscale_for_detection(img, 1280)[0], img)
+        self.assertIs(imaging.downscale_for_detection(img, None)[0], img)
+        small, scale = imaging.downscale_for_detection(np.zeros((2000, 3000, 3), dtype=np.uint8), 1500)
+        self.assertEqual((small.shape, scale), ((1000, 1500, 3), 0.5))
+
+    def test_facial_area_is_mapped_back_and_clamped(self):
+        area = {'x': 10, 'y': 20, 'w': 30, 'h': 40, 'left_eye': (30, 30), 'right_eye': None}
+        self.assertEqual(imaging.scale_facial_area(area, 0.5, (1000, 1000, 3)), {
+            'x': 20, 'y': 40, 'w': 60, 'h': 80, 'left_eye': (60, 60), 'right_eye': None
+        })
+        # A box reaching past the edge of the downscaled copy stays inside the original
+        edge = {'x': -2, 'y': 45, 'w': 52, 'h': 10}
+        self.assertEqual(imaging.scale_facial_area(edge, 0.1, (500, 500)),
+                         {'x': 0, 'y': 450, 'w': 499, 'h': 49, 'left_eye': None, 'right_eye': None})
+
+    def test_aligned_crop_matches_rotating_the_whole_image(self):
+        img = cv2.GaussianBlur(np.random.default_rng(0).integers(0, 255, (300, 400, 3), dtype=np.uint8), (9, 9), 3)
+        # Centred, in a corner, and against the far edges (black outside the image)
+        for x, y, w, h in ((100, 80, 120, 140), (0, 0, 80, 100), (330, 220, 69, 79)):
+            cx, cy = x + w / 2, y + h / 2
+            area = {'x': x, 'y': y, 'w': w, 'h': h,
+                    'left_eye': (int(cx + 30), int(cy - 15)), 'right_eye': (int(cx - 30), int(cy + 10))}
+            angle = np.degrees(np.arctan2(-25, 60))
+            rotated = cv2.warpAffine(img, cv2.getRotationMatrix2D((cx, cy), angle, 1.0), (400, 300),
+                                     flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+            top, left = int(cy - h / 2), int(cx - w / 2)
+            np.testing.assert_array_equal(imaging.crop_aligned_face(img, area),
+                                          rotated[top:top + h, left:left + w])
+
+    def test_crop_without_eyes_is_not_rotated(self):
+        img = np.arange(100 * 100 * 3, dtype=np.uint8).reshape(100, 100, 3)
+        area = {'x': 10, 'y': 20, 'w': 30, 'h': 40, 'left_eye': None, 'right_eye': (5, 5)}
+        np.testing.assert_array_equal(imaging.crop_aligned_face(img, area), img[20:60, 10:40])
+
+
+class DetectorCascadeTests(SimpleTestCase):
+
+    CASCADE = [{'backend': 'opencv', 'min_confidence': 0.9, 'require_landmarks': True}, {'backend': 'retinaface'}]
+
+    def face(self, confidence=0.95, left_eye=(60, 40), right_eye=(40, 40)):
+        return {'confidence': confidence,
+                'facial_area': {'x': 20, 'y': 10, 'w': 60, 'h': 80, 'left_eye': left_eye, 'right_eye': right_eye}}
+
+    def test_stage_thresholds(self):
+        stage = self.CASCADE[0]
+        self.assertTrue(utils._accept_detections([self.face(), self.face(0.9)], stage))
+        for faces in (
+            [],
+            [self.face(), self.face(0.89)],  # every face must pass
+            [self.face(0)],  # whole-image stand-in for no face
+            [self.face(right_eye=None)],
+            [self.face(left_eye=(42, 40))],  # eyes too close for the box
+            [self.face(left_eye=(60, 75), right_eye=(40, 75))],  # eyes below the upper face
+        ):
+            self.assertFalse(utils._accept_detections(faces, stage), faces)
+        self.assertTrue(utils._accept_detections([self.face(0.1, right_eye=None)], {'backend': 'opencv'}))
+
+    def detect(self, results, enforce_detection=False):
+        detect = mock.Mock(side_effect=lambda img, backend, **kwargs: results[backend])
+        with mock.patch.dict(settings.FACE_VERIFICATION, {'detector_cascade': self.CASCADE}), \
+                mock.patch.object(utils, '_detect_with_backend', detect):
+            return utils.detect_faces('image', enforce_detection=enforce_detection), detect
+
+    def test_accepted_first_stage_skips_the_fallback(self):
+        faces, detect = self.detect({'opencv': [self.face()]}, enforce_detection=True)
+        self.assertEqual(faces[0]['detector_backend'], 'opencv')
+        detect.assert_called_once_with('image', 'opencv', enforce_detection=False, max_side=None)
+
+    def test_rejected_first_stage_falls_back(self):
+        faces, detect = self.detect({'opencv': [self.face(0.5)], 'retinaface': [self.face(0.7)]},
+                                    enforce_detection=True)
+        self.assertEqual([face['detector_backend'] for face in faces], ['retinaface'])
+        self.assertEqual(faces[0]['confidence'], 0.7)
+        # Only the last stage may raise for a missing face
+        self.assertEqual([c.kwargs['enforce_detection'] for c in detect.call_args_list], [False, True])
+
+    def test_last_stage_is_accepted_even_without_faces(self):
+        faces, _ = self.detect({'opencv': [], 'retinaface': []})
+        self.assertEqual(faces, [])
+
+
+class IdentifyNoFaceTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('identify'))
+
+    def identify(self):
+        return self.client.post('/api/identify/', {'image': 'aW1hZ2U='}, format='json')
+
+    def test_whole_image_fallback_is_rejected(self):
+        fallback = [{'embedding': [0.1] * 128, 'facial_area': {'x': 0, 'y': 0, 'w': 10, 'h': 10}, 'face_confidence': 0}]
+        with mock.patch.object(services, 'represent_faces', return_value=fallback), \
+                mock.patch.object(services, 'get_index') as get_index:
+            response = self.identify()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], "No face detected in the image")
+        get_index.assert_not_called()
+
+    def test_empty_representation_is_rejected(self):
+        with mock.patch.object(services, 'represent_faces', return_value=[]):
+            response = self.identify()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], "No face detected in the image")
+
+
+class BatchVerificationTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('batch'))
+
+    def represent(self, images):
+        return [ImageDecodeError("Could not decode image data") if image == b'bad' else [image] for image in images]
+
+    def match(self, known_faces, new_faces):
+        if known_faces == [b'faceless']:
+            raise ValueError("No face could be extracted from one of the images")
+        verified = known_faces == new_faces
+        return {'verified': verified, 'distance': 0.0 if verified else 1.0, 'threshold': 0.4,
+                'distance_metric': 'cosine', 'model': 'test-model', 'detector_backend': 'opencv',
+                'known_detector_backend': 'opencv',
+                'new_face': {'embedding': [1.0, 0.0], 'facial_area': None, 'face_confidence': 0.9}}
+
+    def post(self, lines, **patches):
+        body = '\n'.join(line if isinstance(line, str) else json.dumps(line) for line in lines)
+        with mock.patch.object(services, 'represent_images', **{'side_effect': self.represent, **patches}) as represent, \
+                mock.patch.object(services, 'match_faces', side_effect=self.match):
+            response = self.client.post('/api/verify/batch/', body, content_type='application/x-ndjson')
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        return rows, represent
+
+    def pair(self, pair_id, known, new):
+        return {'id': pair_id, 'known_image': base64.b64encode(known).decode(),
+                'new_image': base64.b64encode(new).decode()}
+
+    def test_results_stream_in_order_with_per_pair_errors(self):
+        with mock.patch.dict(settings.FACE_VERIFICATION, {'batch_chunk_size': 2}):
+            rows, represent = self.post([
+                self.pair('same', b'a', b'a'),
+                'not json',
+                self.pair('different', b'a', b'b'),
+                {'id': 'missing'},
+                self.pair('bad', b'bad', b'a'),
+                self.pair('faceless', b'faceless', b'a'),
+            ])
+        self.assertEqual([row['index'] for row in rows], list(range(6)))
+        self.assertEqual([row['success'] for row in rows], [True, False, True, False, False, True])
+        self.assertTrue(rows[0]['verified'])
+        self.assertFalse(rows[2]['verified'])
+        self.assertIn('Invalid JSON line', rows[1]['error'])
+        self.assertIn('known_image', rows[3]['error'])
+        self.assertEqual(rows[4], {'index': 4, 'id': 'bad', 'success': False, 'error': "Could not decode image data"})
+        # A pair without faces was still verified, and failed
+        self.assertEqual(rows[5]['error'], "No face could be extracted from one of the images")
+        self.assertFalse(rows[5]['verified'])
+        # Three chunks of two, each embedded in one pass
+        self.assertEqual(represent.call_count, 3)
+        self.assertEqual(VerificationRecord.objects.count(), 3)
+        self.assertEqual(FaceEmbedding.objects.count(), 1)
+
+    def test_failed_embedding_pass_records_nothing(self):
+        rows, _ = self.post([self.pair('one', b'a', b'a'), self.pair('two', b'a', b'b')],
+                            side_effect=RuntimeError("model failed"))
+        self.assertEqual(rows, [
+            {'index': 0, 'id': 'one', 'success': False, 'error': "model failed"},
+            {'index': 1, 'id': 'two', 'success': False, 'error': "model failed"},
+        ])
+        self.assertFalse(VerificationRecord.objects.exists())
+
+
+class InferenceSchedulerTests(SimpleTestCase):
+
+    def embed_concurrently(self, scheduler, batches):
+        results = {}
+        threads = [
+            threading.Thread(target=lambda images=images: results.update({images[0]: self.call(scheduler, images)}))
+            for images in batches
+        ]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def call(self, scheduler, images):
+        try:
+            return scheduler.embed(images)
+        except BaseException as e:
+            return e
+
+    def test_concurrent_requests_share_a_batch(self):
+        runs = []
+        scheduler = InferenceScheduler(lambda images: runs.append(list(images)) or [i * 10 for i in images],
+                                       max_wait_ms=10000, max_batch_size=4)
+        threads, results = self.embed_concurrently(scheduler, [[1, 2], [3], [4]])
+        for thread in threads:
+            thread.join(5)
+        # Full before max_wait ran out
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(sorted(runs[0]), [1, 2, 3, 4])
+        self.assertEqual(results, {1: [10, 20], 3: [30], 4: [40]})
+        self.assertEqual(scheduler.stats()['batch_size_histogram'], {'4': 1})
+
+    def test_lone_request_is_dispatched_after_max_wait(self):
+        scheduler = InferenceScheduler(lambda images: images, max_wait_ms=50, max_batch_size=32)
+        started = time.monotonic()
+        self.assertEqual(scheduler.embed([1]), [1])
+        self.assertGreaterEqual(time.monotonic() - started, 0.045)
+        self.assertEqual(scheduler.stats()['batches'], 1)
+
+    def test_runner_errors_reach_every_caller_in_the_batch(self):
+        def runner(images):
+            raise ValueError("model failed")
+
+        scheduler = InferenceScheduler(runner, max_wait_ms=10000, max_batch_size=2)
+        threads, results = self.embed_concurrently(scheduler, [[1], [2]])
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual({type(e) for e in results.values()}, {ValueError})
+        self.assertEqual(scheduler.stats()['errors'], 1)
+        scheduler.runner = lambda images: images
+        self.assertEqual(scheduler.embed([3, 4]), [3, 4])
+
+    def test_dispatcher_death_fails_queued_requests_and_restarts(self):
+        class Stop(BaseException):
+            pass
+
+        release = threading.Event()
+
+        def runner(images):
+            release.wait(5)
+            raise Stop()
+
+        scheduler = InferenceScheduler(runner, max_wait_ms=0, max_batch_size=1)
+        with mock.patch('threading.excepthook'), mock.patch('builtins.print'):
+            threads, results = self.embed_concurrently(scheduler, [[1]])
+            while scheduler.stats()['batches'] == 0:
+                time.sleep(0.001)
+            more, queued = self.embed_concurrently(scheduler, [[2]])
+            while scheduler._queue.qsize() == 0:
+                time.sleep(0.001)
+            release.set()
+            for thread in threads + more:
+                thread.join(5)
+        self.assertIsInstance(results[1], Stop)
+        self.assertIsInstance(queued[2], Stop)
+        scheduler.runner = lambda images: images
+        self.assertEqual(scheduler.embed([3]), [3])
+
+    def test_disabled_unless_configured(self):
+        with override_settings(INFERENCE_SCHEDULER={}):
+            self.assertIsNone(get_inference_scheduler())
+
+
+class EmbeddingRetrievalTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('embeddings'))
+        self.vector = np.array([0.5, -1.25, 2.0], dtype=np.float32)
+        self.old = FaceEmbedding.objects.create(created_at=timezone.now() - timedelta(days=1))
+        self.embedding = FaceEmbedding.from_face({'embedding': self.vector}, 'test-model')
+        self.embedding.save()
+
+    def test_representations(self):
+        for path in ('/api/embeddings/', '/embeddings/'):
+            packed = self.client.get(path, {'format': 'base64'}).json()['embedding']
+            self.assertEqual((packed['id'], packed['dimension']), (self.embedding.pk, 3))
+            self.assertEqual(np.frombuffer(base64.b64decode(packed['embedding']), '<f4').tolist(), self.vector.tolist())
+            binary = self.client.get(path, {'format': 'binary'})
+            self.assertEqual(binary['Content-Type'], 'application/octet-stream')
+            self.assertEqual(binary.content, self.vector.astype('<f4').tobytes())
+            self.assertEqual(binary['X-Embedding-Id'], str(self.embedding.pk))
+        self.assertEqual(self.client.get('/api/embeddings/').json()['embedding']['embedding'], self.vector.tolist())
+        self.assertEqual(self.client.get('/embeddings/').json()['embedding'][0]['embedding'], self.vector.tolist())
+        self.assertEqual(self.client.get('/embeddings/', {'format': 'xml'}).status_code, 400)
+
+    def test_lookup_by_id(self):
+        for path in ('/api/embeddings/{}/', '/embeddings/{}/'):
+            self.assertEqual(self.client.get(path.format(self.old.pk), {'format': 'base64'}).json()['embedding']['id'],
+                             self.old.pk)
+            missing = self.client.get(path.format(self.embedding.pk + 1))
+            self.assertEqual((missing.status_code, missing.json()['message']), (404, 'Embedding not found'))
+
+    def test_conditional_get(self):
+        for path in ('/api/embeddings/', '/embeddings/'):
+            response = self.client.get(path, {'format': 'binary'})
+            etag, last_modified = response['ETag'], response['Last-Modified']
+            self.assertIn('no-cache', response['Cache-Control'])
+            self.assertEqual(self.client.get(path, {'format': 'binary'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(
+                self.client.get(path, {'format': 'binary'}, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304
+            )
+            # Each representation has its own ETag
+            self.assertEqual(self.client.get(path, {'format': 'base64'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Saving the row changes the validators
+        self.embedding.face_confidence = 0.5
+        self.embedding.save()
+        self.assertEqual(self.client.get('/api/embeddings/', {'format': 'binary'},
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class RequestProfilingTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.config = {'enabled': True, 'sample_rate': 0.0, 'header': 'X-Profile-Request', 'token': 'secret',
+                       'directory': directory.name, 'max_profiles': 2, 'top_allocations': 5}
+
+    def get(self, header_value=None, **config):
+        headers = {'HTTP_X_PROFILE_REQUEST': header_value} if header_value is not None else {}
+        with override_settings(REQUEST_PROFILING={**self.config, **config}):
+            # The middleware chain is built on the first request of a new client
+            return Client().get('/embeddings/', **headers)
+
+    def store(self):
+        return profiling.ProfileStore(self.config['directory'], max_profiles=2)
+
+    def test_requests_with_the_token_header_are_profiled(self):
+        self.assertEqual(self.get(header_value='wrong').status_code, 200)
+        self.assertEqual(self.store().list(), [])
+
+        self.get(header_value='secret')
+        [profile] = self.store().list()
+        self.assertEqual((profile['trigger'], profile['path'], profile['view'], profile['status']),
+                         ('header', '/embeddings/', 'get_embeddings', 200))
+        self.assertLessEqual(len(profile['top_allocations']), 5)
+        self.assertIn('peak_memory_kb', profile)
+        self.assertIn('cumulative', self.store().read_text(profile['id']))
+        self.assertTrue(os.path.exists(self.store().path(profile['id'], '.prof')))
+
+    def test_sampling_and_one_capture_at_a_time(self):
+        self.get(sample_rate=1.0)
+        self.assertEqual([p['trigger'] for p in self.store().list()], ['sample'])
+        with profiling._active:
+            self.get(sample_rate=1.0)
+        self.assertEqual(len(self.store().list()), 1)
+
+    def test_store_keeps_the_newest_profiles(self):
+        store = self.store()
+        ids = []
+        for _ in range(3):
+            capture = profiling.Capture(use_tracemalloc=False)
+            capture.start()
+            capture.stop()
+            ids.append(store.save({}, capture))
+            time.sleep(0.002)
+        self.assertEqual([p['id'] for p in store.list()], ids[:0:-1])
+        self.assertEqual(sorted(os.listdir(self.config['directory'])),
+                         sorted(f"{profile_id}{ext}" for profile_id in ids[1:] for ext in store.extensions))
+        with self.assertRaises(ValueError):
+            store.path('../../etc/passwd', '.json')
+
+
+class QuantizationTests(TestCase):
+
+    def test_round_trips(self):
+        # Rows of very different magnitudes
+        magnitudes = np.array([0.01, 100] * 25, dtype=np.float32)[:, None]
+        vectors = np.random.default_rng(0).normal(size=(50, 128)).astype(np.float32) * magnitudes
+        codes, scales = quantization.quantize(vectors, 'float32')
+        self.assertEqual(quantization.dequantize(codes, 'float32', scales).tolist(), vectors.tolist())
+
+        codes, scales = quantization.quantize(vectors, 'float16')
+        self.assertEqual((codes.dtype, scales), (np.dtype('<f2'), None))
+        np.testing.assert_allclose(quantization.dequantize(codes, 'float16'), vectors, rtol=1e-3, atol=1e-6)
+
+        codes, scales = quantization.quantize(vectors, 'int8')
+        self.assertEqual(np.abs(codes).max(axis=1).tolist(), [127] * 50)
+        # Off by at most half a step of each row's own scale, whatever its magnitude
+        error = np.abs(quantization.dequantize(codes, 'int8', scales) - vectors)
+        self.assertTrue((error <= scales[:, None] / 2 + 1e-7).all())
+
+    def test_single_vectors(self):
+        vector = np.linspace(-1, 1, 8, dtype=np.float32)
+        for encoding, size in (('float32', 32), ('float16', 16), ('int8', 8)):
+            packed, scale = quantization.encode_vector(vector, encoding)
+            self.assertEqual(len(packed), size)
+            self.assertEqual(scale is None, encoding != 'int8')
+            np.testing.assert_allclose(quantization.decode_vector(packed, encoding, scale), vector, atol=1 / 127)
+        self.assertEqual(quantization.bytes_per_vector(8, 'int8'), 12)
+        # An all-zero vector still has a usable scale
+        packed, scale = quantization.encode_vector(np.zeros(8), 'int8')
+        self.assertEqual((scale, quantization.decode_vector(packed, 'int8', scale).tolist()), (1.0, [0.0] * 8))
+        with self.assertRaisesRegex(ValueError, "Unknown embedding encoding"):
+            quantization.encode_vector(vector, 'int4')
+
+    def test_stored_rows_decode_to_float32(self):
+        vector = np.random.default_rng(1).normal(size=128).astype(np.float32)
+        for encoding in ('float16', 'int8'):
+            embedding = FaceEmbedding.from_face({'embedding': vector}, 'test-model', encoding=encoding)
+            embedding.save()
+            embedding.refresh_from_db()
+            self.assertEqual(len(embedding.vector), 128 * quantization.ENCODINGS[encoding].itemsize)
+            stored = np.frombuffer(embedding.get_vector_bytes(), '<f4')
+            np.testing.assert_allclose(stored, embedding.get_vector())
+            np.testing.assert_allclose(stored, vector, atol=np.abs(vector).max() / 127)
+
+    def test_quantized_search_is_reranked_in_float32_order(self):
+        rng = np.random.default_rng(0)
+        query = rng.normal(size=16).astype(np.float32)
+        query /= np.linalg.norm(query)
+        vectors = (query + 0.05 * rng.normal(size=(200, 16))).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        ids = []
+        for vector in vectors:
+            embedding = FaceEmbedding.from_face({'embedding': vector}, 'test-model')
+            embedding.save()
+            ids.append(embedding.pk)
+        exact = [ids[i] for i in np.argsort(-(vectors @ query))[:5]]
+
+        index = EmbeddingIndex('test-model', quantization='int8', rerank_factor=4)
+        index.sync()
+        # The int8 scores alone put the nearest rows in another order
+        with mock.patch.object(index, '_rerank', side_effect=lambda query, matches: matches):
+            self.assertNotEqual([pk for pk, _ in index.search(query, k=5)], exact)
+        results = index.search(query, k=5)
+        self.assertEqual([pk for pk, _ in results], exact)
+        expected = 1 - np.sort(vectors @ query)[::-1][:5]
+        np.testing.assert_allclose([distance for _, distance in results], expected, atol=1e-5)
+
+
+class IVFMaintenanceTests(TestCase):
+
+    def build(self, **options):
+        index = IVFIndex('test-model', nlist=4, train_min=100, train_sample=200, **options)
+        vectors = np.random.default_rng(0).normal(size=(400, 8)).astype(np.float32)
+        index.add(np.arange(1, 401), vectors)
+        return index, vectors
+
+    def test_search_is_answered_while_clusters_are_trained(self):
+        index, vectors = self.build()
+        started, release = threading.Event(), threading.Event()
+        kmeans = index._kmeans
+
+        def slow_kmeans(*args):
+            started.set()
+            release.wait(10)
+            return kmeans(*args)
+
+        with mock.patch.object(index, '_kmeans', side_effect=slow_kmeans):
+            index.sync()
+            self.assertTrue(started.wait(10))
+            self.assertTrue(index.stats()['clustering'])
+            # The lock is free, so a query on another thread is answered from the exact scan
+            results = []
+            searcher = threading.Thread(target=lambda: results.append(index.search(vectors[0], k=1)))
+            searcher.start()
+            searcher.join(5)
+            self.assertEqual(results[0][0][0], 1)
+            self.assertIsNone(index._centroids)
+            release.set()
+            index.wait_for_maintenance(10)
+
+        self.assertEqual(len(index._centroids), 4)
+        self.assertEqual(len(index._assignments), 400)
+        self.assertEqual(index.search(vectors[0], k=1)[0][0], 1)
+
+    def test_clusters_of_a_rebuilt_index_are_discarded(self):
+        index, _ = self.build(background=False)
+        clustering = index._cluster(retrain=True)
+        index.rebuild()
+        self.assertFalse(index._apply(clustering))
+        self.assertIsNone(index._centroids)
+
+
+class IndexSyncTests(TestCase):
+
+    def embedding(self, pk, seed, **fields):
+        vector = np.random.default_rng(seed).normal(size=8)
+        embedding = FaceEmbedding.from_face({'embedding': vector / np.linalg.norm(vector)}, 'test-model')
+        embedding.pk = pk
+        for name, value in fields.items():
+            setattr(embedding, name, value)
+        embedding.save()
+        return embedding
+
+    def test_rows_committed_behind_the_cursor_are_indexed(self):
+        index = EmbeddingIndex('test-model', reconcile_interval=3600)
+        self.embedding(10, 0)
+        self.embedding(20, 1)
+        self.assertEqual(index.sync(), 2)
+        # Another transaction commits a lower id after the cursor passed it
+        late = self.embedding(15, 2)
+        self.assertEqual(index.sync(), 1)
+        self.assertEqual(index.search(late.get_vector(), k=1)[0][0], 15)
+        self.assertEqual(index.sync(), 0)
+
+        # Older than the overlap window: only a reconcile finds it
+        self.embedding(12, 3, created_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(index.sync(), 0)
+        self.assertEqual(index.reconcile(), (1, 0))
+        self.assertEqual(sorted(index._ids[:len(index)]), [10, 12, 15, 20])
+
+    def test_deleted_rows_leave_the_index(self):
+        index = EmbeddingIndex('test-model', reconcile_interval=0)
+        first, second, third = (self.embedding(pk, pk) for pk in (1, 2, 3))
+        index.sync()
+        with mock.patch('verification.signals.get_loaded_index', return_value=index), \
+                self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(sorted(index._ids[:len(index)]), [2, 3])
+
+        # Raw deletes (the purge command, other processes) are caught by the reconcile
+        FaceEmbedding.objects.filter(pk=second.pk)._raw_delete('default')
+        index.sync()
+        self.assertEqual(index._ids[:len(index)].tolist(), [3])
+        self.assertEqual(index.search(third.get_vector(), k=5)[0][0], 3)
+
+    def test_purge_removes_embeddings_from_the_loaded_index(self):
+        index = EmbeddingIndex('test-model', reconcile_interval=3600)
+        self.embedding(1, 1, created_at=timezone.now() - timedelta(days=40))
+        self.embedding(2, 2)
+        index.sync()
+        with mock.patch('verification.retention.get_loaded_index', return_value=index), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Purger(max_age_days=30).purge_embeddings(), 1)
+        self.assertEqual(index._ids[:len(index)].tolist(), [2])
+
+    def test_removing_rows_keeps_ivf_lists_consistent(self):
+        index = IVFIndex('test-model', nlist=4, train_min=100, train_sample=200, background=False)
+        vectors = np.random.default_rng(0).normal(size=(400, 8)).astype(np.float32)
+        index.add(np.arange(1, 401), vectors)
+        index.train()
+        clustering = index._cluster(retrain=False)
+        self.assertEqual(index.remove(range(1, 401, 2)), 200)
+        # Positions moved, so clustering of the old matrix is not swapped in
+        self.assertFalse(index._apply(clustering))
+        self.assertEqual(len(index._assignments), 200)
+        self.assertEqual(index._list_offsets[-1], 200)
+        self.assertEqual(index.search(vectors[1], k=1)[0][0], 2)
+        self.assertEqual(index.search(vectors[0], k=1)[0][0] % 2, 0)
+
+
+class StaleJobTests(TestCase):
+
+    def running_job(self, started, heartbeat, attempts=1):
+        now = timezone.now()
+        return VerificationJob.objects.create(
+            status=VerificationJob.RUNNING, worker='host:1', attempts=attempts,
+            started_at=now - timedelta(seconds=started),
+            heartbeat_at=now - timedelta(seconds=heartbeat) if heartbeat is not None else None
+        )
+
+    def test_long_running_job_with_a_live_heartbeat_is_left_alone(self):
+        job = self.running_job(started=3600, heartbeat=10)
+        self.assertEqual(jobs.requeue_stale_jobs(stale_after=300, max_attempts=3), (0, 0))
+        job.refresh_from_db()
+        self.assertEqual(job.status, VerificationJob.RUNNING)
+
+    def test_jobs_whose_heartbeat_stopped_are_requeued_or_failed(self):
+        lost = self.running_job(started=600, heartbeat=400)
+        exhausted = self.running_job(started=600, heartbeat=400, attempts=3)
+        legacy = self.running_job(started=600, heartbeat=None)
+        self.assertEqual(jobs.requeue_stale_jobs(stale_after=300, max_attempts=3), (2, 1))
+        for job, status in ((lost, VerificationJob.PENDING), (exhausted, VerificationJob.FAILED),
+                            (legacy, VerificationJob.PENDING)):
+            job.refresh_from_db()
+            self.assertEqual(job.status, status)
+
+
+class JobHeartbeatTests(TransactionTestCase):
+
+    def test_heartbeat_is_renewed_while_the_job_runs(self):
+        job = VerificationJob.objects.create(known_image=b'a', new_image=b'b')
+        job = jobs.claim_next_job('host:1')
+        VerificationJob.objects.filter(id=job.id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+
+        def slow_verify(*args):
+            time.sleep(0.5)
+            return {'verified': True}
+
+        with mock.patch.object(jobs, 'verify_and_record', side_effect=slow_verify), \
+                mock.patch.dict(settings.VERIFICATION_JOBS, heartbeat_interval=0.05):
+            jobs.run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, VerificationJob.DONE)
+        self.assertGreater(job.heartbeat_at, timezone.now() - timedelta(seconds=5))
+
+
+@override_settings(INFERENCE_POOL={'enabled': False})
+class PreforkWarmupTests(SimpleTestCase):
+
+    def test_preloading_master_does_not_start_the_warmup(self):
+        with mock.patch.dict(os.environ, FACE_WARMUP_AFTER_FORK='1'), \
+                mock.patch('verification.apps._is_serving_process', return_value=True), \
+                mock.patch.object(registry, 'start') as start:
+            apps.get_app_config('verification').ready()
+        start.assert_not_called()
+
+    def test_forked_worker_starts_its_own_warmup(self):
+        with mock.patch.object(registry, 'start') as start:
+            start_warmup()
+        start.assert_called_once_with(background=settings.FACE_VERIFICATION.get('warmup_in_background', True))
+
+
+class AsyncSessionCsrfTests(TestCase):
+
+    def setUp(self):
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.force_login(User.objects.create_user('async'))
+
+    def test_session_write_without_csrf_token_is_rejected(self):
+        response = self.client.post('/api/async/capture/', {'image': 'aW1hZ2U='}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_csrf_check_runs_off_the_event_loop(self):
+        on_loop = []
+        process_view = CsrfViewMiddleware.process_view
+
+        def checking(*args):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(True)
+            except RuntimeError:
+                on_loop.append(False)
+            return process_view(*args)
+
+        with mock.patch.object(CsrfViewMiddleware, 'process_view', autospec=True, side_effect=checking):
+            self.client.post('/api/async/capture/', {'image': 'aW1hZ2U='}, content_type='application/json')
+        # The middleware's own call (a no-op for csrf_exempt views) also lands here
+        self.assertEqual(set(on_loop), {False})
+
+    @override_settings(MAX_CONTENT_LENGTH=1024)
+    def test_oversized_multipart_body_is_a_json_413(self):
+        # With a CSRF cookie the check reads the form token from the body
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = _get_new_csrf_string()
+        for path, field in (('/api/async/capture/', 'image'), ('/api/async/upload/', 'file')):
+            upload = io.BytesIO(b'x' * 4096)
+            upload.name = 'face.png'
+            response = self.client.post(path, {field: upload})
+            self.assertEqual(response.status_code, 413, path)
+            self.assertIn('exceeds 1024 bytes', response.json()['error'])
+
+
+class RecordPaginationTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('records'))
+        now = timezone.now()
+        self.tied = now - timedelta(hours=1)
+        dates = [now, self.tied, self.tied, self.tied, now - timedelta(hours=2)]
+        self.records = [
+            VerificationRecord.objects.create(known_image_path='a', new_image_path='b', is_verified=True,
+                                              verification_date=date)
+            for date in dates
+        ]
+
+    def page(self, **params):
+        response = self.client.get('/api/records/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_cursor_round_trip(self):
+        record = self.records[2]
+        cursor = services.encode_record_cursor(record)
+        self.assertEqual(services.decode_record_cursor(cursor), (record.verification_date, record.id))
+
+    def test_pages_cover_tied_dates_exactly_once_in_order(self):
+        seen, cursor = [], None
+        while True:
+            body = self.page(limit=2, **({'cursor': cursor} if cursor else {}))
+            seen.extend(record['id'] for record in body['records'])
+            cursor = body['next_cursor']
+            if cursor is None:
+                break
+        expected = sorted(self.records, key=lambda record: (record.verification_date, record.id), reverse=True)
+        self.assertEqual(seen, [record.id for record in expected])
+
+    def test_cursor_inside_a_tie_resumes_after_that_row(self):
+        tied = sorted((record for record in self.records if record.verification_date == self.tied),
+                      key=lambda record: record.id, reverse=True)
+        body = self.page(limit=1, cursor=services.encode_record_cursor(tied[0]))
+        self.assertEqual(body['records'][0]['id'], tied[1].id)
+
+    def test_tampered_cursors_are_rejected(self):
+        valid = services.encode_record_cursor(self.records[0])
+        raw = base64.urlsafe_b64decode(valid).decode()
+        tampered = [
+            valid[:-3],
+            valid.replace(valid[0], '*'),
+            base64.urlsafe_b64encode(raw.replace('|', '#').encode()).decode(),
+            base64.urlsafe_b64encode((raw.rsplit('|', 1)[0] + '|1 OR 1=1').encode()).decode(),
+            base64.urlsafe_b64encode(('yesterday|' + raw.rsplit('|', 1)[1]).encode()).decode(),
+        ]
+        for cursor in tampered:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(ValueError):
+                    services.decode_record_cursor(cursor)
+                response = self.client.get('/api/records/', {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['error'], "Invalid cursor")
+
+
+class BlobStoreTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = BlobStore('uploads', directory.name)
+
+    def test_same_content_is_stored_once(self):
+        first, created = self.store.save(b'image', '.jpg')
+        second, created_again = self.store.save_chunks([b'ima', b'ge'], '.jpg')
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(StoredBlob.objects.get(pk=first.pk).ref_count, 2)
+        files = [name for _, _, names in os.walk(self.store.root) for name in names]
+        self.assertEqual(files, [first.sha256 + '.jpg'])
+
+    def test_file_is_deleted_with_the_last_reference(self):
+        blob, _ = self.store.save(b'image', '.jpg')
+        self.store.save(b'image', '.jpg')
+        self.assertFalse(self.store.release(blob.sha256))
+        self.assertTrue(os.path.exists(self.store.path(blob)))
+        self.assertTrue(self.store.release(blob.sha256))
+        self.assertFalse(os.path.exists(self.store.path(blob)))
+        self.assertFalse(StoredBlob.objects.filter(pk=blob.pk).exists())
+
+    def test_save_rewrites_a_file_released_before_it_took_its_reference(self):
+        blob, _ = self.store.save(b'image', '.jpg')
+        self.store.release(blob.sha256)
+        again, created = self.store.save(b'image', '.jpg')
+        self.assertTrue(created)
+        self.assertTrue(os.path.exists(self.store.path(again)))
+
+    def test_deleting_a_record_releases_its_retained_images(self):
+        blob, _ = self.store.save(b'image', '.jpg')
+        self.store.save(b'image', '.jpg')
+        path = self.store.path(blob)
+        with mock.patch.dict(storage._stores, {'uploads': self.store}):
+            first = VerificationRecord.objects.create(known_image_path=path, new_image_path=path, is_verified=True)
+            with self.captureOnCommitCallbacks(execute=True):
+                first.delete()
+        self.assertFalse(os.path.exists(path))
+
+
+    # SQLite in tests cannot run concurrent writers, so the races are replayed
+    # by running the competing call at the point where it would interleave
+
+    def save_racing_release(self, on_check):
+        """Save stored content again, running release() at the on_check-th file existence check"""
+        blob, _ = self.store.save(b'image', '.jpg')
+        exists = os.path.exists
+        checks, released = [], []
+
+        def check_then_release(path):
+            checks.append(path)
+            found = exists(path)
+            if len(checks) == on_check:
+                released.append(self.store.release(blob.sha256))
+            return found
+
+        with mock.patch('verification.storage.os.path.exists', side_effect=check_then_release):
+            saved, created = self.store.save(b'image', '.jpg')
+        return blob, saved, created, released
+
+    def test_release_racing_a_save_cannot_remove_the_file(self):
+        # Second check: save() already holds its reference under the row lock
+        blob, saved, created, released = self.save_racing_release(on_check=2)
+        self.assertEqual(released, [False])
+        self.assertFalse(created)
+        self.assertEqual(StoredBlob.objects.get(pk=blob.pk).ref_count, 1)
+        self.assertTrue(os.path.exists(self.store.path(saved)))
+
+    def test_save_writes_the_content_when_it_is_released_before_the_lock(self):
+        # First check: the file was there, so no temporary copy was written
+        _, saved, created, released = self.save_racing_release(on_check=1)
+        self.assertEqual(released, [True])
+        self.assertTrue(created)
+        self.assertEqual(StoredBlob.objects.get(pk=saved.pk).ref_count, 1)
+        with open(self.store.path(saved), 'rb') as f:
+            self.assertEqual(f.read(), b'image')
+        self.assertEqual(os.listdir(self.store.tmp_dir), [])
+
+    def test_content_is_written_before_the_row_lock_is_taken(self):
+        outside = len(transaction.get_connection().atomic_blocks)
+        fsync = os.fsync
+        depths = []
+
+        def recording_fsync(fd):
+            depths.append(len(transaction.get_connection().atomic_blocks))
+            return fsync(fd)
+
+        with mock.patch('verification.storage.os.fsync', side_effect=recording_fsync):
+            self.store.save(b'image', '.jpg')
+            self.store.save_chunks([b'other ', b'image'], '.jpg')
+            # Already stored: nothing to write
+            self.store.save(b'image', '.jpg')
+        self.assertEqual(depths, [outside, outside])
+
+    def test_save_racing_a_first_save_of_the_same_content_adds_a_reference(self):
+        self.store.save(b'image', '.jpg')
+        queryset = StoredBlob.objects.select_for_update().filter(sha256__in=[])
+        with mock.patch.object(StoredBlob.objects, 'select_for_update', side_effect=[queryset, StoredBlob.objects]):
+            blob, created = self.store.save(b'image', '.jpg')
+        self.assertFalse(created)
+        self.assertEqual(StoredBlob.objects.get(pk=blob.pk).ref_count, 2)
+
+
+class RetentionTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        roots = {name: os.path.join(directory.name, name) for name in ('captures', 'uploads')}
+        for root in roots.values():
+            os.makedirs(root)
+        settings_override = override_settings(BLOB_STORAGE={'stores': roots, 'shard_depth': 2})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        stores = mock.patch.dict(storage._stores, clear=True)
+        stores.start()
+        self.addCleanup(stores.stop)
+        self.captures = storage.get_blob_store('captures')
+        self.now = timezone.now()
+
+    def days_ago(self, days):
+        return self.now - timedelta(days=days)
+
+    def record(self, days, embedding=None):
+        return VerificationRecord.objects.create(known_image_path='a', new_image_path='b', is_verified=True,
+                                                 verification_date=self.days_ago(days), embedding=embedding)
+
+    def age_file(self, path, days):
+        stamp = time.time() - days * 86400
+        os.utime(path, (stamp, stamp))
+
+    def legacy_file(self, name):
+        # Written straight into the folder before the blob store existed
+        path = os.path.join(self.captures.root, name)
+        with open(path, 'wb') as f:
+            f.write(b'legacy')
+        self.age_file(path, 400)
+        return path
+
+    def purge(self, *args):
+        output = io.StringIO()
+        call_command('purge_verification_data', *args, stdout=output)
+        return output.getvalue()
+
+    def test_records_beyond_the_age_or_count_limit_are_deleted(self):
+        old, recent, newest = self.record(40), self.record(5), self.record(1)
+        self.assertEqual(Purger(max_age_days=30).purge_records(), 1)
+        self.assertEqual(Purger(max_records=1).purge_records(), 1)
+        self.assertEqual(list(VerificationRecord.objects.values_list('id', flat=True)), [newest.id])
+
+    def test_max_embeddings_keeps_the_newest_unreferenced_embeddings(self):
+        unreferenced = [FaceEmbedding.objects.create(created_at=self.days_ago(days)) for days in (3, 2)]
+        referenced = FaceEmbedding.objects.create(created_at=self.days_ago(1))
+        self.record(1, embedding=referenced)
+        # The referenced embedding is the newest overall but does not count against the limit
+        self.assertEqual(Purger(max_embeddings=1).purge_embeddings(), 1)
+        self.assertEqual(set(FaceEmbedding.objects.values_list('id', flat=True)), {unreferenced[1].id, referenced.id})
+
+    def test_dry_run_reports_the_counts_without_deleting(self):
+        self.record(40)
+        self.record(35)
+        FaceEmbedding.objects.create(created_at=self.days_ago(40))
+        blob, _ = self.captures.save(b'old capture', '.jpg')
+        StoredBlob.objects.filter(pk=blob.pk).update(last_referenced_at=self.days_ago(40))
+
+        dry_run = Purger(max_age_days=30, dry_run=True)
+        counts = (dry_run.purge_records(), dry_run.purge_embeddings(), dry_run.purge_blobs('captures')[0])
+        self.assertEqual(counts, (2, 1, 1))
+        self.assertEqual(VerificationRecord.objects.count(), 2)
+        self.assertTrue(os.path.exists(self.captures.path(blob)))
+
+        purger = Purger(max_age_days=30)
+        self.assertEqual((purger.purge_records(), purger.purge_embeddings(), purger.purge_blobs('captures')[0]), counts)
+        self.assertFalse(os.path.exists(self.captures.path(blob)))
+
+    def test_blob_saved_again_recently_is_not_expired(self):
+        blob, _ = self.captures.save(b'capture', '.jpg')
+        StoredBlob.objects.filter(pk=blob.pk).update(created_at=self.days_ago(40), last_referenced_at=self.days_ago(40))
+        self.captures.save(b'capture', '.jpg')
+        self.assertEqual(Purger(max_age_days=30).purge_blobs('captures'), (0, 0))
+        self.assertTrue(os.path.exists(self.captures.path(blob)))
+
+    def test_orphan_sweep_respects_the_grace_period(self):
+        old, _ = self.captures.save(b'old orphan', '.jpg')
+        young, _ = self.captures.save(b'young orphan', '.jpg')
+        StoredBlob.objects.all().delete()
+        self.age_file(self.captures.path(old), 2)
+
+        self.assertEqual(Purger(orphan_grace_seconds=3600).purge_orphans('captures')[0], 1)
+        self.assertFalse(os.path.exists(self.captures.path(old)))
+        self.assertTrue(os.path.exists(self.captures.path(young)))
+
+    def test_default_run_leaves_legacy_files_alone(self):
+        legacy = self.legacy_file('capture_20240101_120000.jpg')
+        orphan, _ = self.captures.save(b'orphan', '.jpg')
+        StoredBlob.objects.all().delete()
+        self.age_file(self.captures.path(orphan), 2)
+
+        output = self.purge('--max-age-days', '30')
+        self.assertNotIn('orphaned', output)
+        self.assertTrue(os.path.exists(legacy))
+        self.assertTrue(os.path.exists(self.captures.path(orphan)))
+
+    def test_orphan_sweep_never_touches_legacy_files(self):
+        legacy = self.legacy_file('capture_20240101_120000.jpg')
+        # Even one named like a digest, but not sharded the way the store lays blobs out
+        legacy_digest = self.legacy_file('ab' * 32 + '.jpg')
+        orphan, _ = self.captures.save(b'orphan', '.jpg')
+        StoredBlob.objects.all().delete()
+        self.age_file(self.captures.path(orphan), 2)
+
+        self.assertIn("Deleted 1 orphaned captures files", self.purge('--orphans'))
+        self.assertTrue(os.path.exists(legacy))
+        self.assertTrue(os.path.exists(legacy_digest))
+        self.assertFalse(os.path.exists(self.captures.path(orphan)))
+
+    def test_legacy_sweep_deletes_old_unreferenced_legacy_files(self):
+        old = self.legacy_file('capture_20240101_120000.jpg')
+        recent = self.legacy_file('capture_20250101_120000.jpg')
+        self.age_file(recent, 10)
+        referenced = self.legacy_file('known_face.jpg')
+        VerificationRecord.objects.create(known_image_path=referenced, new_image_path='b', is_verified=True)
+        os.makedirs(os.path.join(self.captures.root, 'nested'))
+        nested = self.legacy_file(os.path.join('nested', 'capture.jpg'))
+        blob, _ = self.captures.save(b'current', '.jpg')
+        self.age_file(self.captures.path(blob), 400)
+
+        self.assertIn("Would delete 2 legacy captures files", self.purge('--legacy-max-age-days', '30', '--dry-run'))
+        self.assertTrue(os.path.exists(old))
+        self.assertIn("Deleted 2 legacy captures files", self.purge('--legacy-max-age-days', '30'))
+        self.assertEqual([os.path.exists(path) for path in (old, nested, recent, referenced, self.captures.path(blob))],
+                         [False, False, True, True, True])
+
+
+class AuditJournalTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        # Buffers made here must not flush at interpreter exit, after the test database is gone
+        register = mock.patch('verification.audit_buffer.atexit.register')
+        register.start()
+        self.addCleanup(register.stop)
+
+    def attempt(self, path='known'):
+        return None, VerificationRecord(known_image_path=path, new_image_path='new', is_verified=True,
+                                        verification_date=timezone.now())
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.startswith('audit-') and name.endswith('.jsonl'))
+
+    def test_segments_of_a_crashed_process_are_replayed(self):
+        # A process that died holding rows: its lock file is no longer locked
+        with open(os.path.join(self.directory, 'audit-999999.0.jsonl'), 'w') as f:
+            f.write(serialize_attempt(*self.attempt('crashed')))
+            f.write('{"embedding": null, "rec')  # torn final line
+        open(os.path.join(self.directory, 'audit-999999.lock'), 'w').close()
+
+        journal = AuditJournal(self.directory)
+        self.assertEqual(journal.recover(), 1)
+        self.assertTrue(VerificationRecord.objects.filter(known_image_path='crashed').exists())
+        self.assertEqual(self.segments(), [])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'audit-999999.lock')))
+
+    def test_failed_flush_keeps_the_rows_in_a_new_segment(self):
+        buffer = AuditBuffer(max_rows=1000, flush_interval=3600, journal=AuditJournal(self.directory))
+        buffer.add(*self.attempt('kept'))
+        first_segment = self.segments()
+
+        with mock.patch.object(audit_buffer, 'write_attempts', side_effect=RuntimeError("database is down")):
+            with self.assertRaises(RuntimeError):
+                buffer.flush()
+
+        self.assertEqual(buffer.stats()['pending'], 1)
+        segments = self.segments()
+        self.assertEqual(len(segments), 1)
+        self.assertNotEqual(segments, first_segment)
+        with open(os.path.join(self.directory, segments[0])) as f:
+            self.assertIn('"kept"', f.read())
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertTrue(VerificationRecord.objects.filter(known_image_path='kept').exists())
+        self.assertEqual(self.segments(), [])
+
+    def dead_letters(self):
+        with open(os.path.join(self.directory, 'dead-letter.jsonl')) as f:
+            return [json.loads(line) for line in f]
+
+    def test_rejected_rows_are_dead_lettered_and_the_rest_written(self):
+        buffer = AuditBuffer(max_rows=1000, flush_interval=3600, journal=AuditJournal(self.directory))
+        for path in ('a', 'b', None, 'c', 'd'):  # known_image_path is NOT NULL
+            buffer.add(*self.attempt(path))
+        with mock.patch('builtins.print'):
+            self.assertEqual(buffer.flush(), 4)
+        self.assertEqual(sorted(VerificationRecord.objects.values_list('known_image_path', flat=True)),
+                         ['a', 'b', 'c', 'd'])
+        [dead] = self.dead_letters()
+        self.assertIsNone(dead['record']['known_image_path'])
+        self.assertTrue(dead['error'].startswith('IntegrityError'))
+        self.assertEqual((buffer.stats()['pending'], buffer.stats()['rejected']), (0, 1))
+        self.assertEqual(self.segments(), [])
+
+        buffer.add(*self.attempt('e'))
+        self.assertEqual(buffer.flush(), 1)
+
+    def test_rows_are_retried_without_the_keys_of_a_rolled_back_insert(self):
+        buffer = AuditBuffer(max_rows=1000, flush_interval=3600)
+        embedding = FaceEmbedding.from_face({'embedding': [1.0, 0.0]}, 'test-model')
+        buffer.add(embedding, self.attempt('retried')[1])
+        with mock.patch.object(VerificationRecord.objects, 'bulk_create', side_effect=OperationalError("locked")):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        self.assertIsNone(embedding.pk)
+        self.assertTrue(embedding._state.adding)
+
+        # Another writer takes the id the rolled-back insert had used
+        FaceEmbedding.objects.create()
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(FaceEmbedding.objects.count(), 2)
+        record = VerificationRecord.objects.get(known_image_path='retried')
+        self.assertEqual(record.embedding.get_vector().tolist(), [1.0, 0.0])
+
+    def test_rejected_rows_in_a_replayed_segment_are_dead_lettered(self):
+        with open(os.path.join(self.directory, 'audit-999999.0.jsonl'), 'w') as f:
+            f.write(serialize_attempt(*self.attempt('replayed')))
+            f.write(serialize_attempt(*self.attempt(None)))
+        open(os.path.join(self.directory, 'audit-999999.lock'), 'w').close()
+
+        with mock.patch('builtins.print'):
+            self.assertEqual(AuditJournal(self.directory).recover(), 1)
+        self.assertTrue(VerificationRecord.objects.filter(known_image_path='replayed').exists())
+        self.assertEqual(len(self.dead_letters()), 1)
+        self.assertEqual(self.segments(), [])
+
+    def test_job_worker_flushes_the_buffer_when_it_stops(self):
+        buffer = mock.Mock()
+        stop_event = threading.Event()
+        stop_event.set()
+        with mock.patch.object(jobs, 'get_loaded_audit_buffer', return_value=buffer):
+            jobs.run_worker(stop_event, poll_interval=0.01)
+        buffer.flush.assert_called_once_with()
+
+
+class MetricsAggregationTests(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.requests = self.registry.register(metrics.Counter('requests_total', "Requests", ['view']))
+        self.latency = self.registry.register(metrics.Histogram('latency_seconds', "Latency", buckets=(0.1, 1.0)))
+        self.registry.add_collector(lambda: [('cache_hits_total', 'counter', "Hits", [({'tier': 'disk'}, 2)])])
+
+    def worker_snapshot(self, views, latencies):
+        for view in views:
+            self.requests.inc(view=view)
+        for latency in latencies:
+            self.latency.observe(latency)
+        snapshot = json.loads(json.dumps(self.registry.snapshot()))
+        self.registry.reset()
+        return snapshot
+
+    def test_snapshots_of_all_workers_are_summed(self):
+        snapshots = [
+            self.worker_snapshot(['verify', 'verify'], [0.05]),
+            self.worker_snapshot(['verify', 'identify'], [0.5, 2.0]),
+        ]
+        text = self.registry.render(snapshots)
+        self.assertIn('requests_total{view="verify"} 3', text)
+        self.assertIn('requests_total{view="identify"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_sum 2.55', text)
+        self.assertIn('cache_hits_total{tier="disk"} 4', text)
+
+    def test_scrape_reads_every_process_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, '1-aaaaaaaa.json'), 'w') as f:
+                json.dump(metrics.registry.snapshot(), f)
+            with override_settings(METRICS={**settings.METRICS, 'multiprocess_dir': directory}), \
+                    mock.patch.dict(metrics._export_state, started=True, path=os.path.join(directory, '2-bbbbbbbb.json')):
+                metrics.NO_FACE.inc()
+                text = metrics.render_all()
+                files = sorted(os.listdir(directory))
+        self.assertEqual(files, ['1-aaaaaaaa.json', '2-bbbbbbbb.json'])
+        own = metrics.registry.snapshot()['metrics'][metrics.NO_FACE.name][0][1]
+        self.assertIn(f"{metrics.NO_FACE.name} {own * 2 - 1}", text)
+
+    def test_forwarded_scrapes_are_refused(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', HTTP_X_FORWARDED_FOR='203.0.113.9').status_code, 403)
@@ -1,6 +1,7 @@
 from django.urls import path
 from . import views
 from . import api_views
+from . import async_views
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -8,10 +9,24 @@ urlpatterns = [
     path('verify/', views.verify_faces, name='verify_faces'),
     path('upload/', views.upload_file, name='upload_file'),
     path('embeddings/', views.get_embeddings, name='get_embeddings'),
+    path('embeddings/<int:embedding_id>/', views.get_embeddings, name='get_embedding'),
+    path('metrics', views.metrics, name='metrics'),
     
     path('api/capture/', api_views.capture_image_api, name='capture_image_api'),
     path('api/verify/', api_views.verify_faces_api, name='verify_faces_api'),
+    path('api/jobs/<uuid:job_id>/', api_views.verification_job_api, name='verification_job_api'),
+    path('api/verify/batch/', api_views.verify_batch_api, name='verify_batch_api'),
+    path('api/identify/', api_views.identify_face_api, name='identify_face_api'),
     path('api/upload/', api_views.upload_file_api, name='upload_file_api'),
     path('api/embeddings/', api_views.get_embeddings_api, name='get_embeddings_api'),
+    path('api/embeddings/<int:embedding_id>/', api_views.get_embeddings_api, name='get_embedding_api'),
     path('api/records/', api_views.get_verification_records_api, name='get_verification_records_api'),
+    path('api/stats/', api_views.get_stats_api, name='get_stats_api'),
+    path('api/health/ready/', api_views.readiness_api, name='readiness_api'),
+    
+    # Async variants for ASGI deployments
+    path('api/async/capture/', async_views.capture_image_async, name='capture_image_async'),
+    path('api/async/verify/', async_views.verify_faces_async, name='verify_faces_async'),
+    path('api/async/upload/', async_views.upload_file_async, name='upload_file_async'),
+    path('api/async/records/', async_views.get_verification_records_async, name='get_verification_records_async'),
 ] 
\ No newline at end of file
@@ -1,42 +1,443 @@
-try:
-    from deepface import DeepFace
-    DEEPFACE_AVAILABLE = True
-except ImportError:
-    print("Warning: deepface library not installed. Face verification will be disabled.")
-    DEEPFACE_AVAILABLE = False
+import importlib.util
+import threading
+from django.conf import settings
+import numpy as np
 import json
+from .embedding_cache import EmbeddingCache, get_embedding_cache
+from .imaging import ImageDecodeError, decode_image, downscale_for_detection, scale_facial_area, crop_aligned_face
+from .scheduler import get_inference_scheduler
+from .inference_pool import get_inference_client
+from .metrics import ERRORS, NO_FACE, RESULTS, STAGE_SECONDS
 
-def verify_owner(known_img_path, new_img_path):
-    """Verify if two faces belong to the same person"""
+# deepface imports TensorFlow, which takes seconds and hundreds of MB, so it
+# is only imported on first inference; this just checks it is installed
+DEEPFACE_AVAILABLE = importlib.util.find_spec('deepface') is not None
+if not DEEPFACE_AVAILABLE:
+    print("Warning: deepface library not installed. Face verification will be disabled.")
+
+_DEEPFACE_NAMES = ('DeepFace', 'preprocessing', 'FacialRecognition')
+_deepface_lock = threading.Lock()
+
+
+def load_deepface():
+    """Import deepface (and TensorFlow with it) into this module on first use"""
+    if all(name in globals() for name in _DEEPFACE_NAMES):
+        return
+    with _deepface_lock:
+        if all(name in globals() for name in _DEEPFACE_NAMES):
+            return
+        try:
+            from deepface import DeepFace
+            from deepface.modules import preprocessing
+            from deepface.models.FacialRecognition import FacialRecognition
+        except ImportError as e:
+            raise RuntimeError(f"DeepFace not available - face recognition disabled: {e}") from e
+        # setdefault keeps any name already replaced, e.g. by a test double
+        for name, value in zip(_DEEPFACE_NAMES, (DeepFace, preprocessing, FacialRecognition)):
+            globals().setdefault(name, value)
+
+
+def __getattr__(name):
+    # utils.DeepFace and friends still work from other modules, importing on first access
+    if name in _DEEPFACE_NAMES:
+        try:
+            load_deepface()
+        except RuntimeError as e:
+            raise AttributeError(str(e)) from e
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Pre-tuned distance thresholds, same values DeepFace.verify uses
+DISTANCE_THRESHOLDS = {
+    'VGG-Face': {'cosine': 0.68, 'euclidean': 1.17, 'euclidean_l2': 1.17},
+    'Facenet': {'cosine': 0.40, 'euclidean': 10, 'euclidean_l2': 0.80},
+    'Facenet512': {'cosine': 0.30, 'euclidean': 23.56, 'euclidean_l2': 1.04},
+    'ArcFace': {'cosine': 0.68, 'euclidean': 4.15, 'euclidean_l2': 1.13},
+    'SFace': {'cosine': 0.593, 'euclidean': 10.734, 'euclidean_l2': 1.055},
+}
+
+
+def get_model_name():
+    """Return the face recognition model configured for verification"""
+    return settings.FACE_VERIFICATION.get('model_name', 'Facenet')
+
+
+def get_detector_backend():
+    """Return the face detector backend configured for verification"""
+    return settings.FACE_VERIFICATION.get('detector_backend', 'retinaface')
+
+
+def get_detection_max_side():
+    """Return the longest image side face detection runs at, or None for full resolution"""
+    return settings.FACE_VERIFICATION.get('detection_max_side')
+
+
+def get_detector_cascade():
+    """Return the detector stages to try in order
+
+    Each stage is a dict with a 'backend' and optional 'min_confidence' and
+    'require_landmarks' acceptance thresholds. Without a detector_cascade
+    setting this is the single detector_backend stage.
+    """
+    cascade = settings.FACE_VERIFICATION.get('detector_cascade')
+    return cascade or [{'backend': get_detector_backend()}]
+
+
+def get_detection_signature():
+    """Return a string identifying every setting that changes detection output"""
+    stages = []
+    for stage in get_detector_cascade():
+        thresholds = f"{stage.get('min_confidence', 0)},{int(bool(stage.get('require_landmarks')))}"
+        stages.append(f"{stage['backend']}({thresholds})")
+    signature = '>'.join(stages)
+    max_side = get_detection_max_side()
+    return f"{signature}@{max_side}" if max_side else signature
+
+
+def get_distance_metric():
+    """Return the distance metric used to compare embeddings"""
+    return settings.FACE_VERIFICATION.get('distance_metric', 'cosine')
+
+
+def find_threshold(model_name, distance_metric):
+    """Return the distance below which two faces are the same person"""
+    base_threshold = {'cosine': 0.40, 'euclidean': 0.55, 'euclidean_l2': 0.75}
+    return DISTANCE_THRESHOLDS.get(model_name, base_threshold).get(distance_metric, 0.4)
+
+
+def find_distance(embedding_a, embedding_b, distance_metric):
+    """Return the distance between two embeddings"""
+    a = np.asarray(embedding_a, dtype=np.float64)
+    b = np.asarray(embedding_b, dtype=np.float64)
+    if distance_metric == 'cosine':
+        return float(1 - np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+    if distance_metric == 'euclidean':
+        return float(np.linalg.norm(a - b))
+    if distance_metric == 'euclidean_l2':
+        return float(np.linalg.norm(a / np.linalg.norm(a) - b / np.linalg.norm(b)))
+    raise ValueError(f"Unsupported distance metric: {distance_metric}")
+
+
+def _to_builtin(value):
+    """JSON fallback for NumPy scalars and arrays"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def read_image_bytes(img):
+    """Return the bytes that identify an image for the embedding cache"""
+    if isinstance(img, (bytes, bytearray, memoryview)):
+        return img
+    if isinstance(img, np.ndarray):
+        return img.tobytes() + str(img.shape).encode()
+    with open(img, 'rb') as f:
+        return f.read()
+
+
+def detect_faces(img, enforce_detection=False, max_side=None):
+    """Detect and align the faces in a BGR image with the configured detector cascade
+
+    Stages run in order and the first one whose faces all meet its
+    thresholds wins; the last stage is always accepted. Each face reports
+    the backend that found it in 'detector_backend'.
+    """
+    stages = get_detector_cascade()
+    for i, stage in enumerate(stages):
+        last = i == len(stages) - 1
+        # Earlier stages never raise for a missing face; the next stage gets a try
+        faces = _detect_with_backend(
+            img, stage['backend'], enforce_detection=enforce_detection and last, max_side=max_side
+        )
+        if last or _accept_detections(faces, stage):
+            for face in faces:
+                face['detector_backend'] = stage['backend']
+            return faces
+
+
+def _accept_detections(faces, stage):
+    """Return True when every face found by a cascade stage meets its thresholds"""
+    min_confidence = stage.get('min_confidence', 0)
+    require_landmarks = stage.get('require_landmarks', False)
+    if not faces:
+        return False
+    for face in faces:
+        # A confidence of 0 is extract_faces' whole-image stand-in for "no face"
+        if not face['confidence'] or face['confidence'] < min_confidence:
+            return False
+        if require_landmarks and not _plausible_landmarks(face['facial_area']):
+            return False
+    return True
+
+
+def _plausible_landmarks(facial_area):
+    """Return True when both eyes were found where eyes can be in the face box"""
+    left_eye, right_eye = facial_area.get('left_eye'), facial_area.get('right_eye')
+    if left_eye is None or right_eye is None:
+        return False
+    eye_distance = np.hypot(left_eye[0] - right_eye[0], left_eye[1] - right_eye[1])
+    return (
+        0.2 * facial_area['w'] <= eye_distance <= 0.8 * facial_area['w']
+        and max(left_eye[1], right_eye[1]) <= facial_area['y'] + 0.65 * facial_area['h']
+    )
+
+
+def _detect_with_backend(img, detector_backend, enforce_detection=False, max_side=None):
+    """Detect and align the faces in a BGR image with one detector backend
+
+    Images whose longest side exceeds max_side (the detection_max_side
+    setting by default, 0 for full resolution) are downscaled for detection
+    only; the boxes and eye landmarks are mapped back and each face is
+    aligned and cropped from the full-resolution image.
+    """
+    load_deepface()
+    if max_side is None:
+        max_side = get_detection_max_side()
+    small, scale = downscale_for_detection(img, max_side)
+    if scale == 1.0:
+        return DeepFace.extract_faces(
+            img_path=img,
+            detector_backend=detector_backend,
+            enforce_detection=enforce_detection,
+            align=True
+        )
+
+    detections = DeepFace.extract_faces(
+        img_path=small,
+        detector_backend=detector_backend,
+        enforce_detection=enforce_detection,
+        align=False
+    )
+    faces = []
+    for detection in detections:
+        facial_area = scale_facial_area(detection['facial_area'], scale, img.shape)
+        face = crop_aligned_face(img, facial_area)
+        if face.shape[0] == 0 or face.shape[1] == 0:
+            continue
+        faces.append({
+            'face': face[:, :, ::-1] / 255,  # bgr to rgb in [0, 1], as extract_faces returns
+            'facial_area': facial_area,
+            'confidence': detection['confidence'],
+        })
+    return faces
+
+
+def embed_faces(face_images):
+    """Embed aligned RGB face crops, running the model on whole batches at once"""
+    if not face_images:
+        return []
+    load_deepface()
+    model = DeepFace.build_model(model_name=get_model_name(), task='facial_recognition')
+    target_size = model.input_shape
+
+    # Same preprocessing as DeepFace.represent, one (1, h, w, 3) tensor per face
+    inputs = []
+    for face_image in face_images:
+        img = preprocessing.resize_image(
+            img=face_image[:, :, ::-1],  # rgb to bgr
+            target_size=(target_size[1], target_size[0])
+        )
+        inputs.append(preprocessing.normalize_input(img=img, normalization='base'))
+
+    if type(model).forward is not FacialRecognition.forward:
+        # Models with a custom forward (SFace, Dlib, VGG-Face) only take one face
+        return [np.asarray(model.forward(img), dtype=np.float32) for img in inputs]
+
+    batch_size = settings.FACE_VERIFICATION.get('embedding_batch_size', 32)
+    embeddings = []
+    for start in range(0, len(inputs), batch_size):
+        batch = np.concatenate(inputs[start:start + batch_size])
+        embeddings.extend(model.model(batch, training=False).numpy())
+    return embeddings
+
+
+def schedule_embeddings(face_images):
+    """Embed face crops, sharing a batch with concurrent requests when micro-batching is on"""
+    scheduler = get_inference_scheduler()
+    if scheduler is None:
+        return embed_faces(face_images)
+    return scheduler.embed(face_images)
+
+
+def represent_images(images, enforce_detection=False):
+    """Detect and embed every face in several images
+
+    Runs in the inference pool when one is configured, otherwise in this
+    process. See represent_images_in_process for the arguments and result.
+    """
+    client = get_inference_client()
+    if client is not None:
+        return client.call('represent_images', images, enforce_detection)
+    return represent_images_in_process(images, enforce_detection=enforce_detection)
+
+
+def represent_images_in_process(images, enforce_detection=False):
+    """Detect and embed every face in several images, batching the embedding pass
+
+    Each image may be a file path, encoded image bytes or a BGR NumPy array;
+    bytes are decoded in memory without touching the filesystem. Identical
+    images are only processed once and cached representations are reused.
+    Returns one entry per image: the DeepFace.represent style list of faces,
+    or the exception raised while processing that image.
+    """
+    if not DEEPFACE_AVAILABLE:
+        raise RuntimeError("DeepFace not available - face recognition disabled")
+
+    model_name = get_model_name()
+    detection_signature = get_detection_signature()
+    cache = get_embedding_cache()
+
+    results = {}
+    pending = {}
+    keys = []
+    for img in images:
+        try:
+            image_bytes = read_image_bytes(img)
+        except OSError as e:
+            keys.append(e)
+            continue
+        key = EmbeddingCache.make_key(image_bytes, model_name, detection_signature, align=True)
+        keys.append(key)
+        if key in results or key in pending:
+            continue
+        faces = cache.get(key) if cache is not None else None
+        if faces is None:
+            pending[key] = img if isinstance(img, np.ndarray) else image_bytes
+        elif enforce_detection and all(not face['face_confidence'] for face in faces):
+            # A cached no-face fallback only covers the enforce_detection=False case
+            results[key] = ValueError("Face could not be detected in the image")
+        else:
+            results[key] = faces
+
+    # Detection runs per image; the faces from every image are then embedded together
+    detected = []
+    for key, img in pending.items():
+        try:
+            if not isinstance(img, np.ndarray):
+                with STAGE_SECONDS.time(stage='decode'):
+                    img = decode_image(img)
+            with STAGE_SECONDS.time(stage='detect'):
+                faces = detect_faces(img, enforce_detection=enforce_detection)
+            for face in faces:
+                detected.append((key, face))
+            results[key] = []
+        except Exception as e:
+            results[key] = e
+
+    embeddings = []
+    if detected:
+        with STAGE_SECONDS.time(stage='embed'):
+            embeddings = schedule_embeddings([face['face'] for _, face in detected])
+    for (key, face), embedding in zip(detected, embeddings):
+        results[key].append({
+            'embedding': embedding,
+            'facial_area': face['facial_area'],
+            'face_confidence': face['confidence'],
+            'detector_backend': face.get('detector_backend'),
+        })
+
+    for key in pending:
+        if isinstance(results[key], Exception):
+            continue
+        # Detectors may return NumPy scalars; keep the result JSON-safe for the
+        # disk cache and the FaceEmbedding row
+        results[key] = json.loads(json.dumps(results[key], default=_to_builtin))
+        if cache is not None:
+            cache.set(key, results[key])
+
+    return [key if isinstance(key, Exception) else results[key] for key in keys]
+
+
+def represent_faces(img, enforce_detection=False):
+    """Detect and embed every face in an image in a single pass"""
+    faces = represent_images([img], enforce_detection=enforce_detection)[0]
+    if isinstance(faces, Exception):
+        raise faces
+    return faces
+
+
+def match_faces(known_faces, new_faces):
+    """Compare two lists of represented faces; the closest pair decides"""
+    for faces in (known_faces, new_faces):
+        # Without enforce_detection a faceless image comes back as one face with confidence 0
+        if not any(face['face_confidence'] for face in faces):
+            NO_FACE.inc()
+    if not known_faces or not new_faces:
+        raise ValueError("No face could be extracted from one of the images")
+
+    model_name = get_model_name()
+    distance_metric = get_distance_metric()
+    threshold = find_threshold(model_name, distance_metric)
+
+    # Same rule as DeepFace.verify: the closest pair of faces decides
+    distance, known_face, new_face = min(
+        (
+            (find_distance(known['embedding'], new['embedding'], distance_metric), known, new)
+            for known in known_faces
+            for new in new_faces
+        ),
+        key=lambda candidate: candidate[0]
+    )
+
+    RESULTS.inc(result='verified' if distance <= threshold else 'rejected')
+    return {
+        'verified': distance <= threshold,
+        'distance': distance,
+        'threshold': threshold,
+        'model': model_name,
+        'detector_backend': new_face.get('detector_backend', get_detector_backend()),
+        'known_detector_backend': known_face.get('detector_backend', get_detector_backend()),
+        'distance_metric': distance_metric,
+        'known_face': known_face,
+        'new_face': new_face,
+    }
+
+
+def compare_faces(known_img, new_img):
+    """Detect and embed each image once and compare the closest pair of faces
+
+    Returns None when verification fails, except that ImageDecodeError for
+    undecodable image data is raised.
+    """
     if not DEEPFACE_AVAILABLE:
         print("DeepFace not available - face verification disabled")
-        return False
-    
+        return None
+
     try:
-        result = DeepFace.verify(
-            img1_path=known_img_path,
-            img2_path=new_img_path,
-            model_name="Facenet",  # Most accurate model
-            detector_backend="retinaface",  # Best face detector
-            enforce_detection=False  # Skip if no face found (for testing)
-        )
-        return result["verified"]  # Returns True/False
+        known_faces, new_faces = represent_images([known_img, new_img])
+        for faces in (known_faces, new_faces):
+            if isinstance(faces, Exception):
+                raise faces
+        return match_faces(known_faces, new_faces)
+    except ImageDecodeError:
+        # Undecodable input is the client's error; the views answer it with a 400
+        raise
     except Exception as e:
+        ERRORS.inc(exception=type(e).__name__)
         print(f"Error: {e}")
-        return False
+        return None
+
+
+def largest_face(faces):
+    """Return the face with the largest detected area"""
+    return max(faces, key=lambda face: face['facial_area']['w'] * face['facial_area']['h'])
+
+
+def verify_owner(known_img_path, new_img_path):
+    """Verify if two faces belong to the same person"""
+    result = compare_faces(known_img_path, new_img_path)
+    return result is not None and result["verified"]  # Returns True/False
+
 
 def get_face_embedding(img_path):
     """Generate face embedding for the given image"""
     if not DEEPFACE_AVAILABLE:
         print("DeepFace not available - face embedding disabled")
         return None
-    
+
     try:
-        embedding = DeepFace.represent(
-            img_path=img_path,
-            model_name="Facenet"
-        )
-        return embedding
+        return represent_faces(img_path, enforce_detection=True)
     except Exception as e:
         print(f"Error generating embedding: {e}")
-        return None 
\ No newline at end of file
+        return None
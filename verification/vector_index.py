@@ -0,0 +1,607 @@
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import FaceEmbedding
+from .quantization import ENCODINGS, bytes_per_vector, check_encoding, decode_vector, dequantize, quantize
+from .utils import get_model_name
+
+
+class EmbeddingIndex:
+    """Process-resident matrix of L2-normalized FaceEmbedding vectors for 1:N search
+
+    Keeping it current costs one indexed range query for rows with an id
+    greater than the last one seen, plus a look at the ids created in the
+    last overlap_seconds, which picks up rows with lower ids that another
+    transaction committed late. Every reconcile_interval seconds the row
+    count is compared with the database; when it differs (rows purged by
+    another process, or committed later than the overlap), the ids are
+    reconciled in full. Deletes in this process are applied at once
+    through remove(). Searches are exact; subclasses narrow the candidate
+    rows by overriding _candidate_positions() and the candidates are then
+    scored exactly.
+
+    With quantization='float16' or 'int8' the matrix is held in that
+    encoding (int8 with a float32 scale per row), cutting its memory to a
+    half or about a quarter, at the cost of slower scans (rows are decoded
+    chunk by chunk). Scores from the matrix are then approximate, so the
+    best k * rerank_factor rows are re-scored against their stored
+    FaceEmbedding vectors, which are exact for rows stored as float32.
+    """
+
+    # Rows decoded at a time when scoring a quantized matrix; small enough to stay in cache
+    SCORE_CHUNK_ROWS = 8192
+
+    def __init__(self, model_name, dimension=None, initial_capacity=1024, quantization=None, rerank_factor=4,
+                 overlap_seconds=60.0, reconcile_interval=60.0):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.quantization = check_encoding(quantization) if quantization not in (None, 'float32') else None
+        self.rerank_factor = rerank_factor
+        self.overlap_seconds = overlap_seconds
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.RLock()
+        self._capacity = initial_capacity
+        self._vectors = None
+        self._scales = np.empty(initial_capacity, dtype=np.float32) if self.quantization == 'int8' else None
+        self._ids = np.empty(initial_capacity, dtype=np.int64)
+        self._size = 0
+        self._inserted_ids = set()
+        self.last_synced_id = 0
+        self.last_synced_at = None
+        self.last_reconciled_at = None
+        # Newest created_at seen by sync(); the overlap window is measured back from it
+        self._synced_created_at = None
+        # Ids of rows the index cannot hold (another embedding size)
+        self._skipped = set()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, ids, vectors):
+        """Append rows to the index, normalizing the vectors"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        if len(vectors) == 0:
+            return
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        vectors = vectors / norms
+
+        scales = None
+        if self.quantization is not None:
+            vectors, scales = quantize(vectors, self.quantization)
+
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+            if self._vectors is None:
+                self._vectors = np.empty((self._capacity, self.dimension), dtype=self._dtype())
+            self._reserve(self._size + len(vectors))
+            end = self._size + len(vectors)
+            self._vectors[self._size:end] = vectors
+            if scales is not None:
+                self._scales[self._size:end] = scales
+            self._ids[self._size:end] = ids
+            self._size = end
+
+    def _dtype(self):
+        return ENCODINGS[self.quantization] if self.quantization is not None else np.float32
+
+    def insert(self, embedding_id, vector):
+        """Add a single newly created row ahead of the next sync"""
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if embedding_id <= self.last_synced_id or embedding_id in self._inserted_ids:
+                return
+            if self.dimension is not None and vector.shape[0] != self.dimension:
+                return
+            self.add(np.array([embedding_id], dtype=np.int64), vector)
+            # Remember it so sync() does not load it a second time; the sync
+            # cursor itself is left alone, since rows with lower ids may still
+            # be committed by other workers
+            self._inserted_ids.add(embedding_id)
+
+    def remove(self, embedding_ids):
+        """Drop rows from the index; return how many were removed"""
+        with self._lock:
+            if self._size == 0:
+                return 0
+            keep = ~np.isin(self._ids[:self._size], np.asarray(list(embedding_ids), dtype=np.int64))
+            removed = int(self._size - keep.sum())
+            if removed == 0:
+                return 0
+            # Compact into new arrays: rows below _size are never rewritten in
+            # place, so snapshots taken by a background pass stay valid
+            size = self._size - removed
+            vectors = np.empty((self._capacity, self.dimension), dtype=self._dtype())
+            vectors[:size] = self._vectors[:self._size][keep]
+            ids = np.empty(self._capacity, dtype=np.int64)
+            ids[:size] = self._ids[:self._size][keep]
+            if self._scales is not None:
+                scales = np.empty(self._capacity, dtype=np.float32)
+                scales[:size] = self._scales[:self._size][keep]
+                self._scales = scales
+            self._vectors, self._ids = vectors, ids
+            self._compacted(keep)
+            self._size = size
+            return removed
+
+    def _compacted(self, keep):
+        """Called under the lock after remove() dropped the rows where keep is False"""
+
+    def _reserve(self, size):
+        if size <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < size:
+            capacity *= 2
+        vectors = np.empty((capacity, self.dimension), dtype=self._dtype())
+        vectors[:self._size] = self._vectors[:self._size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        if self._scales is not None:
+            scales = np.empty(capacity, dtype=np.float32)
+            scales[:self._size] = self._scales[:self._size]
+            self._scales = scales
+        self._vectors, self._ids, self._capacity = vectors, ids, capacity
+
+    def _rows(self):
+        return FaceEmbedding.objects.filter(model_name=self.model_name, vector__isnull=False)
+
+    def sync(self, batch_size=10000):
+        """Load FaceEmbedding rows created since the last sync; return how many were added"""
+        added = 0
+        with self._lock:
+            while True:
+                rows = list(
+                    self._rows().filter(id__gt=self.last_synced_id)
+                    .order_by('id')
+                    .values_list('id', 'vector', 'encoding', 'scale', 'created_at')[:batch_size]
+                )
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                newest = max(row[4] for row in rows)
+                if self._synced_created_at is None or newest > self._synced_created_at:
+                    self._synced_created_at = newest
+                # Rows already added by insert() must not be loaded twice
+                added += self._add_rows([row for row in rows if row[0] not in self._inserted_ids])
+                self.last_synced_id = max(self.last_synced_id, last_id)
+                self._inserted_ids = {pk for pk in self._inserted_ids if pk > self.last_synced_id}
+            added += self._sync_late_rows(batch_size)
+
+            now = time.monotonic()
+            if self.last_reconciled_at is None or now - self.last_reconciled_at >= self.reconcile_interval:
+                added += self.reconcile(batch_size)[0]
+            self.last_synced_at = now
+        return added
+
+    def _add_rows(self, rows):
+        """Add (id, vector, encoding, scale, ...) rows; return how many fit the matrix"""
+        if not rows:
+            return 0
+        if self.dimension is None:
+            self.dimension = len(rows[0][1]) // ENCODINGS[rows[0][2]].itemsize
+        # Rows from another embedding size cannot share the matrix
+        fitting = [row for row in rows if len(row[1]) == self.dimension * ENCODINGS[row[2]].itemsize]
+        self._skipped.update(row[0] for row in rows if len(row[1]) != self.dimension * ENCODINGS[row[2]].itemsize)
+        for encoding in {row[2] for row in fitting}:
+            group = [row for row in fitting if row[2] == encoding]
+            ids = np.fromiter((row[0] for row in group), dtype=np.int64, count=len(group))
+            codes = np.frombuffer(
+                b''.join(bytes(row[1]) for row in group), dtype=ENCODINGS[encoding]
+            ).reshape(len(group), self.dimension)
+            scales = [row[3] for row in group] if encoding == 'int8' else None
+            self.add(ids, dequantize(codes, encoding, scales) if encoding != 'float32' else codes)
+        return len(fitting)
+
+    def _missing(self, ids):
+        """Return the ids neither in the index nor skipped"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self._skipped:
+            ids = ids[~np.isin(ids, np.fromiter(self._skipped, dtype=np.int64))]
+        return ids[~np.isin(ids, self._ids[:self._size])] if self._size else ids
+
+    def _load(self, ids, batch_size):
+        added = 0
+        for start in range(0, len(ids), batch_size):
+            chunk = [int(pk) for pk in ids[start:start + batch_size]]
+            added += self._add_rows(list(
+                self._rows().filter(id__in=chunk).values_list('id', 'vector', 'encoding', 'scale')
+            ))
+        return added
+
+    def _sync_late_rows(self, batch_size):
+        """Load rows below the id cursor that were committed after it passed them"""
+        if self._synced_created_at is None:
+            return 0
+        recent = self._rows().filter(
+            id__lte=self.last_synced_id,
+            created_at__gte=self._synced_created_at - timedelta(seconds=self.overlap_seconds)
+        ).values_list('id', flat=True)
+        missing = self._missing(list(recent))
+        return self._load(missing, batch_size) if len(missing) else 0
+
+    def reconcile(self, batch_size=10000):
+        """Compare the index with the database ids, dropping deleted rows and loading missed ones
+
+        Only reads every id when the row counts disagree. Returns (added, removed).
+        """
+        with self._lock:
+            self.last_reconciled_at = time.monotonic()
+            count = self._rows().filter(id__lte=self.last_synced_id).count()
+            in_index = int(np.count_nonzero(self._ids[:self._size] <= self.last_synced_id))
+            if count == in_index + len(self._skipped):
+                return 0, 0
+            stored = np.fromiter(
+                self._rows().filter(id__lte=self.last_synced_id).values_list('id', flat=True).iterator(chunk_size=50000),
+                dtype=np.int64
+            )
+            present = self._ids[:self._size][self._ids[:self._size] <= self.last_synced_id]
+            removed = self.remove(present[~np.isin(present, stored)])
+            self._skipped.intersection_update(stored.tolist())
+            added = self._load(self._missing(stored), batch_size)
+            return added, removed
+
+    def search(self, query, k=5, distance_metric='cosine'):
+        """Return the k nearest rows as a list of (embedding_id, distance), closest first"""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        with self._lock:
+            size = self._size
+            if size == 0:
+                return []
+            if query.shape[0] != self.dimension:
+                raise ValueError(
+                    f"Query has dimension {query.shape[0]}, index holds {self.dimension}"
+                )
+
+            positions = self._candidate_positions(query, k)
+            # Exact scores, or approximate ones to re-rank with a quantized matrix
+            similarities = self._scores(query, positions)
+            count = len(similarities)
+            if count == 0:
+                return []
+
+            shortlist = min(count, k if self.quantization is None else k * self.rerank_factor)
+            top = np.argpartition(similarities, count - shortlist)[count - shortlist:]
+            top = top[np.argsort(-similarities[top])]
+            rows = top if positions is None else positions[top]
+            matches = [(int(self._ids[row]), float(similarities[i])) for row, i in zip(rows, top)]
+
+        if self.quantization is not None:
+            # Outside the lock: this reads the database
+            matches = self._rerank(query, matches)
+        return [
+            (embedding_id, similarity_to_distance(similarity, distance_metric))
+            for embedding_id, similarity in matches[:k]
+        ]
+
+    def _scores(self, query, positions=None):
+        """Return the similarity of the query to every row, or to the rows at positions"""
+        if self.quantization is None:
+            return (self._vectors[:self._size] if positions is None else self._vectors[positions]) @ query
+        count = self._size if positions is None else len(positions)
+        similarities = np.empty(count, dtype=np.float32)
+        # Decoded a chunk at a time so no full float32 copy of the matrix is made
+        for start in range(0, count, self.SCORE_CHUNK_ROWS):
+            end = min(start + self.SCORE_CHUNK_ROWS, count)
+            rows = slice(start, end) if positions is None else positions[start:end]
+            similarities[start:end] = self._vectors[rows].astype(np.float32) @ query
+            if self._scales is not None:
+                # (codes * scale) . query == (codes . query) * scale
+                similarities[start:end] *= self._scales[rows]
+        return similarities
+
+    def _dense(self, rows):
+        """Return the rows selected by a slice or position array as float32"""
+        return self._decode(self._vectors, self._scales, rows)
+
+    def _decode(self, vectors, scales, rows):
+        if self.quantization is None:
+            return vectors[rows]
+        return dequantize(vectors[rows], self.quantization, scales[rows] if scales is not None else None)
+
+    def _rerank(self, query, matches):
+        """Re-score (embedding_id, similarity) candidates against their stored vectors"""
+        stored = self._stored_vectors([embedding_id for embedding_id, _ in matches])
+        rescored = []
+        for embedding_id, similarity in matches:
+            vector = stored.get(embedding_id)
+            if vector is not None:
+                norm = np.linalg.norm(vector)
+                similarity = float(vector @ query / norm) if norm else 0.0
+            rescored.append((embedding_id, similarity))
+        rescored.sort(key=lambda match: -match[1])
+        return rescored
+
+    def _stored_vectors(self, embedding_ids):
+        """Return {embedding_id: float32 vector} for the rows still in the database"""
+        rows = FaceEmbedding.objects.filter(id__in=embedding_ids).values_list('id', 'vector', 'encoding', 'scale')
+        return {
+            pk: decode_vector(bytes(vector), encoding, scale)
+            for pk, vector, encoding, scale in rows if vector is not None
+        }
+
+    def rows(self):
+        """Return (ids, vectors) over the rows currently in the index; vectors are decoded copies when quantized"""
+        with self._lock:
+            if self._vectors is None:
+                return self._ids[:0], np.empty((0, self.dimension or 0), dtype=np.float32)
+            return self._ids[:self._size], self._dense(slice(0, self._size))
+
+    def _candidate_positions(self, query, k):
+        """Return the row positions worth scoring for a query, or None for all rows"""
+        return None
+
+    def rebuild(self):
+        """Drop everything and reload from the database"""
+        with self._lock:
+            self._size = 0
+            self._inserted_ids = set()
+            self._synced_created_at = None
+            self._skipped = set()
+            self.last_synced_id = 0
+            self.last_reconciled_at = None
+            return self.sync()
+
+    def stats(self):
+        """Return a summary of the index"""
+        return {
+            'backend': type(self).__name__,
+            'size': self._size,
+            'dimension': self.dimension,
+            'last_synced_id': self.last_synced_id,
+            'quantization': self.quantization or 'float32',
+            'bytes_per_vector': bytes_per_vector(self.dimension, self.quantization or 'float32') if self.dimension else None,
+        }
+
+
+class IVFIndex(EmbeddingIndex):
+    """Inverted-file index: coarse k-means clusters over the exact matrix
+
+    A query scores the nlist centroids, then only the rows in the nprobe
+    closest clusters are scored exactly. Raising nprobe trades speed for
+    recall. Until train_min rows exist the index answers with exact search.
+    Rows added after the last clustering are kept in an unclustered tail
+    that is always scanned, and are assigned to clusters once the tail
+    grows past reassign_fraction of the index.
+
+    sync() only decides that clustering is due. With background=True
+    (the default) k-means and the assignment pass then run on a separate
+    thread over a snapshot of the matrix, without holding the index lock,
+    so searches keep being answered from the previous clusters; the new
+    centroids and inverted lists are swapped in under the lock at the end.
+    """
+
+    def __init__(self, model_name, dimension=None, initial_capacity=1024, nlist=1024,
+                 nprobe=16, train_min=20000, train_sample=100000, kmeans_iterations=10,
+                 reassign_fraction=0.05, retrain_growth=4.0, quantization=None, rerank_factor=4,
+                 background=True, overlap_seconds=60.0, reconcile_interval=60.0):
+        super().__init__(model_name, dimension=dimension, initial_capacity=initial_capacity,
+                         quantization=quantization, rerank_factor=rerank_factor,
+                         overlap_seconds=overlap_seconds, reconcile_interval=reconcile_interval)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_min = train_min
+        self.train_sample = train_sample
+        self.kmeans_iterations = kmeans_iterations
+        self.reassign_fraction = reassign_fraction
+        self.retrain_growth = retrain_growth
+        self.background = background
+        self._centroids = None
+        self._trained_size = 0
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._list_order = None
+        self._list_offsets = None
+        # Bumped by rebuild() and remove() so clustering of a stale matrix is not swapped in
+        self._generation = 0
+        self._maintenance = None
+
+    def train(self):
+        """Cluster the current rows with spherical k-means and rebuild the inverted lists
+
+        Runs on the calling thread; the index lock is only held to take a
+        snapshot and to swap in the result.
+        """
+        return self._apply(self._cluster(retrain=True))
+
+    def _snapshot(self):
+        # Rows below _size are never written again: add() appends past them and
+        # _reserve() copies into a new array, so the snapshot arrays stay valid
+        with self._lock:
+            return (self._generation, self._size, self._vectors, self._scales,
+                    self._centroids, self._assignments)
+
+    def _cluster(self, retrain):
+        """Compute new clusters (or assign the tail to the current ones) from a snapshot, lock-free"""
+        generation, size, vectors, scales, centroids, assignments = self._snapshot()
+        trained_size = None
+        if retrain or centroids is None:
+            centroids = self._kmeans(vectors, scales, size)
+            assignments = np.empty(0, dtype=np.int32)
+            trained_size = size
+
+        assigned = len(assignments)
+        if assigned < size:
+            tail = np.empty(size - assigned, dtype=np.int32)
+            for start in range(assigned, size, self.SCORE_CHUNK_ROWS):
+                end = min(start + self.SCORE_CHUNK_ROWS, size)
+                tail[start - assigned:end - assigned] = self._nearest_centroids(
+                    self._decode(vectors, scales, slice(start, end)), centroids
+                )
+            assignments = np.concatenate([assignments, tail])
+        list_order, list_offsets = self._inverted_lists(assignments, len(centroids))
+        return generation, trained_size, centroids, assignments, list_order, list_offsets
+
+    @staticmethod
+    def _inverted_lists(assignments, nlist):
+        list_order = np.argsort(assignments, kind='stable').astype(np.int64)
+        counts = np.bincount(assignments, minlength=nlist)
+        return list_order, np.concatenate([[0], np.cumsum(counts)])
+
+    def _apply(self, clustering):
+        """Swap in the result of _cluster(); return False if the index was rebuilt meanwhile"""
+        generation, trained_size, centroids, assignments, list_order, list_offsets = clustering
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._centroids = centroids
+            self._assignments = assignments
+            self._list_order = list_order
+            self._list_offsets = list_offsets
+            if trained_size is not None:
+                self._trained_size = trained_size
+        return True
+
+    def _kmeans(self, vectors, scales, size):
+        nlist = min(self.nlist, max(1, size // 39))
+        rng = np.random.default_rng(0)
+        sample_size = min(size, max(self.train_sample, nlist * 39))
+        sample = self._decode(vectors, scales, rng.choice(size, sample_size, replace=False))
+
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            labels = self._nearest_centroids(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Re-seed empty clusters from random sample rows
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            centroids = (sums / norms).astype(np.float32)
+        return centroids
+
+    def _nearest_centroids(self, vectors, centroids, chunk_size=16384):
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            labels[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+        return labels
+
+    def sync(self, batch_size=10000):
+        with self._lock:
+            added = super().sync(batch_size=batch_size)
+            retrain = self._maintenance_due()
+            if retrain is not None and self.background:
+                self._maintenance = threading.Thread(
+                    target=self._maintain, args=(retrain,), name='ivf-maintenance', daemon=True
+                )
+                self._maintenance.start()
+        if retrain is not None and not self.background:
+            self._maintain(retrain)
+        return added
+
+    def _maintenance_due(self):
+        """Return True to retrain, False to assign the tail, or None when nothing is due"""
+        if self._size < self.train_min:
+            return None
+        if self._maintenance is not None and self._maintenance.is_alive():
+            return None
+        if self._centroids is None or self._size >= self._trained_size * self.retrain_growth:
+            return True
+        if self._size - len(self._assignments) > self._size * self.reassign_fraction:
+            return False
+        return None
+
+    def _maintain(self, retrain):
+        try:
+            self._apply(self._cluster(retrain))
+        except Exception as e:
+            print(f"Error clustering the face index: {e}")
+
+    def wait_for_maintenance(self, timeout=None):
+        """Block until a background clustering pass, if any, has finished"""
+        maintenance = self._maintenance
+        if maintenance is not None:
+            maintenance.join(timeout)
+
+    def _candidate_positions(self, query, k):
+        if self._centroids is None:
+            return None
+
+        nprobe = min(self.nprobe, len(self._centroids))
+        centroid_scores = self._centroids @ query
+        probe = np.argpartition(centroid_scores, len(centroid_scores) - nprobe)[-nprobe:]
+        candidates = [
+            self._list_order[self._list_offsets[c]:self._list_offsets[c + 1]] for c in probe
+        ]
+        # Rows added since the last assignment are always scanned
+        candidates.append(np.arange(len(self._assignments), self._size, dtype=np.int64))
+        return np.concatenate(candidates)
+
+    def _compacted(self, keep):
+        # Row positions shift, so a clustering pass over the old matrix is discarded
+        self._generation += 1
+        if self._centroids is not None:
+            self._assignments = self._assignments[keep[:len(self._assignments)]]
+            self._list_order, self._list_offsets = self._inverted_lists(self._assignments, len(self._centroids))
+
+    def rebuild(self):
+        with self._lock:
+            self._generation += 1
+            self._centroids = None
+            self._trained_size = 0
+            self._assignments = np.empty(0, dtype=np.int32)
+            return super().rebuild()
+
+    def stats(self):
+        summary = super().stats()
+        summary.update({
+            'nlist': len(self._centroids) if self._centroids is not None else 0,
+            'nprobe': self.nprobe,
+            'trained_size': self._trained_size,
+            'clustering': self._maintenance is not None and self._maintenance.is_alive(),
+        })
+        return summary
+
+
+def similarity_to_distance(similarity, distance_metric):
+    """Convert a cosine similarity between unit vectors to the configured distance"""
+    if distance_metric == 'euclidean_l2':
+        return float(np.sqrt(max(0.0, 2.0 - 2.0 * similarity)))
+    return 1.0 - similarity
+
+
+def build_index(backend=None, **options):
+    """Instantiate the index class named in FACE_INDEX['backend']"""
+    config = settings.FACE_INDEX
+    index_class = import_string(backend or config.get('backend', 'verification.vector_index.EmbeddingIndex'))
+    return index_class(model_name=get_model_name(), **{**config.get('options', {}), **options})
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Return the process-wide index, syncing new rows at most once per sync_interval"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_index()
+
+    sync_interval = settings.FACE_INDEX.get('sync_interval', 1.0)
+    last_synced_at = _index.last_synced_at
+    if last_synced_at is None or time.monotonic() - last_synced_at >= sync_interval:
+        _index.sync()
+    return _index
+
+
+def get_loaded_index():
+    """Return the process-wide index if this process has built one"""
+    return _index
@@ -1,14 +1,20 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.cache import get_conditional_response
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.conf import settings
-import os
 import json
-import base64
-import uuid
-from datetime import datetime
-from .utils import verify_owner, get_face_embedding
+from .services import (
+    verify_and_record,
+    store_capture,
+    store_upload,
+    get_face_embedding,
+    embedding_validators,
+    set_embedding_validators
+)
+from .imaging import decode_base64_image
+from .metrics import render_all
 from .models import FaceEmbedding, VerificationRecord
 
 def index(request):
@@ -26,28 +32,13 @@ def capture_image(request):
         if not image_data:
             return JsonResponse({'error': 'No image data received'}, status=400)
         
-        # Remove data URL prefix
-        if image_data.startswith('data:image'):
-            image_data = image_data.split(',')[1]
-        
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        
-        # Generate unique filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"capture_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
-        filepath = os.path.join(settings.CAPTURES_FOLDER, filename)
-        
-        # Save image
-        with open(filepath, 'wb') as f:
-            f.write(image_bytes)
+        # Decode base64 image, with or without a data URL prefix
+        image_bytes = decode_base64_image(image_data)
         
-        return JsonResponse({
-            'success': True,
-            'filename': filename,
-            'filepath': filepath
-        })
+        return JsonResponse({'success': True, **store_capture(image_bytes)})
     
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -63,54 +54,17 @@ def verify_faces(request):
         if not known_image or not new_image:
             return JsonResponse({'error': 'Both images are required'}, status=400)
         
-        # Save uploaded images temporarily
-        known_path = os.path.join(settings.UPLOAD_FOLDER, 'known_temp.jpg')
-        new_path = os.path.join(settings.UPLOAD_FOLDER, 'new_temp.jpg')
-        
-        # Decode and save known image
-        if known_image.startswith('data:image'):
-            known_image = known_image.split(',')[1]
-        with open(known_path, 'wb') as f:
-            f.write(base64.b64decode(known_image))
-        
-        # Decode and save new image
-        if new_image.startswith('data:image'):
-            new_image = new_image.split(',')[1]
-        with open(new_path, 'wb') as f:
-            f.write(base64.b64decode(new_image))
-        
-        # Perform verification
-        is_verified = verify_owner(known_path, new_path)
-        
-        # Get face embedding if verified
-        embedding = None
-        embedding_obj = None
-        if is_verified:
-            embedding = get_face_embedding(new_path)
-            if embedding:
-                # Save embedding to database
-                embedding_obj = FaceEmbedding.objects.create(embedding_data=embedding)
-        
-        # Create verification record
-        VerificationRecord.objects.create(
-            known_image_path=known_path,
-            new_image_path=new_path,
-            is_verified=is_verified,
-            embedding=embedding_obj
-        )
+        # Decode both images in memory; nothing is written to disk
+        known_bytes = decode_base64_image(known_image)
+        new_bytes = decode_base64_image(new_image)
         
-        # Clean up temporary files
-        for temp_file in [known_path, new_path]:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+        # Perform verification and store the attempt
+        outcome = verify_and_record(known_bytes, new_bytes)
         
-        return JsonResponse({
-            'success': True,
-            'verified': is_verified,
-            'embedding_saved': embedding is not None,
-            'message': 'Verification successful!' if is_verified else 'Verification failed - faces do not match'
-        })
+        return JsonResponse({'success': True, **outcome})
     
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -133,42 +87,75 @@ def upload_file(request):
         if file_extension not in allowed_extensions:
             return JsonResponse({'error': 'Invalid file type'}, status=400)
         
-        # Generate unique filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{file.name}"
-        filepath = os.path.join(settings.UPLOAD_FOLDER, filename)
-        
-        # Save file
-        with open(filepath, 'wb+') as destination:
-            for chunk in file.chunks():
-                destination.write(chunk)
-        
-        return JsonResponse({
-            'success': True,
-            'filename': filename,
-            'filepath': filepath
-        })
+        return JsonResponse({'success': True, **store_upload(file)})
     
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 @require_http_methods(["GET"])
-def get_embeddings(request):
-    """Get the latest face embedding"""
+def get_embeddings(request, embedding_id=None):
+    """Get a face embedding by id, or the latest one
+    
+    ?format=base64 packs the vector as base64 float32 and ?format=binary
+    returns the raw bytes; conditional GETs are answered with 304.
+    """
+    representation = request.GET.get('format', 'json')
+    if representation not in ('json', 'base64', 'binary'):
+        return JsonResponse({'error': 'format must be json, base64 or binary'}, status=400)
+    
     try:
-        # Get the most recent embedding
-        latest_embedding = FaceEmbedding.objects.order_by('-created_at').first()
+        embedding = get_face_embedding(embedding_id)
         
-        if latest_embedding:
-            return JsonResponse({
-                'success': True, 
-                'embedding': latest_embedding.get_embedding()
-            })
-        else:
+        if embedding is None:
+            if embedding_id is not None:
+                return JsonResponse({'success': False, 'message': 'Embedding not found'}, status=404)
             return JsonResponse({
                 'success': False, 
                 'message': 'No embedding found'
             })
+        
+        etag, last_modified = embedding_validators(embedding, representation)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            if representation == 'binary':
+                response = HttpResponse(embedding.get_vector_bytes() or b'', content_type='application/octet-stream')
+                response['X-Embedding-Id'] = str(embedding.pk)
+                response['X-Embedding-Model'] = embedding.model_name
+                response['X-Embedding-Dimension'] = str(embedding.dimension)
+            elif representation == 'base64':
+                response = JsonResponse({
+                    'success': True,
+                    'embedding': {
+                        'id': embedding.pk,
+                        'model_name': embedding.model_name,
+                        'dimension': embedding.dimension,
+                        'embedding': embedding.get_vector_base64()
+                    }
+                })
+            else:
+                response = JsonResponse({
+                    'success': True, 
+                    'embedding': embedding.get_embedding()
+                })
+        return set_embedding_validators(response, etag, last_modified)
     
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """Expose the metrics in the Prometheus text format, to local scrapers only
+
+    The allowlist checks REMOTE_ADDR, the immediate peer. Behind a reverse
+    proxy on the same host that is the proxy's address for every client, so
+    requests the proxy marks as forwarded are refused; a proxy that adds no
+    forwarding header must not route /metrics at all.
+    """
+    config = settings.METRICS
+    if not config.get('enabled', True):
+        raise Http404
+    if request.META.get('REMOTE_ADDR') not in config.get('allowed_ips', ['127.0.0.1', '::1']):
+        return HttpResponseForbidden()
+    if any(header in request.META for header in ('HTTP_X_FORWARDED_FOR', 'HTTP_FORWARDED', 'HTTP_X_REAL_IP')):
+        return HttpResponseForbidden()
+    return HttpResponse(render_all(), content_type='text/plain; version=0.0.4; charset=utf-8')